@@ -0,0 +1,400 @@
+"""
+Offline benchmark suite for the ingestion and retrieval hot paths.
+
+Runs without network access: text comes from a synthetic corpus generator,
+the LLM is a mock with a fixed latency, and the embedding model is the
+locally cached sentence transformer (or a hashing embedder with --embedder
+hash, or when no model is available). Measures:
+
+- clean_text and chunk_text throughput of both document processors
+- embedding throughput by batch size, and concurrent single-query
+  embedding with and without micro-batching
+- vector store add and query latency against corpus size (Chroma when
+  installed, and the in-memory NumPy store)
+- end-to-end RAGPipeline.query latency percentiles per retrieval mode
+
+Results are written as JSON. --baseline compares against an earlier run and
+exits non-zero when a metric regressed by more than --tolerance.
+
+    python benchmarks/bench_suite.py --sizes 1000,10000,100000 --output bench.json
+    python benchmarks/bench_suite.py --baseline bench.json --tolerance 0.2
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC_DIR)
+
+from chunking import Chunker
+
+VOCABULARY = (
+    "commander member board selection officer report victim advocate installation program training "
+    "record review appointment authority responsibility request approval procedure requirement policy "
+    "eligibility evaluation promotion personnel unit squadron wing headquarters guidance compliance "
+    "notification investigation response coordinator support referral retention case restricted "
+    "unrestricted annual designated qualified ensure provide maintain complete submit forward determine"
+).split()
+IDENTIFIERS = ["AF Form 1168", "DD Form 2910", "AFSC 3F0X1", "DAFI 90-6001", "para 2.3.1", "AFI 36-2606"]
+
+def synthetic_words(count: int, rng: np.random.Generator) -> List[str]:
+    words = list(rng.choice(VOCABULARY, count))
+    # Sprinkle exact identifiers the way policy text cites forms and paragraphs
+    for position in rng.integers(0, count, max(1, count // 200)):
+        words[position] = str(rng.choice(IDENTIFIERS))
+    return words
+
+def synthetic_document(pages: int, words_per_page: int = 450, seed: int = 0) -> str:
+    """Text shaped like Tika output: headings, running headers and page footers."""
+    rng = np.random.default_rng(seed)
+    parts = []
+    for page in range(1, pages + 1):
+        parts.append(f"DAFMAN 36-2664 1 JUNE 2021\n\n")
+        parts.append(f"{page // 4 + 1}.{page % 4 + 1}. {' '.join(rng.choice(VOCABULARY, 3)).title()}.\n")
+        body = synthetic_words(words_per_page, rng)
+        for start in range(0, len(body), 15):
+            parts.append(" ".join(body[start:start + 15]) + "\n")
+        parts.append(f"\n\nPage {page} of {pages}\n\n")
+    return "".join(parts)
+
+def synthetic_chunks(count: int, words_per_chunk: int = 100, seed: int = 0) -> List[str]:
+    rng = np.random.default_rng(seed)
+    return [" ".join(synthetic_words(words_per_chunk, rng)) for _ in range(count)]
+
+def synthetic_embeddings(count: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors; embedding a million texts with the model would dominate the run."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, count // 50), dim)).astype(np.float32)
+    embeddings = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, 100000):
+        end = min(count, start + 100000)
+        block = centers[rng.integers(0, len(centers), end - start)]
+        block += 0.5 * rng.standard_normal(block.shape).astype(np.float32)
+        embeddings[start:end] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return embeddings
+
+class HashEmbedder:
+    """Deterministic bag-of-words hashing embedder, a stand-in when no model is cached locally."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                embeddings[row, zlib.crc32(word.encode("utf-8")) % self.dim] += 1.0
+        embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings[0] if single else embeddings
+
+class MockLLMClient:
+    """Stands in for LLMClient with a fixed generation latency."""
+
+    def __init__(self, latency_ms: float):
+        self.latency = latency_ms / 1000
+        self.base_url = "mock://llm"
+        self.model = "mock"
+
+    def chat(self, messages, temperature: float = 0.7, max_tokens: int = 512, **kwargs) -> str:
+        time.sleep(self.latency)
+        return "Mock answer based on the provided context."
+
+    def chat_stream(self, messages, temperature: float = 0.7, max_tokens: int = 512, **kwargs):
+        yield self.chat(messages)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"model": self.model}
+
+class InMemoryCollection:
+    """Just enough of a ChromaDB collection to back the NumPy store when chromadb is not installed."""
+
+    def __init__(self, ids, documents, metadatas, embeddings):
+        self.records = {"ids": ids, "documents": documents, "metadatas": metadatas, "embeddings": embeddings}
+
+    def count(self) -> int:
+        return len(self.records["ids"])
+
+    def get(self, include=None, **kwargs):
+        return dict(self.records)
+
+def latency_stats(seconds: List[float]) -> Dict[str, float]:
+    ms = np.asarray(seconds) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+    }
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def load_embedder(kind: str):
+    if kind == "hash":
+        return HashEmbedder(), "hash"
+    try:
+        from model_registry import get_embedding_model, EMBEDDING_BACKEND
+        model = get_embedding_model()
+        model.encode(["warm up"])
+        return model, f"model ({EMBEDDING_BACKEND})"
+    except Exception as e:
+        if kind == "model":
+            raise
+        print(f"Embedding model unavailable, using the hashing embedder: {e}", file=sys.stderr)
+        return HashEmbedder(), "hash"
+
+def bench_text_processing(pages: int, repeats: int) -> Dict[str, Any]:
+    text = synthetic_document(pages)
+    megabytes = len(text.encode("utf-8")) / 1e6
+    report = {"input_mb": round(megabytes, 3)}
+    for name, module in (("v2", "document_processor_v2"), ("v1", "document_processor")):
+        try:
+            processor_class = __import__(module).DocumentProcessor
+        except ImportError as e:
+            report[name] = {"skipped": f"cannot import {module}: {e}"}
+            continue
+        # Only the pure text methods are measured, so skip model and database setup
+        processor = processor_class.__new__(processor_class)
+        processor.chunker = Chunker()
+        clean_seconds, chunk_seconds, chunks = [], [], []
+        for _ in range(repeats):
+            cleaned, seconds = timed(processor.clean_text, text)
+            clean_seconds.append(seconds)
+            chunks, seconds = timed(processor.chunk_text, cleaned)
+            chunk_seconds.append(seconds)
+        report[name] = {
+            "clean_text_mb_per_second": round(megabytes / min(clean_seconds), 2),
+            "chunk_text_mb_per_second": round(megabytes / min(chunk_seconds), 2),
+            "chunk_text_chunks_per_second": round(len(chunks) / min(chunk_seconds), 1),
+            "chunks": len(chunks),
+            "max_chunk_tokens": max((c["metadata"]["token_count"] for c in chunks), default=0),
+        }
+    return report
+
+def bench_embedding(embedder, batch_sizes: List[int], texts: int, concurrency: int) -> Dict[str, Any]:
+    corpus = synthetic_chunks(texts, seed=1)
+    report = {}
+    for batch_size in batch_sizes:
+        _, seconds = timed(embedder.encode, corpus, batch_size=batch_size, show_progress_bar=False)
+        report[str(batch_size)] = {"texts_per_second": round(texts / seconds, 1)}
+    single = [timed(embedder.encode, text)[1] for text in corpus[:min(50, texts)]]
+    report["single_query"] = latency_stats(single)
+
+    # Request threads each embedding their own query, as under load
+    from embedding_batcher import EmbeddingBatcher
+    queries = synthetic_chunks(texts, words_per_chunk=12, seed=2)
+    batcher = EmbeddingBatcher(lambda batch: embedder.encode(batch, batch_size=len(batch), show_progress_bar=False))
+    for name, encode in (("concurrent_unbatched", embedder.encode), ("concurrent_batched", batcher.encode)):
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            start = time.perf_counter()
+            seconds = list(pool.map(lambda query: timed(encode, query)[1], queries))
+            elapsed = time.perf_counter() - start
+        report[name] = {"queries_per_second": round(len(queries) / elapsed, 1), **latency_stats(seconds)}
+    report["concurrent_batched"]["mean_batch_size"] = batcher.stats()["mean_batch_size"]
+    report["concurrency"] = concurrency
+    return report
+
+def bench_vector_stores(sizes: List[int], dim: int, queries: int, k: int) -> Dict[str, Any]:
+    from vector_store import NumpyVectorStore
+
+    report: Dict[str, Any] = {"numpy": {}, "chroma": {}}
+    try:
+        import chromadb
+    except ImportError:
+        chromadb = None
+        report["chroma"] = {"skipped": "chromadb is not installed"}
+
+    for size in sizes:
+        embeddings = synthetic_embeddings(size, dim)
+        ids = [f"chunk_{i}" for i in range(size)]
+        # Short placeholder texts keep memory flat at large sizes; only vectors matter here
+        documents = [f"synthetic chunk {i}" for i in range(size)]
+        # Publications of 1000 chunks each, so a search scoped to one should not slow down with size
+        metadatas = [{"source": f"doc_{i // 1000}", "section_id": str(i % 40)} for i in range(size)]
+        rng = np.random.default_rng(2)
+        probe = embeddings[rng.integers(0, size, queries)]
+
+        store, build_seconds = timed(NumpyVectorStore, ids, documents, metadatas, embeddings)
+        query_seconds = [timed(store.query, [q], k)[1] for q in probe]
+        scoped_seconds = [timed(store.query, [q], k, {"source": "doc_0"})[1] for q in probe]
+        report["numpy"][str(size)] = {
+            "build_vectors_per_second": round(size / build_seconds, 1),
+            "query": latency_stats(query_seconds),
+            "query_one_publication": latency_stats(scoped_seconds),
+        }
+        del store
+
+        if chromadb is None:
+            continue
+        with tempfile.TemporaryDirectory() as path:
+            collection = chromadb.PersistentClient(path=path).create_collection("benchmark")
+            add_start = time.perf_counter()
+            for start in range(0, size, 1000):
+                end = start + 1000
+                collection.add(ids=ids[start:end], documents=documents[start:end],
+                               metadatas=metadatas[start:end], embeddings=embeddings[start:end].tolist())
+            add_seconds = time.perf_counter() - add_start
+            query_seconds = [timed(collection.query, query_embeddings=[q.tolist()], n_results=k)[1] for q in probe]
+            report["chroma"][str(size)] = {
+                "add_vectors_per_second": round(size / add_seconds, 1),
+                "query": latency_stats(query_seconds),
+            }
+    return report
+
+def bench_pipeline(embedder, size: int, queries: int, llm_latency_ms: float, modes: List[str]) -> Dict[str, Any]:
+    try:
+        import rag_pipeline
+        from lexical_index import BM25Index
+        from vector_store import NumpyVectorStore
+    except ImportError as e:
+        return {"skipped": f"cannot import the pipeline: {e}"}
+
+    documents = synthetic_chunks(size, seed=3)
+    ids = [f"chunk_{i}" for i in range(size)]
+    metadatas = [{"source": "synthetic", "chunk_id": i, "section_id": str(i % 40)} for i in range(size)]
+    embeddings = np.asarray(embedder.encode(documents, batch_size=128), dtype=np.float32)
+    collection = InMemoryCollection(ids, documents, metadatas, embeddings)
+
+    with tempfile.TemporaryDirectory() as path:
+        lexical_path = os.path.join(path, "bm25_index.npz")
+        BM25Index.build(ids, documents, metadatas).save(lexical_path)
+
+        # One section per section_id, embedded as the mean of its chunks, so toc routing has work to do
+        section_ids = sorted({m["section_id"] for m in metadatas})
+        section_rows = np.array([int(m["section_id"]) for m in metadatas])
+        section_embeddings = np.stack([embeddings[section_rows == int(s)].mean(axis=0) for s in section_ids])
+        sections = InMemoryCollection(section_ids, [f"Section {s}" for s in section_ids],
+                                      [{"source": "synthetic", "section_id": s} for s in section_ids], section_embeddings)
+
+        # Wire the pipeline to the synthetic corpus, the embedder and the mock LLM
+        original_load = rag_pipeline.RAGPipeline.load_pipeline
+
+        def load_pipeline(pipeline):
+            pipeline.embedding_model = embedder
+            pipeline.collection = collection
+            pipeline.vector_store = NumpyVectorStore.from_collection(collection)
+            pipeline.section_store = NumpyVectorStore.from_collection(sections)
+            pipeline.lexical_index = BM25Index.load(lexical_path)
+            pipeline.llm_client = MockLLMClient(llm_latency_ms)
+            pipeline.is_ready = True
+
+        rag_pipeline.RAGPipeline.load_pipeline = load_pipeline
+        try:
+            pipeline = rag_pipeline.RAGPipeline()
+        finally:
+            rag_pipeline.RAGPipeline.load_pipeline = original_load
+        # Every query is new, so the cache would only add its lookup cost
+        pipeline.answer_cache = None
+
+        probes = synthetic_chunks(queries, words_per_chunk=12, seed=4)
+        report = {"corpus_size": size, "llm_latency_ms": llm_latency_ms}
+        for mode in modes:
+            seconds = [timed(pipeline.query, probe, 5, mode)[1] for probe in probes]
+            stats = latency_stats(seconds)
+            stats["overhead_p50_ms"] = round(stats["p50_ms"] - llm_latency_ms, 3)
+            report[mode] = stats
+    return report
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=SRC_DIR, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, path: str = "") -> List[str]:
+    """List metrics that got worse than the baseline by more than `tolerance` (a fraction)."""
+    regressions = []
+    for key, value in report.items():
+        if key == "meta" or key not in baseline:
+            continue
+        name = f"{path}.{key}" if path else key
+        old = baseline[key]
+        if isinstance(value, dict) and isinstance(old, dict):
+            regressions.extend(compare(value, old, tolerance, name))
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old > 0:
+            if key.endswith("_ms") and value > old * (1 + tolerance):
+                regressions.append(f"{name}: {old} -> {value} (slower)")
+            elif key.endswith("_per_second") and value < old * (1 - tolerance):
+                regressions.append(f"{name}: {old} -> {value} (lower throughput)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000", help="Comma-separated corpus sizes for the vector store runs, up to 1000000")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=200, help="Pages of synthetic text for clean_text/chunk_text")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--embedder", choices=("auto", "model", "hash"), default="auto")
+    parser.add_argument("--batch-sizes", default="1,8,32,128")
+    parser.add_argument("--embed-texts", type=int, default=512)
+    parser.add_argument("--embed-concurrency", type=int, default=8, help="Threads embedding single queries at once")
+    parser.add_argument("--pipeline-size", type=int, default=2000)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--modes", default="flat,toc,hybrid")
+    parser.add_argument("--skip", default="", help="Comma-separated sections to skip: text,embedding,vector_store,pipeline")
+    parser.add_argument("--output", help="Write results JSON here instead of stdout")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    skip = set(filter(None, args.skip.split(",")))
+    embedder, embedder_name = load_embedder(args.embedder)
+    report: Dict[str, Any] = {"meta": {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "embedder": embedder_name,
+        "args": vars(args),
+    }}
+
+    if "text" not in skip:
+        report["text_processing"] = bench_text_processing(args.pages, args.repeats)
+    if "embedding" not in skip:
+        batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+        report["embedding"] = bench_embedding(embedder, batch_sizes, args.embed_texts, args.embed_concurrency)
+    if "vector_store" not in skip:
+        sizes = [int(s) for s in args.sizes.split(",")]
+        report["vector_store"] = bench_vector_stores(sizes, args.dim, args.queries, args.k)
+    if "pipeline" not in skip:
+        report["pipeline"] = bench_pipeline(embedder, args.pipeline_size, args.queries,
+                                            args.llm_latency_ms, args.modes.split(","))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(report, baseline, args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    if report.get("regressions"):
+        print(f"{len(report['regressions'])} metrics regressed beyond {args.tolerance:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Compare the in-memory NumPy vector store with ChromaDB on latency and recall.
+
+Uses synthetic unit vectors shaped like MiniLM embeddings (384-d). Exact
+float32 NumPy search is the ground truth for recall@k.
+
+    python benchmarks/bench_vector_store.py --corpus-size 5000 --queries 200
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from vector_store import NumpyVectorStore
+
+def synthetic_corpus(size: int, dim: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # Clustered vectors are closer to real embeddings than uniform noise
+    centers = rng.standard_normal((max(1, size // 50), dim)).astype(np.float32)
+    embeddings = centers[rng.integers(0, len(centers), size)] + 0.5 * rng.standard_normal((size, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    ids = [f"chunk_{i}" for i in range(size)]
+    documents = [f"synthetic chunk {i}" for i in range(size)]
+    metadatas = [{"source": f"doc_{i % 10}", "section_id": str(i % 40)} for i in range(size)]
+    return ids, documents, metadatas, embeddings
+
+def time_queries(store, queries: np.ndarray, k: int, where=None, batch: bool = False):
+    latencies = []
+    results = []
+    if batch:
+        start = time.perf_counter()
+        out = store.query(queries, n_results=k, where=where)
+        latencies.append((time.perf_counter() - start) / len(queries))
+        results = out["ids"]
+    else:
+        for query in queries:
+            start = time.perf_counter()
+            out = store.query([query], n_results=k, where=where)
+            latencies.append(time.perf_counter() - start)
+            results.append(out["ids"][0])
+    latencies_ms = np.array(latencies) * 1000
+    return results, {
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "mean_ms": round(float(latencies_ms.mean()), 3),
+    }
+
+def recall(results, truth) -> float:
+    hits = sum(len(set(r) & set(t)) for r, t in zip(results, truth))
+    return round(hits / sum(len(t) for t in truth), 4)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus-size", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--output", help="Write results JSON here instead of stdout")
+    args = parser.parse_args()
+
+    ids, documents, metadatas, embeddings = synthetic_corpus(args.corpus_size, args.dim)
+    rng = np.random.default_rng(1)
+    queries = embeddings[rng.integers(0, len(embeddings), args.queries)] + 0.3 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    where = {"section_id": {"$in": ["1", "2", "3"]}}
+
+    report = {"corpus_size": args.corpus_size, "queries": args.queries, "dim": args.dim, "k": args.k, "backends": {}}
+
+    exact = NumpyVectorStore(ids, documents, metadatas, embeddings)
+    truth, _ = time_queries(exact, queries, args.k)
+    truth_filtered, _ = time_queries(exact, queries, args.k, where)
+
+    with tempfile.TemporaryDirectory() as path:
+        NumpyVectorStore(ids, documents, metadatas, embeddings, dtype="float16").save(path)
+        stores = {
+            "numpy_float32": exact,
+            "numpy_float16": NumpyVectorStore(ids, documents, metadatas, embeddings, dtype="float16"),
+            "numpy_float16_mmap": NumpyVectorStore.load(path),
+        }
+        for name, store in stores.items():
+            results, latency = time_queries(store, queries, args.k)
+            filtered, filtered_latency = time_queries(store, queries, args.k, where)
+            _, batch_latency = time_queries(store, queries, args.k, batch=True)
+            report["backends"][name] = {
+                "latency": latency,
+                "filtered_latency": filtered_latency,
+                "batched_latency_per_query": batch_latency,
+                "recall_at_k": recall(results, truth),
+                "filtered_recall_at_k": recall(filtered, truth_filtered),
+            }
+
+    try:
+        import chromadb
+        from vector_store import ChromaVectorStore
+    except ImportError:
+        report["backends"]["chroma"] = {"skipped": "chromadb is not installed"}
+    else:
+        with tempfile.TemporaryDirectory() as path:
+            collection = chromadb.PersistentClient(path=path).create_collection("benchmark")
+            for start in range(0, len(ids), 1000):
+                collection.add(ids=ids[start:start + 1000], documents=documents[start:start + 1000],
+                               metadatas=metadatas[start:start + 1000], embeddings=embeddings[start:start + 1000].tolist())
+            store = ChromaVectorStore(collection)
+            results, latency = time_queries(store, queries, args.k)
+            filtered, filtered_latency = time_queries(store, queries, args.k, where)
+            report["backends"]["chroma"] = {
+                "latency": latency,
+                "filtered_latency": filtered_latency,
+                "recall_at_k": recall(results, truth),
+                "filtered_recall_at_k": recall(filtered, truth_filtered),
+            }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
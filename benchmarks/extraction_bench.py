@@ -0,0 +1,126 @@
+"""
+Compare PDF extraction backends on throughput and text parity.
+
+Extracts a PDF (dafman36-2664.pdf by default) with every extractor, without
+the cache, and reports pages per second. It then times a second run served
+from the extraction cache. Each page is compared with the reference
+extractor's text of the same page: the similarity of the word sequences,
+ignoring punctuation and whitespace. The script also reports the word
+overlap of the whole document. Extractors that cannot run here (Tika
+without Java) are reported and skipped. Exits non-zero when an extractor's
+mean page similarity is below --min-parity.
+
+    python benchmarks/extraction_bench.py --extractors tika,pypdf --output extraction.json
+"""
+
+import argparse
+import difflib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from pdf_extraction import EXTRACTORS, iter_pages
+
+WORD_PATTERN = re.compile(r"\w+")
+
+def words(text: str):
+    return WORD_PATTERN.findall(text.lower())
+
+def extract(pdf_path: str, extractor: str, cache_dir: str, workers: int, pages_per_task: int):
+    start = time.perf_counter()
+    pages = [text for _, text in iter_pages(pdf_path, pages_per_task, workers, extractor=extractor, cache_dir=cache_dir)]
+    return pages, time.perf_counter() - start
+
+def page_similarity(reference: str, candidate: str) -> float:
+    reference, candidate = words(reference), words(candidate)
+    if not reference and not candidate:
+        return 1.0
+    return difflib.SequenceMatcher(None, reference, candidate, autojunk=False).ratio()
+
+def word_overlap(reference: str, candidate: str) -> float:
+    """F1 of the two documents' word multisets."""
+    reference, candidate = Counter(words(reference)), Counter(words(candidate))
+    common = sum((reference & candidate).values())
+    total = sum(reference.values()) + sum(candidate.values())
+    return 2 * common / total if total else 1.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", default=os.path.join(ROOT_DIR, "dafman36-2664.pdf"))
+    parser.add_argument("--extractors", default=",".join(EXTRACTORS), help="Comma-separated extractor names")
+    parser.add_argument("--reference", default="tika", help="Extractor the others are compared with")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes (defaults to the CPU count)")
+    parser.add_argument("--pages-per-task", type=int, default=None)
+    parser.add_argument("--min-parity", type=float, default=0.9, help="Minimum mean page similarity")
+    parser.add_argument("--worst", type=int, default=5, help="Least similar pages to report")
+    parser.add_argument("--output", help="Write results JSON here instead of stdout")
+    args = parser.parse_args()
+
+    extracted = {}
+    results = {"pdf": args.pdf, "reference": args.reference, "extractors": {}}
+    for name in args.extractors.split(","):
+        try:
+            pages, seconds = extract(args.pdf, name, "", args.workers, args.pages_per_task)
+        except Exception as e:
+            print(f"Skipping {name}: {e}", file=sys.stderr)
+            results["extractors"][name] = {"error": str(e)}
+            continue
+        with tempfile.TemporaryDirectory() as cache_dir:
+            extract(args.pdf, name, cache_dir, args.workers, args.pages_per_task)
+            _, cached_seconds = extract(args.pdf, name, cache_dir, args.workers, args.pages_per_task)
+        extracted[name] = pages
+        characters = sum(len(text) for text in pages)
+        results["extractors"][name] = {
+            "pages": len(pages),
+            "characters": characters,
+            "words": sum(len(words(text)) for text in pages),
+            "empty_pages": sum(1 for text in pages if not text.strip()),
+            "seconds": round(seconds, 3),
+            "pages_per_second": round(len(pages) / seconds, 1) if seconds else None,
+            "cached_seconds": round(cached_seconds, 4),
+        }
+        print(f"{name}: {len(pages)} pages, {characters} characters in {seconds:.2f}s "
+              f"({len(pages) / seconds:.1f} pages/s), cached {cached_seconds * 1000:.1f} ms", file=sys.stderr)
+
+    failures = []
+    reference = extracted.get(args.reference)
+    if reference is None:
+        print(f"No parity check: reference extractor {args.reference} did not run", file=sys.stderr)
+    for name, pages in extracted.items():
+        if reference is None or name == args.reference:
+            continue
+        if len(pages) != len(reference):
+            failures.append(f"{name} extracted {len(pages)} pages, {args.reference} {len(reference)}")
+        similarities = [page_similarity(ref, text) for ref, text in zip(reference, pages)]
+        mean = sum(similarities) / len(similarities) if similarities else 1.0
+        worst = sorted(range(len(similarities)), key=lambda i: similarities[i])[:args.worst]
+        results["extractors"][name]["parity"] = {
+            "mean_page_similarity": round(mean, 4),
+            "min_page_similarity": round(min(similarities), 4) if similarities else 1.0,
+            "document_word_overlap": round(word_overlap("\n".join(reference), "\n".join(pages)), 4),
+            "least_similar_pages": {i + 1: round(similarities[i], 4) for i in worst},
+        }
+        print(f"{name} vs {args.reference}: mean page similarity {mean:.3f}", file=sys.stderr)
+        if mean < args.min_parity:
+            failures.append(f"{name} mean page similarity {mean:.3f} is below {args.min_parity}")
+    results["failures"] = failures
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
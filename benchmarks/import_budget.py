@@ -0,0 +1,126 @@
+"""
+Fail when the Flask app's startup time regresses.
+
+Imports `main` in fresh interpreters under `python -X importtime`, reports
+the slowest modules it imports, and times a first `/health` request. Exits
+non-zero when the import or boot time exceeds its budget, or when a heavy
+dependency (torch, chromadb, pandas, ...) is imported at boot instead of on
+the path that needs it.
+
+    python benchmarks/import_budget.py --budget-ms 500 --health-budget-ms 1000
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+# Only imported lazily: by the pipeline, the document processor or the embedding backends
+HEAVY_MODULES = ("torch", "sentence_transformers", "transformers", "chromadb", "pandas", "groq",
+                 "onnxruntime", "tika", "scipy", "sklearn")
+
+IMPORTTIME_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$")
+
+BOOT_SCRIPT = """
+import time
+start = time.perf_counter()
+import main
+response = main.app.test_client().get('/api/chatbot/health')
+print(response.status_code, (time.perf_counter() - start) * 1000)
+"""
+
+def boot_env():
+    env = dict(os.environ)
+    # Preloading deliberately loads the model at boot (see the Procfile)
+    env.pop("PRELOAD_MODELS", None)
+    return env
+
+def measure_imports():
+    """One `import main` under -X importtime: its ms, the ms of each module it imports directly, and every module imported."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=SRC_DIR,
+                            env=boot_env(), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import main failed:\n{result.stderr[-2000:]}")
+    import_ms = 0.0
+    direct = {}
+    children = {}
+    modules = set()
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if not match:
+            continue
+        cumulative_ms, indent, name = int(match.group(2)) / 1000, match.group(3), match.group(4)
+        modules.add(name)
+        # Imports are indented two spaces per level and listed before the module importing them
+        if len(indent) == 3:
+            children[name] = children.get(name, 0.0) + cumulative_ms
+        elif len(indent) == 1:
+            if name == "main":
+                import_ms, direct = cumulative_ms, children
+            children = {}
+    return import_ms, direct, modules
+
+def measure_boot():
+    """Milliseconds from a fresh interpreter to the first /health response."""
+    result = subprocess.run([sys.executable, "-c", BOOT_SCRIPT], cwd=SRC_DIR, env=boot_env(),
+                            capture_output=True, text=True)
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f"booting the app failed:\n{result.stderr[-2000:]}")
+    status, milliseconds = lines[-1].split()
+    if status != "200":
+        raise RuntimeError(f"/health returned {status}")
+    return float(milliseconds)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("RAG_IMPORT_BUDGET_MS", "500")),
+                        help="Maximum time to import the app")
+    parser.add_argument("--health-budget-ms", type=float,
+                        default=float(os.environ.get("RAG_BOOT_BUDGET_MS", "1000")),
+                        help="Maximum time from interpreter start to the first /health response")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, the fastest counts")
+    parser.add_argument("--top", type=int, default=10, help="Slowest direct imports of main to report")
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    runs = [measure_imports() for _ in range(args.repeat)]
+    import_ms, direct, modules = min(runs, key=lambda run: run[0])
+    boot_ms = min(measure_boot() for _ in range(args.repeat))
+    heavy = sorted(name for name in modules if name.split(".")[0] in HEAVY_MODULES)
+    heavy_roots = sorted({name.split(".")[0] for name in heavy})
+
+    print(f"import main: {import_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"boot to /health: {boot_ms:.1f} ms (budget {args.health_budget_ms:.0f} ms)")
+    print("slowest imports of main:")
+    for name, milliseconds in sorted(direct.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {milliseconds:8.1f} ms  {name}")
+
+    failures = []
+    if import_ms > args.budget_ms:
+        failures.append(f"importing the app took {import_ms:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+    if boot_ms > args.health_budget_ms:
+        failures.append(f"boot to /health took {boot_ms:.1f} ms, over the {args.health_budget_ms:.0f} ms budget")
+    if heavy_roots:
+        failures.append(f"heavy modules imported at boot: {', '.join(heavy_roots)}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "import_ms": round(import_ms, 3),
+                "boot_ms": round(boot_ms, 3),
+                "direct_imports_ms": {name: round(ms, 3) for name, ms in direct.items()},
+                "heavy_modules": heavy_roots,
+                "failures": failures,
+            }, f, indent=2)
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
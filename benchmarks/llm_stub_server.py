@@ -0,0 +1,153 @@
+"""
+Local OpenAI/Groq-compatible chat completions server for offline load tests.
+
+Serves POST /openai/v1/chat/completions and /v1/chat/completions, streamed
+or not, with configurable latency and injected failures. Point the pipeline
+at it with:
+
+    python benchmarks/llm_stub_server.py --port 8089 --latency-ms 400 --failure-rate 0.05
+    RAG_LLM_BASE_URL=http://127.0.0.1:8089/openai/v1 python src/main.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubConfig:
+    def __init__(self, args):
+        self.latency = args.latency_ms / 1000
+        self.jitter = args.jitter_ms / 1000
+        self.token_delay = args.token_delay_ms / 1000
+        self.failure_rate = args.failure_rate
+        self.failure_status = args.failure_status
+        self.hang_rate = args.hang_rate
+        self.rate_limit_rate = args.rate_limit_rate
+        self.answer_words = args.answer_words
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "failures": 0, "hangs": 0, "rate_limited": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def count(self, key: str, delta: int = 1):
+        with self.lock:
+            self.counts[key] += delta
+            if key == "in_flight":
+                self.counts["max_in_flight"] = max(self.counts["max_in_flight"], self.counts["in_flight"])
+
+def make_handler(config: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                with config.lock:
+                    self.send_json(200, dict(config.counts))
+            else:
+                self.send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_json(404, {"error": {"message": "not found"}})
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            config.count("requests")
+            config.count("in_flight")
+            try:
+                self.complete(body)
+            finally:
+                config.count("in_flight", -1)
+
+        def complete(self, body):
+            roll = random.random()
+            if roll < config.hang_rate:
+                # Simulate a provider that accepts the connection and never answers
+                config.count("hangs")
+                time.sleep(3600)
+                return
+            roll -= config.hang_rate
+            if roll < config.rate_limit_rate:
+                config.count("rate_limited")
+                self.send_json(429, {"error": {"message": "rate limited"}}, {"Retry-After": "1"})
+                return
+            roll -= config.rate_limit_rate
+            time.sleep(max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+            if roll < config.failure_rate:
+                config.count("failures")
+                self.send_json(config.failure_status, {"error": {"message": "injected failure"}})
+                return
+
+            question = body.get("messages", [{}])[-1].get("content", "")[:60]
+            words = f"Stub answer to: {question}".split()
+            words = (words * (config.answer_words // max(1, len(words)) + 1))[:config.answer_words]
+            model = body.get("model", "stub")
+            if body.get("stream"):
+                self.stream(words, model)
+            else:
+                self.send_json(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": len(json.dumps(body)) // 4, "completion_tokens": len(words)},
+                })
+
+        def stream(self, words, model):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, word in enumerate(words):
+                chunk = {"object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}}]}
+                self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                time.sleep(config.token_delay)
+            self.write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def write_chunk(self, text: str):
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def send_json(self, status: int, payload, headers=None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=300, help="Time before the first byte of an answer")
+    parser.add_argument("--jitter-ms", type=float, default=100, help="Uniform +/- jitter on the latency")
+    parser.add_argument("--token-delay-ms", type=float, default=10, help="Delay between streamed words")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests answered with --failure-status")
+    parser.add_argument("--failure-status", type=int, default=503)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered 429 with Retry-After")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Fraction of requests that never get an answer")
+    parser.add_argument("--answer-words", type=int, default=60)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(StubConfig(args)))
+    server.daemon_threads = True
+    print(f"LLM stub listening on http://{args.host}:{args.port}/openai/v1 (stats at /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Check that the int8 ONNX embedding backend retrieves the same chunks as PyTorch.
+
+Embeds a corpus (chunks from the ChromaDB index, or the built-in sample
+passages) and a query set with both backends, then compares each query's
+top-k chunks and the cosine similarity of the two embeddings. Exits non-zero
+when the mean top-k overlap is below --min-overlap.
+
+    python benchmarks/onnx_parity.py --k 5 --output onnx_parity.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from model_registry import DEFAULT_EMBEDDING_MODEL, get_embedding_model
+
+SAMPLE_PASSAGES = [
+    "Commanders ensure victims of sexual assault are offered a Sexual Assault Response Coordinator.",
+    "A restricted report allows a victim to confidentially disclose an assault without triggering an investigation.",
+    "An unrestricted report is forwarded to the chain of command and to law enforcement for investigation.",
+    "Victim advocates provide non-clinical crisis intervention, referrals and ongoing support.",
+    "The Sexual Assault Prevention and Response program office maintains case files and reports annually.",
+    "Healthcare personnel must notify the SARC when a victim seeks care without first contacting the SARC.",
+    "Expedited transfer requests are decided by the commander within five workdays.",
+    "Annual training covers bystander intervention, reporting options and available resources.",
+    "Collateral misconduct by the victim is addressed at the discretion of the commander.",
+    "Records of restricted reports are retained for fifty years in the defense case management system.",
+    "The installation SARC reports directly to the vice wing commander.",
+    "Civilian employees may receive advocacy services but have limited access to military medical care.",
+]
+
+DEFAULT_QUERIES = [
+    "What reporting options does a victim have?",
+    "Who does the SARC report to?",
+    "How long are restricted report records kept?",
+    "What does a victim advocate do?",
+    "How quickly must an expedited transfer be decided?",
+    "What happens with an unrestricted report?",
+    "What training is required every year?",
+    "Can civilians get advocacy support?",
+]
+
+def load_corpus(chroma_path: str, limit: int):
+    try:
+        from model_registry import get_chroma_client
+        collection = get_chroma_client(chroma_path).get_collection("dafman_documents")
+        documents = collection.get(limit=limit, include=["documents"])["documents"]
+    except Exception as e:
+        print(f"Using sample passages ({e})", file=sys.stderr)
+        return SAMPLE_PASSAGES
+    return documents or SAMPLE_PASSAGES
+
+def embed(model, texts, batch_size: int):
+    start = time.perf_counter()
+    embeddings = np.asarray(model.encode(texts, batch_size=batch_size, normalize_embeddings=True), dtype=np.float32)
+    return embeddings, time.perf_counter() - start
+
+def top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ corpus.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL)
+    parser.add_argument("--chroma-path", default="./chroma_db")
+    parser.add_argument("--corpus-limit", type=int, default=2000)
+    parser.add_argument("--queries-file", help="Text file with one query per line")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--min-overlap", type=float, default=0.8)
+    parser.add_argument("--output", help="Write results JSON here instead of stdout")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.chroma_path, args.corpus_limit)
+    queries = DEFAULT_QUERIES
+    if args.queries_file:
+        with open(args.queries_file, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    k = min(args.k, len(corpus))
+
+    report = {"model": args.model, "corpus_size": len(corpus), "queries": len(queries), "k": k, "backends": {}}
+    results = {}
+    for backend in ("torch", "onnx"):
+        start = time.perf_counter()
+        model = get_embedding_model(args.model, backend=backend)
+        load_seconds = time.perf_counter() - start
+        corpus_embeddings, corpus_seconds = embed(model, corpus, args.batch_size)
+        query_embeddings, _ = embed(model, queries, args.batch_size)
+        single_seconds = []
+        for query in queries:
+            _, seconds = embed(model, [query], 1)
+            single_seconds.append(seconds)
+        results[backend] = (query_embeddings, top_k(corpus_embeddings, query_embeddings, k))
+        report["backends"][backend] = {
+            "load_seconds": round(load_seconds, 3),
+            "corpus_texts_per_second": round(len(corpus) / corpus_seconds, 1),
+            "single_query_p50_ms": round(float(np.percentile(single_seconds, 50)) * 1000, 3),
+        }
+
+    (torch_queries, torch_top), (onnx_queries, onnx_top) = results["torch"], results["onnx"]
+    overlaps = [len(set(a) & set(b)) / k for a, b in zip(torch_top, onnx_top)]
+    cosines = np.sum(torch_queries * onnx_queries, axis=1)
+    report["parity"] = {
+        "mean_top_k_overlap": round(float(np.mean(overlaps)), 4),
+        "min_top_k_overlap": round(float(np.min(overlaps)), 4),
+        "top1_agreement": round(float(np.mean(torch_top[:, 0] == onnx_top[:, 0])), 4),
+        "mean_query_cosine": round(float(np.mean(cosines)), 5),
+        "min_query_cosine": round(float(np.min(cosines)), 5),
+    }
+    report["passed"] = report["parity"]["mean_top_k_overlap"] >= args.min_overlap
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    sys.exit(0 if report["passed"] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Admission control for LLM calls.
+
+Without a limit, a burst of queries piles up request threads that all wait
+on the LLM provider until every one of them times out. AdmissionController
+lets RAG_LLM_MAX_CONCURRENCY generations run at once and queues at most
+RAG_ADMISSION_MAX_QUEUE more, first come first served, for at most
+RAG_ADMISSION_MAX_WAIT_MS. Anything beyond that is rejected at once with
+Overloaded, which the routes turn into HTTP 503 with a Retry-After header,
+so an overloaded worker sheds load instead of collapsing. Cache hits and
+coalesced queries never reach the controller.
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+from metrics import ADMISSION_REJECTED_TOTAL, ADMISSION_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# 0 disables admission control
+LLM_MAX_CONCURRENCY = int(os.environ.get("RAG_LLM_MAX_CONCURRENCY", "8"))
+ADMISSION_MAX_QUEUE = int(os.environ.get("RAG_ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_MAX_WAIT_MS = float(os.environ.get("RAG_ADMISSION_MAX_WAIT_MS", "2000"))
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        """
+        Raised when a query is not admitted.
+
+        Args:
+            reason: "queue_full" or "timeout"
+            retry_after: Seconds the client should wait before retrying
+        """
+        super().__init__(f"Server overloaded ({reason}), retry in {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int = None, max_queue: int = None, max_wait_ms: float = None):
+        """
+        Bound the number of concurrent and waiting LLM calls.
+
+        Args:
+            max_concurrency: Calls running at once, defaults to RAG_LLM_MAX_CONCURRENCY
+            max_queue: Calls waiting for a slot, defaults to RAG_ADMISSION_MAX_QUEUE
+            max_wait_ms: Longest a call waits for a slot, defaults to RAG_ADMISSION_MAX_WAIT_MS
+        """
+        self.max_concurrency = max_concurrency or LLM_MAX_CONCURRENCY
+        self.max_queue = ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.max_wait = (ADMISSION_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000
+        self.active = 0
+        self._waiting = deque()
+        self._condition = threading.Condition()
+        # Smoothed time a call holds its slot, used to suggest a Retry-After
+        self._service_seconds = 1.0
+        self._recent_waits = deque(maxlen=1000)
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "timeout": 0}
+
+    @contextmanager
+    def slot(self, max_wait: float = None) -> Iterator[float]:
+        """
+        Hold one of the concurrent call slots for the duration of the block.
+
+        Args:
+            max_wait: Seconds to wait for a slot when less than the configured maximum
+
+        Yields:
+            The seconds spent waiting for the slot
+
+        Raises:
+            Overloaded: If the queue is full or no slot frees up in time
+        """
+        waited = self._acquire(self.max_wait if max_wait is None else min(max_wait, self.max_wait))
+        started = time.perf_counter()
+        try:
+            yield waited
+        finally:
+            with self._condition:
+                self.active -= 1
+                self._service_seconds = 0.9 * self._service_seconds + 0.1 * (time.perf_counter() - started)
+                self._condition.notify_all()
+
+    def _acquire(self, max_wait: float) -> float:
+        queued = time.perf_counter()
+        with self._condition:
+            if self.active < self.max_concurrency and not self._waiting:
+                return self._admit(0.0)
+            if len(self._waiting) >= self.max_queue:
+                self._reject("queue_full")
+            ticket = object()
+            self._waiting.append(ticket)
+            deadline = queued + max_wait
+            try:
+                # First come first served: only the head of the queue takes a free slot
+                while self._waiting[0] is not ticket or self.active >= self.max_concurrency:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self._reject("timeout")
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                # The next in line may be able to go now
+                self._condition.notify_all()
+            return self._admit(time.perf_counter() - queued)
+
+    def _admit(self, waited: float) -> float:
+        self.active += 1
+        self.admitted += 1
+        self._recent_waits.append(waited)
+        ADMISSION_WAIT_SECONDS.observe(waited)
+        return waited
+
+    def _reject(self, reason: str):
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED_TOTAL.inc(reason=reason)
+        raise Overloaded(reason, self.retry_after())
+
+    def retry_after(self) -> int:
+        """Seconds until the calls queued now are likely to have been served."""
+        backlog = self.active + len(self._waiting)
+        return max(1, math.ceil(backlog * self._service_seconds / self.max_concurrency))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            waits = sorted(self._recent_waits)
+            return {
+                "active": self.active,
+                "queued": len(self._waiting),
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "max_wait_ms": self.max_wait * 1000,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "wait_ms_p50": round(waits[len(waits) // 2] * 1000, 3) if waits else 0.0,
+                "wait_ms_p95": round(waits[int(len(waits) * 0.95)] * 1000, 3) if waits else 0.0,
+            }
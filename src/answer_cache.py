@@ -0,0 +1,147 @@
+"""
+Semantic answer cache for the RAG pipeline.
+
+Answers are keyed on the query embedding: a lookup hits when the nearest
+cached query is above a cosine similarity threshold, so paraphrases of the
+same policy question are served without another retrieval and LLM call.
+"""
+
+import copy
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = 0.95, ttl_seconds: float = 3600, max_size_mb: float = 64):
+        """
+        Initialize an empty cache.
+
+        Args:
+            threshold: Minimum cosine similarity between two queries for a hit
+            ttl_seconds: Age after which an entry expires (0 disables expiry)
+            max_size_mb: Approximate memory cap; least recently used entries are evicted past it
+        """
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._size_bytes = 0
+        self._next_key = 0
+        self._lock = threading.Lock()
+        # Stacked embeddings of all entries, rebuilt lazily after inserts/evictions
+        self._matrix = None
+        self._matrix_keys = []
+
+    def lookup(self, embedding, params: Hashable = None) -> Optional[Dict[str, Any]]:
+        """
+        Return a copy of the cached value for the most similar query, or None.
+
+        Args:
+            embedding: Query embedding
+            params: Retrieval parameters that must match exactly (e.g. n_results)
+
+        Returns:
+            Cached value with "similarity" added, or None on a miss
+        """
+        vector = self._normalize(embedding)
+        with self._lock:
+            self._expire()
+            best_key, best_similarity = None, -1.0
+            if self._entries:
+                matrix, keys = self._get_matrix()
+                similarities = matrix @ vector
+                for index in np.argsort(-similarities):
+                    if similarities[index] < self.threshold:
+                        break
+                    if self._entries[keys[index]]["params"] == params:
+                        best_key, best_similarity = keys[index], float(similarities[index])
+                        break
+
+            if best_key is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(best_key)
+            value = copy.deepcopy(self._entries[best_key]["value"])
+        value["similarity"] = best_similarity
+        return value
+
+    def store(self, embedding, value: Dict[str, Any], params: Hashable = None):
+        """Cache a value for a query embedding, evicting old entries past the size cap."""
+        vector = self._normalize(embedding)
+        size = vector.nbytes + len(json.dumps(value, default=str).encode("utf-8"))
+        if size > self.max_size_bytes:
+            return
+
+        with self._lock:
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = {
+                "embedding": vector,
+                "value": copy.deepcopy(value),
+                "params": params,
+                "created": time.monotonic(),
+                "size": size,
+            }
+            self._size_bytes += size
+            self._matrix = None
+            while self._size_bytes > self.max_size_bytes:
+                self._evict(next(iter(self._entries)))
+
+    def clear(self):
+        """Drop every entry, e.g. after the document index has been rebuilt."""
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+            self._matrix = None
+        logger.info("Answer cache cleared")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "size_mb": round(self._size_bytes / (1024 * 1024), 3),
+                "max_size_mb": round(self.max_size_bytes / (1024 * 1024), 3),
+                "threshold": self.threshold,
+            }
+
+    def _normalize(self, embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _get_matrix(self):
+        if self._matrix is None:
+            self._matrix_keys = list(self._entries.keys())
+            self._matrix = np.vstack([self._entries[k]["embedding"] for k in self._matrix_keys])
+        return self._matrix, self._matrix_keys
+
+    def _evict(self, key: int):
+        entry = self._entries.pop(key)
+        self._size_bytes -= entry["size"]
+        self._matrix = None
+        self.evictions += 1
+
+    def _expire(self):
+        if not self.ttl_seconds:
+            return
+        cutoff = time.monotonic() - self.ttl_seconds
+        # Entries are in LRU order, not insertion order, so check them all
+        for key in [k for k, e in self._entries.items() if e["created"] < cutoff]:
+            self._evict(key)
@@ -0,0 +1,208 @@
+"""
+Token-aware, streaming text chunking.
+
+Chunk sizes are measured in tokens of the embedding model's own tokenizer,
+so no chunk is silently truncated at the model's maximum sequence length
+(256 word pieces for all-MiniLM-L6-v2). Text is split into sentences (and
+paragraphs), each tokenized once, and packed into chunks with a sliding
+window whose running token total is updated incrementally, so chunking is
+linear in the length of the text. Chunks are yielded as soon as they are
+complete and StreamingEmbedder embeds them in batches while the rest of the
+document is still being extracted.
+"""
+
+import logging
+import math
+import os
+import re
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHUNK_MAX_TOKENS = int(os.environ.get("RAG_CHUNK_MAX_TOKENS", "128"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("RAG_CHUNK_OVERLAP_TOKENS", "24"))
+EMBED_BATCH_SIZE = int(os.environ.get("RAG_EMBED_BATCH_SIZE", "64"))
+
+# Sentence ends, and paragraph breaks (blank lines) even without punctuation
+SENTENCE_BOUNDARY_PATTERN = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+WORD_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+# Without the model's tokenizer, a word piece counts as 1.3 tokens (see context_assembly)
+ESTIMATED_TOKENS_PER_PIECE = 1.3
+# [CLS] and [SEP] take two positions of the model's maximum sequence length
+SPECIAL_TOKENS = 2
+
+class _Pieces:
+    def __init__(self, offsets: List[Tuple[int, int]]):
+        self.offsets = offsets
+
+class _WordPieceTokenizer:
+    """Stand-in tokenizer splitting on words and punctuation, used when the model's is unavailable."""
+
+    def encode_batch(self, texts: List[str], add_special_tokens: bool = False) -> List[_Pieces]:
+        return [_Pieces([m.span() for m in WORD_PIECE_PATTERN.finditer(text)]) for text in texts]
+
+def tokenizer_for_model(model) -> Optional[Any]:
+    """
+    The fast tokenizer behind a sentence-transformers or ONNX embedding model.
+
+    Returns a `tokenizers.Tokenizer` without truncation or padding, or None
+    when the model exposes no fast tokenizer.
+    """
+    tokenizer = getattr(model, "tokenizer", None)
+    backend = getattr(tokenizer, "backend_tokenizer", tokenizer)
+    if backend is None or not hasattr(backend, "to_str"):
+        return None
+    try:
+        from tokenizers import Tokenizer
+        # A private copy: the model's tokenizer carries truncation settings between calls
+        tokenizer = Tokenizer.from_str(backend.to_str())
+        tokenizer.no_truncation()
+        tokenizer.no_padding()
+        return tokenizer
+    except Exception as e:
+        logger.warning(f"Could not copy the embedding model's tokenizer, estimating chunk tokens: {e}")
+        return None
+
+class Chunker:
+    def __init__(self, tokenizer=None, max_tokens: int = None, overlap_tokens: int = None):
+        """
+        Split text into overlapping chunks of at most `max_tokens` tokens.
+
+        Args:
+            tokenizer: `tokenizers.Tokenizer` of the embedding model; token
+                counts are estimated from word pieces if omitted
+            max_tokens: Maximum tokens per chunk, excluding special tokens
+            overlap_tokens: Tokens of trailing sentences repeated at the start of the next chunk
+        """
+        self.tokenizer = tokenizer or _WordPieceTokenizer()
+        self.exact = tokenizer is not None
+        self.tokens_per_piece = 1.0 if self.exact else ESTIMATED_TOKENS_PER_PIECE
+        self.max_tokens = max_tokens or CHUNK_MAX_TOKENS
+        self.overlap_tokens = min(CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens,
+                                  self.max_tokens // 2)
+
+    @classmethod
+    def for_model(cls, model, max_tokens: int = None, overlap_tokens: int = None) -> "Chunker":
+        """Chunker sized in the model's tokens and capped at its maximum sequence length."""
+        max_tokens = max_tokens or CHUNK_MAX_TOKENS
+        max_seq_length = getattr(model, "max_seq_length", None)
+        if max_seq_length:
+            max_tokens = min(max_tokens, max_seq_length - SPECIAL_TOKENS)
+        return cls(tokenizer_for_model(model), max_tokens, overlap_tokens)
+
+    def count(self, pieces: int) -> int:
+        return math.ceil(pieces * self.tokens_per_piece)
+
+    def iter_units(self, text: str) -> Iterator[Tuple[str, int]]:
+        """
+        Yield (sentence, tokens) pairs, the smallest units chunks are built from.
+
+        Sentences longer than a chunk are cut at token boundaries, preferring
+        the start of a word.
+        """
+        sentences = [" ".join(s.split()) for s in SENTENCE_BOUNDARY_PATTERN.split(text)]
+        sentences = [s for s in sentences if s]
+        if not sentences:
+            return
+        max_pieces = max(1, int(self.max_tokens / self.tokens_per_piece))
+        for sentence, encoding in zip(sentences, self.tokenizer.encode_batch(sentences, add_special_tokens=False)):
+            offsets = encoding.offsets
+            if len(offsets) <= max_pieces:
+                yield sentence, self.count(len(offsets))
+                continue
+            start = 0
+            while start < len(offsets):
+                end = min(start + max_pieces, len(offsets))
+                if end < len(offsets):
+                    # Back off to the last token starting a word, so words are not split
+                    cut = end
+                    while cut > start + 1 and sentence[offsets[cut][0] - 1] != " ":
+                        cut -= 1
+                    if cut > start + 1:
+                        end = cut
+                text_end = offsets[end][0] if end < len(offsets) else len(sentence)
+                yield sentence[offsets[start][0]:text_end].strip(), self.count(end - start)
+                start = end
+
+    def chunks(self, segments: Iterable[Tuple[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Chunk a stream of (text, page_number) segments.
+
+        Chunks never cross a sentence boundary unless a single sentence is
+        longer than a chunk. Each chunk records the pages it spans (when
+        page numbers are given) and its token count.
+
+        Yields:
+            Chunk dicts with "id", "text" and "metadata"
+        """
+        window = deque()  # (sentence, tokens, page_number)
+        window_tokens = 0
+        fresh = 0  # Units in the window that were not carried over as overlap
+        chunk_id = 0
+        for text, page_number in segments:
+            for sentence, tokens in self.iter_units(text):
+                if window and window_tokens + tokens > self.max_tokens:
+                    yield self._make_chunk(chunk_id, window, window_tokens)
+                    chunk_id += 1
+                    while window and (window_tokens > self.overlap_tokens
+                                      or window_tokens + tokens > self.max_tokens):
+                        window_tokens -= window.popleft()[1]
+                    fresh = 0
+                window.append((sentence, tokens, page_number))
+                window_tokens += tokens
+                fresh += 1
+        if fresh:
+            yield self._make_chunk(chunk_id, window, window_tokens)
+
+    def _make_chunk(self, chunk_id: int, window, tokens: int) -> Dict[str, Any]:
+        metadata = {"token_count": tokens}
+        if window[0][2] is not None:
+            metadata["page_number"] = window[0][2]
+            metadata["page_end"] = window[-1][2]
+        return {
+            "id": f"chunk_{chunk_id}",
+            "text": " ".join(sentence for sentence, _, _ in window),
+            "metadata": metadata
+        }
+
+class StreamingEmbedder:
+    def __init__(self, embed: Callable[[List[str]], List[List[float]]], batch_size: int = None,
+                 skip: Callable[[str], bool] = None):
+        """
+        Embed chunk texts in batches while the chunks are still being produced.
+
+        Args:
+            embed: Function embedding a list of texts
+            batch_size: Texts per call to `embed`
+            skip: Returns True for texts that need no embedding, e.g. already indexed
+        """
+        self._embed = embed
+        self.batch_size = batch_size or EMBED_BATCH_SIZE
+        self._skip = skip or (lambda text: False)
+        self._pending: List[str] = []
+        self._queued = set()
+        self._embeddings: Dict[str, List[float]] = {}
+
+    def feed(self, chunks: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Pass chunks through, embedding their texts a batch at a time."""
+        for chunk in chunks:
+            text = chunk["text"]
+            if text not in self._queued and not self._skip(text):
+                self._queued.add(text)
+                self._pending.append(text)
+                if len(self._pending) >= self.batch_size:
+                    self.flush()
+            yield chunk
+
+    def flush(self):
+        """Embed the texts of a partly filled batch."""
+        if self._pending:
+            self._embeddings.update(zip(self._pending, self._embed(self._pending)))
+            self._pending = []
+
+    def get(self, text: str) -> Optional[List[float]]:
+        return self._embeddings.get(text)
+
+    def __len__(self) -> int:
+        return len(self._embeddings)
@@ -0,0 +1,213 @@
+"""
+Token-budgeted context assembly for the LLM prompt.
+
+Retrieved chunks overlap (both chunkers slide a window with overlap) and
+often repeat each other, so joining them as they come sends the same text to
+the LLM several times. assemble_context() merges chunks of the same source
+whose words overlap, drops near-duplicates, and packs the best-ranked
+passages into a token budget.
+
+The budget is measured with the LLM's tokenizer when RAG_TOKENIZER names
+one. The default Llama model's tokenizer is only published in a gated
+Hugging Face repository, so by default token counts are estimated from word
+pieces instead. Code, tables and numbers can take
+more tokens than the estimate, so an estimated count is packed into
+RAG_TOKEN_ESTIMATE_MARGIN less than the budget.
+"""
+
+import logging
+import math
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Hugging Face tokenizer name or tokenizer.json path matching the LLM; when
+# unset (or it cannot be loaded) tokens are estimated from word pieces
+TOKENIZER = os.environ.get("RAG_TOKENIZER", "")
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("RAG_CONTEXT_TOKEN_BUDGET", "1500"))
+# Share of the budget left unused when token counts are estimated
+TOKEN_ESTIMATE_MARGIN = float(os.environ.get("RAG_TOKEN_ESTIMATE_MARGIN", "0.2"))
+DEDUP_THRESHOLD = float(os.environ.get("RAG_DEDUP_THRESHOLD", "0.8"))
+
+# Shortest word overlap treated as two chunks being cut from the same text
+MIN_OVERLAP_WORDS = 8
+SHINGLE_SIZE = 3
+WORD_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+class TokenCounter:
+    def __init__(self, tokenizer: str = None):
+        """
+        Count tokens the way the LLM does.
+
+        Args:
+            tokenizer: Hugging Face tokenizer name or path to a tokenizer.json
+        """
+        self.tokenizer_name = TOKENIZER if tokenizer is None else tokenizer
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            if self.tokenizer_name:
+                try:
+                    from tokenizers import Tokenizer
+                    if os.path.exists(self.tokenizer_name):
+                        self._tokenizer = Tokenizer.from_file(self.tokenizer_name)
+                    else:
+                        self._tokenizer = Tokenizer.from_pretrained(self.tokenizer_name)
+                    logger.info(f"Counting context tokens with {self.tokenizer_name}")
+                except Exception as e:
+                    logger.warning(f"Could not load tokenizer {self.tokenizer_name}, estimating token counts: {e}")
+            self._loaded = True
+
+    @property
+    def exact(self) -> bool:
+        self._load()
+        return self._tokenizer is not None
+
+    def count(self, text: str) -> int:
+        self._load()
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+        # Llama-style BPE averages about 1.3 tokens per word piece on English prose
+        return math.ceil(len(WORD_PIECE_PATTERN.findall(text)) * 1.3)
+
+def _word_overlap(first: List[str], second: List[str]) -> int:
+    """Length of the longest suffix of `first` that is a prefix of `second`."""
+    if len(first) < MIN_OVERLAP_WORDS or len(second) < MIN_OVERLAP_WORDS:
+        return 0
+    head = second[:MIN_OVERLAP_WORDS]
+    start = max(0, len(first) - len(second))
+    for position in range(start, len(first) - MIN_OVERLAP_WORDS + 1):
+        if first[position:position + MIN_OVERLAP_WORDS] == head:
+            tail = first[position:]
+            if second[:len(tail)] == tail:
+                return len(tail)
+    return 0
+
+def _shingles(words: List[str]) -> Set[Tuple[str, ...]]:
+    lowered = [w.lower() for w in words]
+    if len(lowered) < SHINGLE_SIZE:
+        return {tuple(lowered)}
+    return {tuple(lowered[i:i + SHINGLE_SIZE]) for i in range(len(lowered) - SHINGLE_SIZE + 1)}
+
+def _merge_overlapping(passages: List[Dict[str, Any]]) -> int:
+    """Merge passages of the same source whose words overlap, in place. Returns the number of merges."""
+    merges = 0
+    merged = True
+    while merged:
+        merged = False
+        for a in passages:
+            for b in passages:
+                if a is b or a["source"] != b["source"]:
+                    continue
+                overlap = _word_overlap(a["words"], b["words"])
+                if overlap:
+                    a["words"] = a["words"] + b["words"][overlap:]
+                    a["rank"] = min(a["rank"], b["rank"])
+                    a["members"] += b["members"]
+                    passages.remove(b)
+                    merges += 1
+                    merged = True
+                    break
+            if merged:
+                break
+    return merges
+
+def assemble_context(documents: List[str], sources: Optional[List[str]] = None, token_budget: int = None,
+                     dedup_threshold: float = None, counter: TokenCounter = None) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    Build the prompt context from ranked chunks.
+
+    Args:
+        documents: Chunk texts, best first
+        sources: Source document of each chunk; only chunks of the same source are merged
+        token_budget: Maximum context tokens (0 disables the budget); reduced by
+            RAG_TOKEN_ESTIMATE_MARGIN when the counter only estimates
+        dedup_threshold: Shingle Jaccard similarity above which a lower-ranked passage is dropped
+        counter: Token counter, a shared default is used if omitted
+
+    Returns:
+        Passages to send, best first, and stats including prompt_tokens_saved
+    """
+    token_budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    dedup_threshold = DEDUP_THRESHOLD if dedup_threshold is None else dedup_threshold
+    counter = counter or default_counter()
+    sources = sources or [None] * len(documents)
+
+    packing_budget = token_budget
+    if token_budget and not counter.exact:
+        packing_budget = max(1, math.floor(token_budget * (1 - TOKEN_ESTIMATE_MARGIN)))
+
+    raw_tokens = sum(counter.count(document) for document in documents)
+    passages = [
+        {"words": document.split(), "rank": rank, "source": source, "members": 1}
+        for rank, (document, source) in enumerate(zip(documents, sources))
+    ]
+    merges = _merge_overlapping(passages)
+    passages.sort(key=lambda p: p["rank"])
+
+    kept, kept_shingles, duplicates = [], [], 0
+    for passage in passages:
+        shingles = _shingles(passage["words"])
+        if any(len(shingles & other) / max(1, len(shingles | other)) >= dedup_threshold
+               or shingles <= other for other in kept_shingles):
+            duplicates += 1
+            continue
+        kept.append(passage)
+        kept_shingles.append(shingles)
+
+    context, used_tokens, skipped = [], 0, 0
+    for passage in kept:
+        text = " ".join(passage["words"])
+        tokens = counter.count(text)
+        if packing_budget and used_tokens + tokens > packing_budget:
+            if context:
+                # Keep scanning, a shorter lower-ranked passage may still fit
+                skipped += 1
+                continue
+            # Always send something: cut the best passage down to the budget
+            text, tokens = _truncate(passage["words"], packing_budget, counter)
+        context.append(text)
+        used_tokens += tokens
+
+    stats = {
+        "token_budget": token_budget,
+        "packing_budget": packing_budget,
+        "exact_token_count": counter.exact,
+        "raw_context_tokens": raw_tokens,
+        "context_tokens": used_tokens,
+        "prompt_tokens_saved": max(0, raw_tokens - used_tokens),
+        "chunks_retrieved": len(documents),
+        "chunks_merged": merges,
+        "duplicates_dropped": duplicates,
+        "passages_over_budget": skipped,
+        "passages_sent": len(context),
+    }
+    return context, stats
+
+def _truncate(words: List[str], token_budget: int, counter: TokenCounter) -> Tuple[str, int]:
+    low, high = 0, len(words)
+    # Binary search for the longest word prefix within the budget
+    while low < high:
+        middle = (low + high + 1) // 2
+        if counter.count(" ".join(words[:middle])) <= token_budget:
+            low = middle
+        else:
+            high = middle - 1
+    text = " ".join(words[:low])
+    return text, counter.count(text)
+
+_default_counter = None
+
+def default_counter() -> TokenCounter:
+    global _default_counter
+    if _default_counter is None:
+        _default_counter = TokenCounter()
+    return _default_counter
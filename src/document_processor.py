@@ -1,16 +1,19 @@
 """
-Document processor for extracting text from PDFs using Apache Tika
-and preparing it for vector database storage.
+Document processor for extracting text from PDFs (with Apache Tika or pypdf,
+see pdf_extraction) and preparing it for vector database storage.
 """
 
 import os
 import re
 from typing import List, Dict, Any
-from tika import parser
-import chromadb
-from sentence_transformers import SentenceTransformer
 import logging
 
+from model_registry import get_embedding_model, get_chroma_client
+from index_sync import assign_chunk_ids, sync_collection
+from chunking import Chunker
+from publications import describe_publication, running_header_pattern
+from pdf_extraction import extract_text
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,13 +26,14 @@ class DocumentProcessor:
         Args:
             embedding_model_name: Name of the sentence transformer model to use
         """
-        self.embedding_model = SentenceTransformer(embedding_model_name)
-        self.chroma_client = chromadb.PersistentClient(path="./chroma_db")
+        self.embedding_model = get_embedding_model(embedding_model_name)
+        self.chunker = Chunker.for_model(self.embedding_model)
+        self.chroma_client = get_chroma_client("./chroma_db")
         self.collection = None
         
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """
-        Extract text from PDF using Apache Tika.
+        Extract text from PDF with the RAG_PDF_EXTRACTOR backend, or from the extraction cache.
         
         Args:
             pdf_path: Path to the PDF file
@@ -39,8 +43,7 @@ class DocumentProcessor:
         """
         try:
             logger.info(f"Extracting text from {pdf_path}")
-            parsed = parser.from_file(pdf_path)
-            text = parsed['content']
+            text = extract_text(pdf_path)
             
             if not text:
                 raise ValueError("No text content extracted from PDF")
@@ -52,12 +55,13 @@ class DocumentProcessor:
             logger.error(f"Error extracting text from PDF: {e}")
             raise
     
-    def clean_text(self, text: str) -> str:
+    def clean_text(self, text: str, source: str = None) -> str:
         """
         Clean and normalize extracted text.
         
         Args:
             text: Raw extracted text
+            source: Publication number of the document, whose running header is removed
             
         Returns:
             Cleaned text
@@ -67,65 +71,45 @@ class DocumentProcessor:
         
         # Remove page numbers and headers/footers patterns
         text = re.sub(r'Page \d+ of \d+', '', text)
-        text = re.sub(r'DAFMAN\s+\d+-\d+', '', text)
+        header = running_header_pattern(source)
+        if header:
+            text = header.sub(' ', text)
         
         # Remove excessive line breaks
         text = re.sub(r'\n\s*\n', '\n', text)
         
         return text.strip()
     
-    def chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 100) -> List[Dict[str, Any]]:
+    def chunk_text(self, text: str, document: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """
-        Split text into overlapping chunks for better retrieval.
+        Split text into overlapping, sentence-aligned chunks for better retrieval.
         
         Args:
             text: Text to chunk
-            chunk_size: Maximum size of each chunk
-            overlap: Number of characters to overlap between chunks
+            document: Publication metadata stamped on every chunk (see publications.describe_publication)
             
         Returns:
             List of chunk dictionaries with metadata
         """
+        document = document or {'source': 'DAFMAN 36-2664'}
         chunks = []
-        
-        # Split by paragraphs first
-        paragraphs = text.split('\n')
-        
-        current_chunk = ""
-        chunk_id = 0
-        
-        for paragraph in paragraphs:
-            # If adding this paragraph would exceed chunk size, save current chunk
-            if len(current_chunk) + len(paragraph) > chunk_size and current_chunk:
-                chunks.append({
-                    'id': f"chunk_{chunk_id}",
-                    'text': current_chunk.strip(),
-                    'metadata': {
-                        'chunk_id': chunk_id,
-                        'source': 'DAFMAN 36-2664',
-                        'length': len(current_chunk.strip())
-                    }
-                })
-                
-                # Start new chunk with overlap
-                overlap_text = current_chunk[-overlap:] if len(current_chunk) > overlap else current_chunk
-                current_chunk = overlap_text + " " + paragraph
-                chunk_id += 1
-            else:
-                current_chunk += " " + paragraph if current_chunk else paragraph
-        
-        # Add the last chunk
-        if current_chunk.strip():
+        for chunk_id, chunk in enumerate(self.chunker.chunks([(text, None)])):
             chunks.append({
-                'id': f"chunk_{chunk_id}",
-                'text': current_chunk.strip(),
+                'id': chunk['id'],
+                'text': chunk['text'],
                 'metadata': {
+                    **document,
                     'chunk_id': chunk_id,
-                    'source': 'DAFMAN 36-2664',
-                    'length': len(current_chunk.strip())
+                    'length': len(chunk['text']),
+                    'token_count': chunk['metadata']['token_count']
                 }
             })
         
+        # Content-hashed IDs stay stable across re-ingestion and unique across documents
+        content_ids = assign_chunk_ids(document['source'], [chunk['text'] for chunk in chunks])
+        for chunk, content_id in zip(chunks, content_ids):
+            chunk['id'] = content_id
+        
         logger.info(f"Created {len(chunks)} text chunks")
         return chunks
     
@@ -145,27 +129,28 @@ class DocumentProcessor:
         embeddings = self.embedding_model.encode(texts, show_progress_bar=True)
         return embeddings.tolist()
     
-    def setup_vector_database(self, collection_name: str = "dafman_documents"):
+    def setup_vector_database(self, collection_name: str = "dafman_documents", rebuild: bool = False):
         """
         Set up ChromaDB collection for storing document embeddings.
         
         Args:
             collection_name: Name of the collection
+            rebuild: Drop the existing collection instead of syncing into it
         """
         try:
-            # Delete existing collection if it exists
-            try:
-                self.chroma_client.delete_collection(name=collection_name)
-                logger.info(f"Deleted existing collection: {collection_name}")
-            except:
-                pass
-            
-            # Create new collection
-            self.collection = self.chroma_client.create_collection(
+            if rebuild:
+                try:
+                    self.chroma_client.delete_collection(name=collection_name)
+                    logger.info(f"Deleted existing collection: {collection_name}")
+                except:
+                    pass
+            
+            # Reuse the existing collection so it stays queryable during re-ingestion
+            self.collection = self.chroma_client.get_or_create_collection(
                 name=collection_name,
                 metadata={"description": "DAFMAN 36-2664 Personnel Assessment Program"}
             )
-            logger.info(f"Created new collection: {collection_name}")
+            logger.info(f"Using collection: {collection_name}")
             
         except Exception as e:
             logger.error(f"Error setting up vector database: {e}")
@@ -202,6 +187,29 @@ class DocumentProcessor:
             logger.error(f"Error storing documents: {e}")
             raise
     
+    def sync_documents(self, chunks: List[Dict[str, Any]], source: str = 'DAFMAN 36-2664') -> Dict[str, int]:
+        """
+        Sync document chunks into ChromaDB, embedding only new chunks.
+        
+        Args:
+            chunks: List of text chunks with content-hashed IDs
+            source: Publication number the chunks belong to
+            
+        Returns:
+            Counts of added, updated, deleted and unchanged chunks
+        """
+        if not self.collection:
+            raise ValueError("Vector database collection not initialized")
+        
+        ids = [chunk['id'] for chunk in chunks]
+        documents = [chunk['text'] for chunk in chunks]
+        metadatas = [chunk['metadata'] for chunk in chunks]
+        embed = lambda texts: self.embedding_model.encode(texts, show_progress_bar=True).tolist()
+        
+        stats = sync_collection(self.collection, source, ids, documents, metadatas, embed)
+        logger.info(f"Synced {len(chunks)} documents in vector database: {stats}")
+        return stats
+    
     def process_document(self, pdf_path: str) -> Dict[str, Any]:
         """
         Complete document processing pipeline.
@@ -216,26 +224,29 @@ class DocumentProcessor:
             # Extract text
             raw_text = self.extract_text_from_pdf(pdf_path)
             
+            # Publication number and revision date from the file name and title page
+            document = describe_publication(pdf_path, raw_text[:3000])
+            
             # Clean text
-            cleaned_text = self.clean_text(raw_text)
+            cleaned_text = self.clean_text(raw_text, document['source'])
             
             # Create chunks
-            chunks = self.chunk_text(cleaned_text)
-            
-            # Create embeddings
-            embeddings = self.create_embeddings(chunks)
+            chunks = self.chunk_text(cleaned_text, document)
             
             # Setup vector database
             self.setup_vector_database()
             
-            # Store documents
-            self.store_documents(chunks, embeddings)
+            # Embed and store new chunks, remove stale ones
+            stats = self.sync_documents(chunks, document['source'])
             
             return {
                 'status': 'success',
+                'source': document['source'],
                 'total_chunks': len(chunks),
                 'total_characters': len(cleaned_text),
-                'embedding_dimension': len(embeddings[0]) if embeddings else 0
+                'chunks_added': stats['added'],
+                'chunks_deleted': stats['deleted'],
+                'embedding_dimension': self.embedding_model.get_sentence_embedding_dimension()
             }
             
         except Exception as e:
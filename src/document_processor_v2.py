@@ -1,10 +1,40 @@
 import os
-from tika import parser
-from typing import List, Dict, Any
-from sentence_transformers import SentenceTransformer
-import chromadb
+from itertools import chain, groupby
+from operator import itemgetter
+from typing import List, Dict, Any, Iterable, Tuple
+from model_registry import get_embedding_model, get_chroma_client
+from pdf_extraction import iter_pages
+from index_sync import assign_chunk_ids, content_chunk_id, plan_sync, apply_sync
+from chunking import Chunker, StreamingEmbedder
+from ingestion_jobs import JobCancelled
+from lexical_index import rebuild_lexical_index
+from publications import describe_publication, running_header_pattern
 import re
-import torch
+
+# Table-of-contents entries, e.g. "2.3.1. Selection Board President. ........ 14"
+# or "Chapter 2—SELECTION BOARDS 12". The trailing page number is required so
+# body headings are not mistaken for TOC lines.
+TOC_ENTRY_PATTERN = re.compile(
+    r'^\s*(?:(?P<kind>Chapter|Attachment)\s+(?P<ordinal>\d+)\s*[-\u2013\u2014:]*\s*'
+    r'|(?P<number>\d+(?:\.\d+)*)\.\s+)'
+    r'(?P<title>\S.{0,150}?)(?:\s*(?:\.\s*){2,}|\s+)(?P<page>\d+)\s*$',
+    re.IGNORECASE
+)
+# Section headings in the body of the manual, e.g. "2.3.1. Selection Board President."
+HEADING_PATTERN = re.compile(
+    r'^\s*(?:(?P<kind>Chapter|Attachment)\s+(?P<ordinal>\d+)\b|(?P<number>\d+(?:\.\d+)*)\.\s+\S)',
+    re.IGNORECASE
+)
+
+def _section_number(match) -> str:
+    if match.group("number"):
+        return match.group("number")
+    # Chapters share the numbering of their paragraphs ("2" -> "2.1"), attachments do not
+    prefix = "A" if match.group("kind").lower() == "attachment" else ""
+    return f"{prefix}{match.group('ordinal')}"
+
+def _parent_number(number: str) -> str:
+    return number.rsplit(".", 1)[0] if "." in number else ""
 
 class DocumentProcessor:
     def __init__(self):
@@ -16,114 +46,340 @@ class DocumentProcessor:
 
     def load_embedding_model(self):
         print("INFO:document_processor:Loading embedding model: all-MiniLM-L6-v2")
-        # Explicitly set device to CPU to avoid MPS meta tensor issues
-        self.embedding_model = SentenceTransformer(
-            'all-MiniLM-L6-v2',
-            device='cpu' # Force CPU to avoid MPS meta tensor error
-        )
+        # Shared with the RAG pipeline; CPU avoids MPS meta tensor issues
+        self.embedding_model = get_embedding_model('all-MiniLM-L6-v2', device='cpu')
+        # Chunks are sized in the model's own tokens so none are truncated when embedded
+        self.chunker = Chunker.for_model(self.embedding_model)
 
     def connect_to_chromadb(self):
         print("INFO:document_processor:Connecting to ChromaDB at: ./chroma_db")
-        self.chroma_client = chromadb.PersistentClient(path="./chroma_db")
+        self.chroma_client = get_chroma_client("./chroma_db")
         self.collection = self.chroma_client.get_or_create_collection(name="dafman_documents")
+        self.section_collection = self.chroma_client.get_or_create_collection(name="dafman_sections")
+
+    def process_documents(self, pdf_paths: List[str], job=None, metadata: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Ingest several documents, committing each one as it is done.
+
+        A document that fails is reported and skipped. Cancelling stops
+        before the next document; documents already committed stay in the
+        index. The keyword index is rebuilt once at the end.
+
+        Args:
+            pdf_paths: Documents to ingest
+            job: Ingestion job to report progress on
+            metadata: Document metadata overrides, only applied to a single document
+        """
+        results = {}
+        status = "success"
+        try:
+            for i, pdf_path in enumerate(pdf_paths):
+                if job:
+                    job.start_document(pdf_path, i, len(pdf_paths))
+                results[pdf_path] = self.process_document(
+                    pdf_path, job, metadata if len(pdf_paths) == 1 else None, rebuild_index=False
+                )
+        except JobCancelled:
+            if not any(r["status"] == "success" for r in results.values()):
+                raise
+            status = "cancelled"
 
-    def process_document(self, pdf_path: str) -> Dict[str, Any]:
+        succeeded = [r for r in results.values() if r["status"] == "success"]
+        if succeeded:
+            rebuild_lexical_index(self.collection)
+        if status == "success" and len(succeeded) < len(pdf_paths):
+            status = "partial" if succeeded else "error"
+        summary = {
+            "status": status,
+            "documents_processed": len(succeeded),
+            "documents_failed": len(results) - len(succeeded),
+            "total_chunks": sum(r["total_chunks"] for r in succeeded),
+            "chunks_added": sum(r["chunks_added"] for r in succeeded),
+            "chunks_deleted": sum(r["chunks_deleted"] for r in succeeded),
+            "documents": results,
+        }
+        if status == "error":
+            summary["error"] = "No document could be processed"
+        return summary
+
+    def process_document(self, pdf_path: str, job=None, metadata: Dict[str, Any] = None,
+                         rebuild_index: bool = True) -> Dict[str, Any]:
+        """
+        Extract, chunk, embed and commit a document to the index.
+
+        When run as a background ingestion job, progress is reported on `job`
+        and the index is only written in the final "committing" stage, so a
+        cancelled or failed run leaves the previous index untouched.
+
+        Args:
+            pdf_path: Document to ingest
+            job: Ingestion job to report progress on
+            metadata: Overrides for the publication metadata read from the document
+            rebuild_index: Rebuild the keyword index after committing
+        """
+        set_stage = job.set_stage if job else (lambda stage: None)
         print(f"INFO:__main__:Extracting text from {pdf_path}")
         try:
-            parsed_pdf = parser.from_file(pdf_path)
-            text = parsed_pdf["content"]
-            if not text:
-                raise ValueError("Could not extract text from PDF.")
+            set_stage("extracting")
+            pages = iter_pages(pdf_path)
+            first_page = next(pages, None)
+            if first_page is not None:
+                pages = chain([first_page], pages)
+            # The publication number is the document's source in both collections
+            document = describe_publication(pdf_path, first_page[1] if first_page else "", metadata)
+            source = document["source"]
+            # Pages stream in from the extraction workers; sections are cleaned
+            # and chunked as soon as they are complete
+            sections: Dict[str, Dict[str, Any]] = {}
+            summaries: Dict[str, str] = {}
+            chunks = []
+            total_characters = 0
+            # New chunks are embedded in batches while later pages are still being extracted
+            stored_ids = set(self.collection.get(where={"source": source}, include=[])["ids"])
+            embedder = StreamingEmbedder(
+                lambda texts: self.embedding_model.encode(texts).tolist(),
+                skip=lambda text: content_chunk_id(source, text) in stored_ids
+            )
+            for section, lines in self.iter_section_segments(pages, sections):
+                if job:
+                    job.check_cancelled()
+                segments = []
+                for page_number, page_lines in groupby(lines, key=itemgetter(0)):
+                    cleaned_text = self.clean_text("\n".join(line for _, line in page_lines), source)
+                    total_characters += len(cleaned_text)
+                    segments.append((cleaned_text, page_number))
+                if section and section["number"] not in summaries:
+                    summaries[section["number"]] = " ".join(text for text, _ in segments)[:300]
 
-            # Clean and chunk text
-            cleaned_text = self.clean_text(text)
-            chunks = self.chunk_text(cleaned_text)
+                for chunk in embedder.feed(self.chunker.chunks(segments)):
+                    if section:
+                        chunk["metadata"].update({
+                            "section_id": section["number"],
+                            "section_title": section["title"],
+                            "section_path": section["path"],
+                        })
+                    chunks.append(chunk)
 
-            # Store chunks in ChromaDB
-            self.store_chunks_in_chromadb(chunks, pdf_path)
+            if not total_characters:
+                raise ValueError("Could not extract text from PDF.")
+            embedder.flush()
+
+            # Embed what was not embedded while streaming and the sections, then commit both to ChromaDB
+            set_stage("embedding")
+            chunk_plan = self.plan_chunk_sync(chunks, source, lambda texts: self.embed_texts(texts, job, embedder), document)
+            set_stage("embedding_sections")
+            section_plan = self.plan_section_sync(list(sections.values()), summaries, source, document)
+            # Chunks indexed before documents were keyed by publication number used the file path
+            legacy_plans = [plan_sync(collection, pdf_path, [], [], [], self.embed_texts)
+                            for collection in (self.collection, self.section_collection)] if pdf_path != source else []
+            set_stage("committing")
+            chunk_stats = apply_sync(chunk_plan)
+            apply_sync(section_plan)
+            for plan in legacy_plans:
+                apply_sync(plan)
+            if rebuild_index:
+                # Keyword index over the same chunk IDs, for hybrid retrieval
+                rebuild_lexical_index(self.collection)
+            print(f"INFO:__main__:Stored {len(chunks)} chunks of {source} in vector database ({chunk_stats['added']} embedded, {chunk_stats['deleted']} removed)")
 
             return {
                 "status": "success",
+                **document,
                 "total_chunks": len(chunks),
-                "total_characters": len(cleaned_text),
+                "chunks_added": chunk_stats["added"],
+                "chunks_deleted": chunk_stats["deleted"],
+                "chunks_unchanged": chunk_stats["unchanged"],
+                "total_sections": len(sections),
+                "total_characters": total_characters,
                 "embedding_dimension": self.embedding_model.get_sentence_embedding_dimension(),
-                "average_chunk_size": sum(len(c["text"]) for c in chunks) / len(chunks) if chunks else 0
+                "average_chunk_size": sum(len(c["text"]) for c in chunks) / len(chunks) if chunks else 0,
+                "average_chunk_tokens": sum(c["metadata"]["token_count"] for c in chunks) / len(chunks) if chunks else 0,
+                "max_chunk_tokens": max((c["metadata"]["token_count"] for c in chunks), default=0),
+                "exact_token_count": self.chunker.exact
             }
+        except JobCancelled:
+            print(f"INFO:__main__:Processing of {pdf_path} cancelled, index left unchanged")
+            raise
         except Exception as e:
             print(f"ERROR:__main__:Error extracting text from PDF: {e}")
             return {"status": "error", "error": str(e)}
 
-    def clean_text(self, text: str) -> str:
+    def clean_text(self, text: str, source: str = None) -> str:
+        """
+        Normalize extracted text and drop page furniture.
+
+        Args:
+            text: Raw extracted text
+            source: Publication number of the document, whose running header is removed
+        """
         # Remove multiple newlines and replace with single space
         text = re.sub(r'\n\s*\n', '\n', text)
         # Remove page numbers, headers, footers (often at top/bottom of pages)
         # This is a generic attempt; may need fine-tuning for specific documents
         text = re.sub(r'\s*Page \d+ of \d+\s*', '', text, flags=re.IGNORECASE)
-        text = re.sub(r'\s*DAFMAN 36-2664\s*', '', text, flags=re.IGNORECASE)
+        header = running_header_pattern(source)
+        if header:
+            text = header.sub('', text)
         return text.strip()
 
-    def chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 100) -> List[Dict[str, Any]]:
-        chunks = []
-        words = text.split()
-        current_chunk = []
-        current_length = 0
-        chunk_id_counter = 0
-
-        for word in words:
-            word_length = len(word) + 1  # +1 for space
-            if current_length + word_length > chunk_size and current_chunk:
-                chunks.append({
-                    "id": f"chunk_{chunk_id_counter}",
-                    "text": " ".join(current_chunk),
-                    "metadata": {}
-                })
-                chunk_id_counter += 1
-                # Create overlap
-                current_chunk = current_chunk[-int(overlap / (chunk_size / len(current_chunk))):] if current_chunk else []
-                current_length = sum(len(w) + 1 for w in current_chunk)
-
-            current_chunk.append(word)
-            current_length += word_length
-
-        if current_chunk:
-            chunks.append({
-                "id": f"chunk_{chunk_id_counter}",
-                "text": " ".join(current_chunk),
-                "metadata": {}
-            })
-
-        return chunks
-
-    def store_chunks_in_chromadb(self, chunks: List[Dict[str, Any]], source_doc: str):
+    def parse_table_of_contents(self, text: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Parse the table of contents into a section tree.
+
+        Returns section number -> section dict, in TOC order. Each section
+        carries its number, title, level, parent, page and full path, e.g.
+        "2 SELECTION BOARDS > 2.3 Board Members > 2.3.1 Selection Board President".
+        """
+        sections: Dict[str, Dict[str, Any]] = {}
+        for _ in self.iter_section_segments([(None, text)], sections):
+            pass
+        return sections
+
+    def iter_section_segments(self, pages: Iterable[Tuple[Any, str]], sections: Dict[str, Dict[str, Any]]):
+        """
+        Split a stream of (page_number, text) pages into sections using the TOC.
+
+        The TOC is read from the first lines of the stream into `sections`;
+        it ends where its first entry shows up again as a body heading. After
+        that, every heading listed in the TOC starts a new segment. Yields
+        (section, lines) pairs as soon as each section is complete, where
+        lines are (page_number, line) pairs. Text before the first heading
+        (including the TOC itself) is yielded with a section of None.
+        """
+        in_toc = True
+        current_section = None
+        current_lines = []
+        started = set()
+        for page_number, text in pages:
+            for line in text.split("\n"):
+                if in_toc:
+                    entry = TOC_ENTRY_PATTERN.match(line)
+                    heading = entry or HEADING_PATTERN.match(line)
+                    if heading and _section_number(heading) in sections:
+                        in_toc = False
+                        print(f"INFO:document_processor:Found {len(sections)} sections in table of contents")
+                    else:
+                        if entry:
+                            self._add_toc_entry(entry, sections)
+                        current_lines.append((page_number, line))
+                        continue
+
+                heading = HEADING_PATTERN.match(line)
+                number = _section_number(heading) if heading else None
+                if number in sections and number not in started:
+                    if current_lines:
+                        yield current_section, current_lines
+                    started.add(number)
+                    current_section = sections[number]
+                    current_lines = []
+                current_lines.append((page_number, line))
+        if current_lines:
+            yield current_section, current_lines
+
+    def _add_toc_entry(self, entry, sections: Dict[str, Dict[str, Any]]):
+        number = _section_number(entry)
+        title = entry.group("title").strip(" .\u2013\u2014-")
+        parent = _parent_number(number)
+        parent_path = sections[parent]["path"] + " > " if parent in sections else ""
+        sections[number] = {
+            "number": number,
+            "title": title,
+            "level": number.count(".") + 1,
+            "parent": parent if parent in sections else "",
+            "page": int(entry.group("page")),
+            "path": f"{parent_path}{number} {title}",
+        }
+
+    def chunk_text(self, text: str) -> List[Dict[str, Any]]:
+        return list(self.chunker.chunks([(text, None)]))
+
+    def store_chunks_in_chromadb(self, chunks: List[Dict[str, Any]], source_doc: str) -> Dict[str, int]:
+        """
+        Sync a document's chunks into the collection.
+
+        IDs are content hashes, so only new or changed chunks are embedded
+        and chunks no longer in the document are deleted.
+        """
+        stats = apply_sync(self.plan_chunk_sync(chunks, source_doc))
+        print(f"INFO:__main__:Stored {len(chunks)} documents in vector database ({stats['added']} embedded, {stats['deleted']} removed)")
+        return stats
+
+    def plan_chunk_sync(self, chunks: List[Dict[str, Any]], source_doc: str, embed=None,
+                        document: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Plan the sync of a document's chunks; `document` holds metadata stamped on every chunk."""
         documents = [chunk["text"] for chunk in chunks]
+        ids = assign_chunk_ids(source_doc, documents)
         metadatas = []
-        for chunk in chunks:
+        for chunk, chunk_id in zip(chunks, ids):
             # Ensure metadata values are not None
             metadata = {
+                **(document or {}),
                 "source": source_doc,
-                "chunk_id": chunk["id"],
+                "chunk_id": chunk_id,
             }
-            # Only add page_number if it exists and is not None
-            if "page_number" in chunk["metadata"] and chunk["metadata"]["page_number"] is not None:
-                metadata["page_number"] = str(chunk["metadata"]["page_number"]) # Ensure it's a string
+            # Page numbers stay integers so queries can filter on page ranges
+            if chunk["metadata"].get("page_number") is not None:
+                metadata["page_number"] = int(chunk["metadata"]["page_number"])
+                metadata["page_end"] = int(chunk["metadata"].get("page_end", metadata["page_number"]))
             else:
                 metadata["page_number"] = "N/A" # Provide a default string value
+            for key in ("section_id", "section_title", "section_path"):
+                if key in chunk["metadata"]:
+                    metadata[key] = chunk["metadata"][key]
             metadatas.append(metadata)
 
-        ids = [chunk["id"] for chunk in chunks]
+        print("INFO:document_processor:Generating embeddings for new chunks...")
+        return plan_sync(self.collection, source_doc, ids, documents, metadatas, embed or self.embed_texts)
+
+    def store_sections_in_chromadb(self, sections: List[Dict[str, Any]], summaries: Dict[str, str], source_doc: str) -> Dict[str, int]:
+        stats = apply_sync(self.plan_section_sync(sections, summaries, source_doc))
+        print(f"INFO:__main__:Stored {len(sections)} sections in section index ({stats['added']} embedded)")
+        return stats
+
+    def plan_section_sync(self, sections: List[Dict[str, Any]], summaries: Dict[str, str], source_doc: str,
+                          document: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Embed each section's path plus a summary for section routing.
+
+        Summaries are the opening of the section's own text, not its subsections.
+        """
+        if not sections:
+            print("INFO:document_processor:No table of contents found, section index left empty")
+
+        documents = [f"{s['path']}\n{summaries.get(s['number'], '')}".strip() for s in sections]
+        metadatas = [{
+            **(document or {}),
+            "source": source_doc,
+            "section_id": s["number"],
+            "section_title": s["title"],
+            "section_path": s["path"],
+            "parent_id": s["parent"],
+            "level": s["level"],
+            "page": s["page"],
+        } for s in sections]
+        ids = assign_chunk_ids(source_doc, documents)
+
+        return plan_sync(self.section_collection, source_doc, ids, documents, metadatas, self.embed_texts)
 
-        # Generate embeddings
-        print("INFO:document_processor:Generating embeddings for chunks...")
-        embeddings = self.embedding_model.encode(documents).tolist()
+    def embed_texts(self, texts: List[str], job=None, precomputed: StreamingEmbedder = None,
+                    batch_size: int = 64) -> List[List[float]]:
+        """
+        Embed texts in batches, reporting progress to an ingestion job if given.
 
-        # Add to ChromaDB
-        self.collection.add(
-            documents=documents,
-            metadatas=metadatas,
-            embeddings=embeddings,
-            ids=ids
-        )
-        print(f"INFO:__main__:Stored {len(documents)} documents in vector database")
+        Texts already embedded by `precomputed` while streaming are not embedded again.
+        """
+        if job:
+            job.start_embedding(len(texts))
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            known = [precomputed.get(text) if precomputed else None for text in batch]
+            missing = [text for text, embedding in zip(batch, known) if embedding is None]
+            computed = iter(self.embedding_model.encode(missing).tolist() if missing else [])
+            embeddings.extend(embedding if embedding is not None else next(computed) for embedding in known)
+            if job:
+                job.advance(len(batch))
+        return embeddings
 
 # For testing purposes
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+"""
+Micro-batching of query embeddings across concurrent requests.
+
+Each request thread used to encode its own single query, which wastes most
+of a CPU matrix multiply and makes the threads compete for torch's intra-op
+threads. EmbeddingBatcher queues concurrent encode requests, and one worker
+thread encodes up to RAG_EMBED_MAX_BATCH of them at once, waiting at most
+RAG_EMBED_MAX_WAIT_MS after the first for the batch to fill. With a wait of
+0 only the requests that queued up while the previous batch was encoding
+are batched together, so an idle server adds no latency at all.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+from metrics import EMBED_BATCH_FILL, EMBED_BATCH_SIZE, EMBED_QUEUE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+EMBED_BATCHING = os.environ.get("RAG_EMBED_BATCHING", "1") == "1"
+EMBED_MAX_BATCH = int(os.environ.get("RAG_EMBED_MAX_BATCH", "32"))
+EMBED_MAX_WAIT_MS = float(os.environ.get("RAG_EMBED_MAX_WAIT_MS", "2"))
+
+class EmbeddingBatcher:
+    def __init__(self, encode: Callable[[List[str]], Any], max_batch_size: int = None, max_wait_ms: float = None):
+        """
+        Batch single-text encode calls from concurrent threads.
+
+        Args:
+            encode: Embeds a list of texts, returning one vector per text
+            max_batch_size: Most texts per encode call, defaults to RAG_EMBED_MAX_BATCH
+            max_wait_ms: Longest a request waits for the batch to fill, defaults to RAG_EMBED_MAX_WAIT_MS
+        """
+        self._encode = encode
+        self.max_batch_size = max_batch_size or EMBED_MAX_BATCH
+        self.max_wait = (EMBED_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000
+        self._requests = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+
+    def encode(self, text: str) -> List[float]:
+        """Embed one text; blocks until the batch it joined has been encoded."""
+        future = Future()
+        self._worker_queue().put((text, future, time.perf_counter()))
+        return future.result()
+
+    def _worker_queue(self) -> queue.Queue:
+        if self._pid != os.getpid():
+            with self._lock:
+                # Started on first use, and again in a forked worker, which inherits no threads
+                if self._pid != os.getpid():
+                    self._requests = queue.Queue()
+                    threading.Thread(target=self._run, args=(self._requests,),
+                                     name="embedding-batcher", daemon=True).start()
+                    self._pid = os.getpid()
+        return self._requests
+
+    def _run(self, requests: queue.Queue):
+        while True:
+            batch = [requests.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(requests.get(timeout=remaining) if remaining > 0 else requests.get_nowait())
+                except queue.Empty:
+                    break
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch: List[tuple]):
+        started = time.perf_counter()
+        try:
+            embeddings = self._encode([text for text, _, _ in batch])
+            rows = embeddings.tolist() if hasattr(embeddings, "tolist") else [list(e) for e in embeddings]
+        except Exception as e:
+            logger.error(f"Embedding a batch of {len(batch)} queries failed: {e}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.texts += len(batch)
+        EMBED_BATCH_SIZE.observe(len(batch))
+        EMBED_BATCH_FILL.observe(len(batch) / self.max_batch_size)
+        for (_, future, queued), row in zip(batch, rows):
+            EMBED_QUEUE_SECONDS.observe(started - queued)
+            future.set_result(row)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queued": self._requests.qsize() if self._requests is not None else 0,
+        }
@@ -0,0 +1,91 @@
+"""
+Extractive fallback answers built without the LLM.
+
+When generation fails or cannot finish inside the query's latency budget,
+the pipeline still has the retrieved chunks and the query embedding.
+extractive_answer() splits the chunks into sentences, embeds them in one
+encode() call and ranks them against the query with a single matrix-vector
+product, then returns the best sentences with their sources. It needs
+nothing but the embedding model, so it works while the LLM provider is slow
+or down.
+"""
+
+import logging
+import os
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from chunking import SENTENCE_BOUNDARY_PATTERN
+
+logger = logging.getLogger(__name__)
+
+EXTRACTIVE_SENTENCES = int(os.environ.get("RAG_EXTRACTIVE_SENTENCES", "4"))
+# Caps the encode() call, so the fallback fits in the time reserved for it
+EXTRACTIVE_MAX_CANDIDATES = int(os.environ.get("RAG_EXTRACTIVE_MAX_CANDIDATES", "200"))
+
+# Shorter fragments are headings, list markers or page furniture
+MIN_SENTENCE_WORDS = 5
+
+FALLBACK_PREAMBLE = ("The AI model could not answer in time, so these are the passages from the sources "
+                     "that best match your question:")
+
+def candidate_sentences(retrieved_docs: List[Dict[str, Any]], max_candidates: int = None) -> List[Dict[str, Any]]:
+    """Distinct sentences of the retrieved chunks, in retrieval rank order, with their sources."""
+    max_candidates = max_candidates or EXTRACTIVE_MAX_CANDIDATES
+    seen = set()
+    candidates = []
+    for doc in retrieved_docs:
+        metadata = doc.get("metadata") or {}
+        for sentence in SENTENCE_BOUNDARY_PATTERN.split(doc["document"]):
+            sentence = " ".join(sentence.split())
+            key = sentence.lower()
+            # Overlapping chunks repeat the sentences at their edges
+            if len(sentence.split()) < MIN_SENTENCE_WORDS or key in seen:
+                continue
+            seen.add(key)
+            candidates.append({
+                "text": sentence,
+                "source": metadata.get("source", "Unknown"),
+                "section": metadata.get("section_path"),
+                "page": metadata.get("page_number"),
+            })
+            if len(candidates) == max_candidates:
+                return candidates
+    return candidates
+
+def extractive_answer(query_embedding: List[float], retrieved_docs: List[Dict[str, Any]],
+                      encode: Callable[[List[str]], Any], n_sentences: int = None) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Answer with the retrieved sentences closest to the query.
+
+    Args:
+        query_embedding: Embedding of the query
+        retrieved_docs: Retrieved chunks as returned by retrieve_documents()
+        encode: Embeds a list of texts with the model that embedded the query
+        n_sentences: Sentences in the answer, defaults to RAG_EXTRACTIVE_SENTENCES
+
+    Returns:
+        (answer text, passages): each passage has its text, source, section,
+        page and cosine similarity to the query; both are empty when the
+        chunks have no usable sentences
+    """
+    candidates = candidate_sentences(retrieved_docs)
+    if not candidates:
+        return "", []
+
+    embeddings = np.asarray(encode([c["text"] for c in candidates]), dtype=np.float32)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1) * (np.linalg.norm(query) or 1.0)
+    scores = embeddings @ query / np.where(norms > 0, norms, 1.0)
+
+    n_sentences = min(n_sentences or EXTRACTIVE_SENTENCES, len(candidates))
+    top = np.argpartition(-scores, n_sentences - 1)[:n_sentences]
+    passages = [{**candidates[i], "score": round(float(scores[i]), 4)}
+                for i in sorted(top, key=lambda i: -scores[i])]
+
+    lines = [FALLBACK_PREAMBLE, ""]
+    for passage in passages:
+        citation = passage["source"] + (f", {passage['section']}" if passage["section"] else "")
+        lines.append(f"- {passage['text']} ({citation})")
+    return "\n".join(lines), passages
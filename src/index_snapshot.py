@@ -0,0 +1,407 @@
+"""
+Portable, memory-mapped snapshots of a vector collection.
+
+A snapshot holds everything the numpy vector store serves from in files
+that are memory-mapped as they are: no database and no index rebuild, so a
+cold start costs an mmap, and worker processes mapping the same snapshot
+share its pages in the OS page cache. A snapshot directory contains:
+
+    manifest.json   Format version, embedding model, dimension, row count,
+                    per-source row ranges, metadata value dictionaries, and
+                    the size and SHA-256 of every other file
+    embeddings.f16  Unit-length float16 vectors, row-major little-endian,
+                    with the rows of each source document contiguous
+    ids.col         String columns: the row count and row count + 1 offsets
+    documents.col   as little-endian uint64, then the UTF-8 bytes
+    metadata.codes  int32 matrix (rows x metadata keys) indexing into each
+                    key's value dictionary, -1 where a row lacks the key
+
+Snapshots are written to and restored from ChromaDB with
+
+    python src/index_snapshot.py export --out snapshot
+    python src/index_snapshot.py import --snapshot snapshot
+    python src/index_snapshot.py verify snapshot
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import operator
+import os
+import shutil
+import sys
+from collections.abc import Sequence
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from vector_store import MetadataIndex
+
+logger = logging.getLogger(__name__)
+
+# Directory holding one snapshot per collection, served instead of ChromaDB when set
+SNAPSHOT_DIR = os.environ.get("RAG_SNAPSHOT_DIR")
+# Check every file against its checksum when loading (reads the whole snapshot)
+SNAPSHOT_VERIFY = os.environ.get("RAG_SNAPSHOT_VERIFY", "0") == "1"
+
+SNAPSHOT_FORMAT = 1
+COLLECTIONS = ("dafman_documents", "dafman_sections")
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.f16"
+IDS_FILE = "ids.col"
+DOCUMENTS_FILE = "documents.col"
+METADATA_FILE = "metadata.codes"
+LEXICAL_INDEX_FILE = "bm25_index.npz"
+
+RANGE_OPERATORS = {"$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le}
+
+def snapshot_path(collection_name: str, root: str = None) -> Optional[str]:
+    """Path of a collection's snapshot under the snapshot directory, or None if there is none configured."""
+    root = root or SNAPSHOT_DIR
+    return os.path.join(root, collection_name) if root else None
+
+class StringColumn(Sequence):
+    """Read-only list of strings decoded on access from a memory-mapped column file."""
+
+    def __init__(self, path: str):
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        self._count = int(data[:8].view("<u8")[0])
+        header = 8 * (self._count + 2)
+        self._offsets = data[8:header].view("<u8")
+        self._data = data[header:]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(self._count))]
+        if row < 0:
+            row += self._count
+        if not 0 <= row < self._count:
+            raise IndexError("string column index out of range")
+        return bytes(self._data[self._offsets[row]:self._offsets[row + 1]]).decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        data = bytes(self._data)
+        offsets = self._offsets.tolist()
+        for start, stop in zip(offsets, offsets[1:]):
+            yield data[start:stop].decode("utf-8")
+
+def write_string_column(path: str, strings: List[str]):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    with open(path, "wb") as f:
+        f.write(np.array([len(encoded)], dtype="<u8").tobytes())
+        f.write(offsets.tobytes())
+        for b in encoded:
+            f.write(b)
+
+class MetadataColumns(Sequence):
+    def __init__(self, codes: np.ndarray, keys: List[str], values: List[List[Any]]):
+        """
+        Row metadata stored as dictionary-encoded columns.
+
+        Args:
+            codes: (rows, keys) matrix of indexes into `values`, -1 for a missing key
+            keys: Metadata keys, one per column
+            values: Distinct values of each key
+        """
+        self.codes = codes
+        self.keys = keys
+        self.values = values
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        codes = self.codes[row].tolist()
+        return {key: self.values[j][code] for j, (key, code) in enumerate(zip(self.keys, codes)) if code >= 0}
+
+class ColumnarMetadataIndex(MetadataIndex):
+    """
+    Filters evaluated directly on the dictionary codes of MetadataColumns.
+
+    A condition compares one int32 column against the codes of the values
+    it selects, so no per-value masks are built and nothing is decoded.
+    """
+
+    def __init__(self, columns: MetadataColumns):
+        super().__init__(columns)
+        self.columns = columns
+        self._positions = {key: j for j, key in enumerate(columns.keys)}
+
+    def _value_masks(self, key: str):
+        j = self._positions.get(key)
+        if j is None:
+            return None
+        lookup = self._masks.get(key)
+        if lookup is None:
+            # Keyed by type too, as in write_snapshot, so a True filter doesn't match 1
+            lookup = {(type(value), value): code for code, value in enumerate(self.columns.values[j])}
+            self._masks[key] = lookup
+        return self.columns.codes[:, j], lookup
+
+    def _condition_mask(self, column, op: str, value) -> np.ndarray:
+        if column is None:
+            # No row has the key
+            return super()._condition_mask({}, op, value)
+        codes, lookup = column
+        if op in ("$eq", "$ne"):
+            mask = codes == lookup.get((type(value), value), -2)
+            return mask if op == "$eq" else ~mask
+        if op in ("$in", "$nin"):
+            mask = np.isin(codes, [lookup[(type(v), v)] for v in value if (type(v), v) in lookup])
+            return mask if op == "$in" else ~mask
+        compare = RANGE_OPERATORS.get(op)
+        if compare is None:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        return np.isin(codes, [code for (kind, v), code in lookup.items()
+                               if kind in (int, float) and compare(v, value)])
+
+def write_snapshot(path: str, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+                   embeddings, model_name: str = None, collection_name: str = None) -> Dict[str, Any]:
+    """
+    Write a snapshot, replacing any snapshot at `path` only once it is complete.
+
+    Processes that have the old snapshot mapped keep reading it until they
+    reload.
+
+    Args:
+        path: Snapshot directory
+        ids: Record IDs
+        documents: Record texts
+        metadatas: Record metadata
+        embeddings: Record embeddings (normalized and converted to float16)
+        model_name: Embedding model the vectors come from
+        collection_name: Collection the records come from
+
+    Returns:
+        The manifest
+    """
+    count = len(ids)
+    # Group rows by source document so each one is a contiguous slice
+    order = sorted(range(count), key=lambda row: str((metadatas[row] or {}).get("source", "")))
+    if order:
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(count, -1)[order]
+    else:
+        # ChromaDB returns no embeddings at all for an empty collection
+        matrix = np.zeros((0, np.shape(embeddings)[-1] if np.ndim(embeddings) == 2 else 0), dtype=np.float32)
+    dimension = matrix.shape[1]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = (matrix / np.where(norms == 0, 1, norms)).astype("<f2")
+
+    keys = sorted({key for metadata in metadatas for key in (metadata or {})})
+    positions = {key: j for j, key in enumerate(keys)}
+    values: List[List[Any]] = [[] for _ in keys]
+    # Keyed by type too, so True and 1 stay distinct values
+    dictionaries: List[Dict[Any, int]] = [{} for _ in keys]
+    codes = np.full((count, len(keys)), -1, dtype="<i4")
+    namespaces: Dict[Any, List[int]] = {}
+    scattered = set()
+    for new_row, row in enumerate(order):
+        metadata = metadatas[row] or {}
+        for key, value in metadata.items():
+            j = positions[key]
+            code = dictionaries[j].get((type(value).__name__, value))
+            if code is None:
+                code = dictionaries[j][(type(value).__name__, value)] = len(values[j])
+                values[j].append(value)
+            codes[new_row, j] = code
+        source = metadata.get("source")
+        namespace = namespaces.setdefault(source, [new_row, new_row])
+        if namespace[1] != new_row:
+            scattered.add(source)
+        namespace[1] = new_row + 1
+
+    temporary = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    matrix.tofile(os.path.join(temporary, EMBEDDINGS_FILE))
+    write_string_column(os.path.join(temporary, IDS_FILE), [ids[row] for row in order])
+    write_string_column(os.path.join(temporary, DOCUMENTS_FILE), [documents[row] or "" for row in order])
+    codes.tofile(os.path.join(temporary, METADATA_FILE))
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "collection": collection_name,
+        "model": model_name,
+        "dimension": dimension,
+        "count": count,
+        "dtype": "float16",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "metadata_keys": keys,
+        "metadata_values": values,
+        "namespaces": [[source, start, stop] for source, (start, stop) in namespaces.items()],
+        "scattered_sources": sorted(scattered, key=str),
+        "files": {name: _describe_file(os.path.join(temporary, name))
+                  for name in (EMBEDDINGS_FILE, IDS_FILE, DOCUMENTS_FILE, METADATA_FILE)},
+    }
+    with open(os.path.join(temporary, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+
+    if os.path.exists(path):
+        previous = f"{path}.old-{os.getpid()}"
+        os.rename(path, previous)
+        os.rename(temporary, path)
+        shutil.rmtree(previous)
+    else:
+        os.rename(temporary, path)
+    logger.info(f"Wrote snapshot of {count} records to {path}")
+    return manifest
+
+def _describe_file(path: str) -> Dict[str, Any]:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return {"bytes": os.path.getsize(path), "sha256": digest.hexdigest()}
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format {manifest.get('format')} in {path}")
+    return manifest
+
+def verify_snapshot(path: str) -> Dict[str, Any]:
+    """
+    Check every file of a snapshot against the sizes and checksums in its manifest.
+
+    Raises:
+        ValueError: If a file is missing, truncated or corrupted
+    """
+    manifest = read_manifest(path)
+    for name, expected in manifest["files"].items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path):
+            raise ValueError(f"Snapshot file {file_path} is missing")
+        if _describe_file(file_path) != expected:
+            raise ValueError(f"Snapshot file {file_path} does not match its checksum")
+    return manifest
+
+class Snapshot:
+    def __init__(self, path: str, verify: bool = None):
+        """
+        Memory-map a snapshot.
+
+        Args:
+            path: Snapshot directory
+            verify: Check file checksums first, defaults to RAG_SNAPSHOT_VERIFY
+
+        Raises:
+            ValueError: If the snapshot is incomplete or, when verifying, corrupted
+        """
+        self.path = path
+        self.manifest = verify_snapshot(path) if (SNAPSHOT_VERIFY if verify is None else verify) else read_manifest(path)
+        # Sizes are cheap to check and catch a partly copied snapshot
+        for name, expected in self.manifest["files"].items():
+            file_path = os.path.join(path, name)
+            if not os.path.exists(file_path) or os.path.getsize(file_path) != expected["bytes"]:
+                raise ValueError(f"Snapshot file {file_path} is missing or truncated")
+
+        count, dimension = self.manifest["count"], self.manifest["dimension"]
+        keys = self.manifest["metadata_keys"]
+        self.embeddings = self._map(EMBEDDINGS_FILE, "<f2", (count, dimension))
+        self.ids = StringColumn(os.path.join(path, IDS_FILE))
+        self.documents = StringColumn(os.path.join(path, DOCUMENTS_FILE))
+        self.metadatas = MetadataColumns(self._map(METADATA_FILE, "<i4", (count, len(keys))),
+                                         keys, self.manifest["metadata_values"])
+        self.namespaces = {source: (start, stop) for source, start, stop in self.manifest["namespaces"]}
+        self.scattered_sources = set(self.manifest["scattered_sources"])
+
+    def _map(self, name: str, dtype: str, shape) -> np.ndarray:
+        if 0 in shape:
+            # An empty file cannot be mapped
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode="r", shape=shape)
+
+    def filters(self) -> ColumnarMetadataIndex:
+        return ColumnarMetadataIndex(self.metadatas)
+
+    def __len__(self) -> int:
+        return self.manifest["count"]
+
+def export_collection(collection, path: str, model_name: str = None) -> Dict[str, Any]:
+    """Write a snapshot of every record in a ChromaDB collection."""
+    records = collection.get(include=["documents", "metadatas", "embeddings"])
+    return write_snapshot(path, records["ids"], records["documents"], records["metadatas"],
+                          records["embeddings"], model_name=model_name, collection_name=collection.name)
+
+def import_snapshot(path: str, collection, batch_size: int = 1000) -> int:
+    """Upsert every record of a snapshot into a ChromaDB collection; returns the number of records."""
+    snapshot = Snapshot(path, verify=True)
+    for start in range(0, len(snapshot), batch_size):
+        stop = min(start + batch_size, len(snapshot))
+        collection.upsert(
+            ids=snapshot.ids[start:stop],
+            documents=snapshot.documents[start:stop],
+            metadatas=snapshot.metadatas[start:stop],
+            embeddings=np.asarray(snapshot.embeddings[start:stop], dtype=np.float32).tolist(),
+        )
+    return len(snapshot)
+
+def _copy_file(source: str, destination: str):
+    os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+    temporary = f"{destination}.tmp-{os.getpid()}"
+    shutil.copyfile(source, temporary)
+    os.replace(temporary, destination)
+
+def main():
+    from lexical_index import LEXICAL_INDEX_PATH
+    from model_registry import DEFAULT_EMBEDDING_MODEL, get_chroma_client
+
+    parser = argparse.ArgumentParser(description="Export, import and verify vector index snapshots.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Snapshot the ChromaDB collections")
+    export.add_argument("--chroma", default="./chroma_db", help="ChromaDB directory")
+    export.add_argument("--out", default=SNAPSHOT_DIR, required=not SNAPSHOT_DIR, help="Snapshot directory")
+    export.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL, help="Embedding model of the collections")
+    restore = commands.add_parser("import", help="Load snapshots into the ChromaDB collections")
+    restore.add_argument("--chroma", default="./chroma_db", help="ChromaDB directory")
+    restore.add_argument("--snapshot", default=SNAPSHOT_DIR, required=not SNAPSHOT_DIR, help="Snapshot directory")
+    verify = commands.add_parser("verify", help="Check snapshot checksums")
+    verify.add_argument("snapshot", nargs="?", default=SNAPSHOT_DIR, help="Snapshot directory")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "export":
+        client = get_chroma_client(args.chroma)
+        existing = {getattr(c, "name", c) for c in client.list_collections()}
+        for name in COLLECTIONS:
+            if name in existing:
+                manifest = export_collection(client.get_collection(name), snapshot_path(name, args.out), args.model)
+                print(f"{name}: {manifest['count']} records")
+        if os.path.exists(LEXICAL_INDEX_PATH):
+            _copy_file(LEXICAL_INDEX_PATH, os.path.join(args.out, LEXICAL_INDEX_FILE))
+    elif args.command == "import":
+        client = get_chroma_client(args.chroma)
+        for name in COLLECTIONS:
+            path = snapshot_path(name, args.snapshot)
+            if os.path.exists(path):
+                count = import_snapshot(path, client.get_or_create_collection(name=name))
+                print(f"{name}: {count} records")
+        lexical_path = os.path.join(args.snapshot, LEXICAL_INDEX_FILE)
+        if os.path.exists(lexical_path):
+            _copy_file(lexical_path, LEXICAL_INDEX_PATH)
+    else:
+        failed = False
+        for name in COLLECTIONS:
+            path = snapshot_path(name, args.snapshot)
+            if not os.path.exists(path):
+                continue
+            try:
+                manifest = verify_snapshot(path)
+                print(f"{name}: ok ({manifest['count']} records, model {manifest['model']})")
+            except ValueError as e:
+                failed = True
+                print(f"{name}: {e}")
+        sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
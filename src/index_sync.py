@@ -0,0 +1,126 @@
+"""
+Incremental synchronisation of document chunks into a ChromaDB collection.
+
+Chunk IDs are derived from a hash of the source document and the chunk text,
+so re-ingesting a document only embeds chunks whose text is new, deletes
+chunks that disappeared, and leaves everything else in place. Changes are
+embedded first and written in one commit step at the end; the collection is
+never dropped, so it stays queryable while a document is re-ingested.
+"""
+
+import hashlib
+import logging
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Stay well under ChromaDB's maximum batch size for a single write
+WRITE_BATCH_SIZE = 1000
+
+def content_chunk_id(source: str, text: str, occurrence: int = 0) -> str:
+    """
+    Derive a stable chunk ID from the source document and the chunk text.
+
+    Args:
+        source: Source document identifier
+        text: Chunk text
+        occurrence: Index among identical chunks of the same source
+
+    Returns:
+        Hex digest used as the ChromaDB ID
+    """
+    key = f"{source}\0{text}\0{occurrence}" if occurrence else f"{source}\0{text}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+def assign_chunk_ids(source: str, texts: List[str]) -> List[str]:
+    """Content IDs for a document's chunks, disambiguating repeated texts."""
+    seen: Dict[str, int] = {}
+    ids = []
+    for text in texts:
+        occurrence = seen.get(text, 0)
+        seen[text] = occurrence + 1
+        ids.append(content_chunk_id(source, text, occurrence))
+    return ids
+
+def plan_sync(collection, source: str, ids: List[str], documents: List[str],
+              metadatas: List[Dict[str, Any]], embed: Callable[[List[str]], List[List[float]]]) -> Dict[str, Any]:
+    """
+    Work out and embed the changes needed to make one source match the given chunks.
+
+    Nothing is written, so the collection keeps serving the previous version
+    until apply_sync() commits the plan.
+
+    Args:
+        collection: ChromaDB collection
+        source: Value of the "source" metadata field identifying the document
+        ids: Content IDs of the chunks (see assign_chunk_ids)
+        documents: Chunk texts
+        metadatas: Chunk metadata, each including "source"
+        embed: Function embedding a list of texts
+
+    Returns:
+        Sync plan for apply_sync()
+    """
+    stored = collection.get(where={"source": source}, include=["metadatas"])
+    stored_metadata = dict(zip(stored["ids"], stored["metadatas"]))
+
+    new = [i for i, chunk_id in enumerate(ids) if chunk_id not in stored_metadata]
+    changed = [i for i, chunk_id in enumerate(ids)
+               if chunk_id in stored_metadata and stored_metadata[chunk_id] != metadatas[i]]
+    wanted = set(ids)
+    stale = [chunk_id for chunk_id in stored_metadata if chunk_id not in wanted]
+    logger.info(f"Syncing {source}: {len(new)} new, {len(changed)} updated, {len(stale)} stale chunks")
+
+    embeddings = embed([documents[i] for i in new]) if new else []
+    return {
+        "collection": collection,
+        "add": {
+            "ids": [ids[i] for i in new],
+            "documents": [documents[i] for i in new],
+            "metadatas": [metadatas[i] for i in new],
+            "embeddings": embeddings,
+        },
+        "update": {
+            "ids": [ids[i] for i in changed],
+            "metadatas": [metadatas[i] for i in changed],
+        },
+        "delete": stale,
+        "total": len(ids),
+    }
+
+def apply_sync(plan: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Commit a sync plan.
+
+    Returns:
+        Counts of added, updated (metadata only), deleted and unchanged chunks
+    """
+    collection = plan["collection"]
+    add, update, delete = plan["add"], plan["update"], plan["delete"]
+
+    # Add first and delete last so the document never disappears from the index
+    for start in range(0, len(add["ids"]), WRITE_BATCH_SIZE):
+        end = start + WRITE_BATCH_SIZE
+        collection.upsert(
+            ids=add["ids"][start:end],
+            documents=add["documents"][start:end],
+            metadatas=add["metadatas"][start:end],
+            embeddings=add["embeddings"][start:end]
+        )
+    for start in range(0, len(update["ids"]), WRITE_BATCH_SIZE):
+        end = start + WRITE_BATCH_SIZE
+        collection.update(ids=update["ids"][start:end], metadatas=update["metadatas"][start:end])
+    for start in range(0, len(delete), WRITE_BATCH_SIZE):
+        collection.delete(ids=delete[start:start + WRITE_BATCH_SIZE])
+
+    return {
+        "added": len(add["ids"]),
+        "updated": len(update["ids"]),
+        "deleted": len(delete),
+        "unchanged": plan["total"] - len(add["ids"]) - len(update["ids"]),
+    }
+
+def sync_collection(collection, source: str, ids: List[str], documents: List[str],
+                    metadatas: List[Dict[str, Any]], embed: Callable[[List[str]], List[List[float]]]) -> Dict[str, int]:
+    """Plan and immediately commit a sync, see plan_sync() for the arguments."""
+    return apply_sync(plan_sync(collection, source, ids, documents, metadatas, embed))
@@ -0,0 +1,191 @@
+"""
+Background document ingestion jobs.
+
+Ingestion (extraction, chunking, embedding and the ChromaDB commit) runs on a
+worker thread so the request that submits it returns immediately with a job
+id. Jobs report their stage and embedding progress and can be cancelled until
+they start committing to the index.
+
+Job state lives in the memory of the process that runs the job.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation was requested."""
+
+class IngestionJob:
+    def __init__(self, pdf_path: str):
+        self.id = uuid.uuid4().hex
+        self.pdf_path = pdf_path
+        self.status = "queued"
+        self.stage = "queued"
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.current_document: Optional[str] = None
+        self.documents_total = 1
+        self.documents_done = 0
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._embedding_started_at: Optional[float] = None
+        self._cancel_requested = threading.Event()
+        self._committing = False
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage: str):
+        """Record the current stage and honour pending cancellation requests."""
+        self.check_cancelled()
+        with self._lock:
+            self.stage = stage
+            if stage == "committing":
+                # Past this point the index is being written and the job runs to completion
+                self._committing = True
+        logger.info(f"Ingestion job {self.id}: {stage}")
+
+    def start_document(self, pdf_path: str, index: int, total: int):
+        """Move on to the next document of a multi-document job."""
+        self.check_cancelled()
+        with self._lock:
+            self.current_document = pdf_path
+            self.documents_done = index
+            self.documents_total = total
+            # Earlier documents are committed, this one can still be cancelled
+            self._committing = False
+
+    def start_embedding(self, total: int):
+        with self._lock:
+            self.chunks_total = total
+            self.chunks_embedded = 0
+            self._embedding_started_at = time.time()
+
+    def advance(self, count: int):
+        """Record embedded chunks and stop if the job was cancelled."""
+        with self._lock:
+            self.chunks_embedded += count
+        self.check_cancelled()
+
+    def cancel(self) -> bool:
+        """Request cancellation. Returns False if the job can no longer be cancelled."""
+        with self._lock:
+            if self.status not in ("queued", "running") or self._committing:
+                return False
+            self._cancel_requested.set()
+            return True
+
+    def check_cancelled(self):
+        if self._cancel_requested.is_set() and not self._committing:
+            raise JobCancelled(f"Ingestion job {self.id} was cancelled")
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            throughput = None
+            eta_seconds = None
+            if self._embedding_started_at and self.chunks_embedded:
+                elapsed = time.time() - self._embedding_started_at
+                throughput = self.chunks_embedded / elapsed if elapsed > 0 else None
+                if throughput and self.chunks_total > self.chunks_embedded and self.stage == "embedding":
+                    eta_seconds = round((self.chunks_total - self.chunks_embedded) / throughput, 1)
+            end = self.finished_at or time.time()
+            return {
+                "job_id": self.id,
+                "pdf_path": self.pdf_path,
+                "status": self.status,
+                "stage": self.stage,
+                "current_document": self.current_document,
+                "documents_done": self.documents_done,
+                "documents_total": self.documents_total,
+                "chunks_total": self.chunks_total,
+                "chunks_embedded": self.chunks_embedded,
+                "throughput_chunks_per_second": round(throughput, 2) if throughput else None,
+                "eta_seconds": eta_seconds,
+                "elapsed_seconds": round(end - self.started_at, 1) if self.started_at else None,
+                "result": self.result,
+                "error": self.error,
+            }
+
+class IngestionJobManager:
+    def __init__(self, max_workers: int = 1, max_finished_jobs: int = 50):
+        """
+        Initialize the job manager.
+
+        Args:
+            max_workers: Number of jobs that run at the same time
+            max_finished_jobs: Finished jobs kept around for status polling
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingestion")
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._max_finished_jobs = max_finished_jobs
+        self._lock = threading.Lock()
+
+    def submit(self, run: Callable[[str, IngestionJob], Dict[str, Any]], pdf_path: str,
+               on_success: Callable[[Dict[str, Any]], None] = None) -> IngestionJob:
+        """
+        Queue an ingestion job, or return the active job for the same document.
+
+        Args:
+            run: Function doing the ingestion, called with the PDF path and the job
+            pdf_path: Document to ingest
+            on_success: Called with the result after the new index is committed
+
+        Returns:
+            The queued or already active job
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.pdf_path == pdf_path and job.status in ("queued", "running"):
+                    return job
+            job = IngestionJob(pdf_path)
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, run, on_success)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[IngestionJob]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.submitted_at, reverse=True)
+
+    def _run(self, job: IngestionJob, run, on_success):
+        job.started_at = time.time()
+        job.status = "running"
+        try:
+            job.check_cancelled()
+            result = run(job.pdf_path, job)
+            job.result = result
+            if result.get("status") == "error":
+                job.status = "failed"
+                job.error = result.get("error")
+            else:
+                # A multi-document job cancelled part way has still committed some documents
+                job.status = "cancelled" if result.get("status") == "cancelled" else "succeeded"
+                if on_success:
+                    on_success(result)
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            logger.error(f"Ingestion job {job.id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.stage = job.status
+            job.finished_at = time.time()
+            logger.info(f"Ingestion job {job.id} finished with status {job.status}")
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.finished_at]
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:max(0, len(finished) - self._max_finished_jobs)]:
+            del self._jobs[job.id]
@@ -0,0 +1,206 @@
+"""
+BM25 inverted index over the chunk collection.
+
+Embeddings blur exact identifiers such as form numbers, AFSC codes and
+paragraph numbers; a lexical index matches them exactly. The index covers
+the same chunk IDs as the ChromaDB collection and is rebuilt from it after
+every ingestion. Postings are stored in CSR layout (one array of row indices
+and one of term frequencies, sliced per term), so scoring a query is a few
+vectorized numpy operations. The whole index is one .npz file, replaced
+atomically.
+"""
+
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from vector_store import MetadataIndex
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_PATH = os.environ.get("RAG_LEXICAL_INDEX_PATH", "./chroma_db/bm25_index.npz")
+
+# Identifiers keep their inner separators: "36-2664", "1.2.3", "af-1168", "3f0x1"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+PART_PATTERN = re.compile(r"[-./]")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or that the this to was what when "
+    "where which who will with does do can should i my me we our you your".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokens with stopwords removed.
+
+    Compound identifiers are emitted whole and as their parts, so "36-2664"
+    also matches a query for "36 2664".
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if PART_PATTERN.search(token):
+            tokens.extend(part for part in PART_PATTERN.split(token) if part and part not in STOPWORDS)
+    return tokens
+
+class BM25Index:
+    def __init__(self, ids: List[str], metadatas: List[Dict[str, Any]], terms: List[str],
+                 offsets: np.ndarray, rows: np.ndarray, frequencies: np.ndarray,
+                 lengths: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        """
+        Wrap prebuilt postings; use build() or load() to create one.
+
+        Args:
+            ids: Chunk ID of each row
+            metadatas: Chunk metadata of each row, for `where` filters
+            terms: Sorted vocabulary
+            offsets: Postings of terms[t] are rows[offsets[t]:offsets[t + 1]]
+            rows: Row index of each posting
+            frequencies: Term frequency of each posting
+            lengths: Token count of each row
+            k1: BM25 term frequency saturation
+            b: BM25 length normalization
+        """
+        self.ids = list(ids)
+        self.metadatas = list(metadatas)
+        self.filters = MetadataIndex(self.metadatas)
+        self.term_index = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.rows = rows
+        self.frequencies = frequencies
+        self.lengths = lengths
+        self.k1 = k1
+        self.b = b
+
+        count = len(self.ids)
+        document_frequency = np.diff(offsets).astype(np.float64)
+        self.idf = np.log1p((count - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        average_length = float(lengths.mean()) if count else 0.0
+        # Per-row part of the BM25 denominator, precomputed once
+        self.length_norm = (k1 * (1 - b + b * lengths / max(average_length, 1e-9))).astype(np.float32)
+
+    @classmethod
+    def build(cls, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]]) -> "BM25Index":
+        """Build the index from chunk texts."""
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = np.zeros(len(ids), dtype=np.float32)
+        for row, document in enumerate(documents):
+            tokens = tokenize(document or "")
+            lengths[row] = len(tokens)
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, frequency in counts.items():
+                postings.setdefault(token, []).append((row, frequency))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        rows, frequencies = [], []
+        for i, term in enumerate(terms):
+            term_postings = postings[term]
+            offsets[i + 1] = offsets[i] + len(term_postings)
+            rows.extend(row for row, _ in term_postings)
+            frequencies.extend(frequency for _, frequency in term_postings)
+        return cls(ids, metadatas, terms, offsets, np.asarray(rows, dtype=np.int32),
+                   np.asarray(frequencies, dtype=np.float32), lengths)
+
+    @classmethod
+    def from_collection(cls, collection) -> "BM25Index":
+        records = collection.get(include=["documents", "metadatas"])
+        return cls.build(records["ids"], records["documents"], records["metadatas"])
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path, allow_pickle=False) as data:
+            records = json.loads(data["records"].tobytes().decode("utf-8"))
+            return cls(records["ids"], records["metadatas"], records["terms"], data["offsets"],
+                       data["rows"], data["frequencies"], data["lengths"])
+
+    def save(self, path: str):
+        """Write the index to one .npz file, replacing any previous version atomically."""
+        terms = [None] * len(self.term_index)
+        for term, i in self.term_index.items():
+            terms[i] = term
+        records = json.dumps({"ids": self.ids, "metadatas": self.metadatas, "terms": terms}).encode("utf-8")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, records=np.frombuffer(records, dtype=np.uint8), offsets=self.offsets, rows=self.rows,
+                 frequencies=self.frequencies, lengths=self.lengths)
+        os.replace(tmp_path, path)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every row for a query."""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        slices = []
+        for term in set(tokenize(query)):
+            t = self.term_index.get(term)
+            if t is not None:
+                slices.append((t, self.offsets[t], self.offsets[t + 1]))
+        if not slices:
+            return scores
+
+        rows = np.concatenate([self.rows[start:end] for _, start, end in slices])
+        frequencies = np.concatenate([self.frequencies[start:end] for _, start, end in slices])
+        idf = np.concatenate([np.full(end - start, self.idf[t], dtype=np.float32) for t, start, end in slices])
+        contributions = idf * frequencies * (self.k1 + 1) / (frequencies + self.length_norm[rows])
+        return np.bincount(rows, weights=contributions, minlength=len(self.ids)).astype(np.float32)
+
+    def search(self, query: str, n_results: int = 5, where: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+        """
+        Top rows for a query by BM25 score.
+
+        Args:
+            query: Query text
+            n_results: Maximum number of results
+            where: ChromaDB-style metadata filter
+
+        Returns:
+            (chunk_id, score) pairs, best first, only rows matching at least one term
+        """
+        scores = self.scores(query)
+        if where:
+            scores[~self.filters.mask(where)] = 0
+        matching = np.flatnonzero(scores > 0)
+        if len(matching) == 0:
+            return []
+        k = min(n_results, len(matching))
+        top = matching[np.argpartition(-scores[matching], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[row], float(scores[row])) for row in top]
+
+def rebuild_lexical_index(collection, path: str = None) -> BM25Index:
+    """Rebuild the on-disk BM25 index from every chunk in a collection."""
+    path = path or LEXICAL_INDEX_PATH
+    index = BM25Index.from_collection(collection)
+    index.save(path)
+    logger.info(f"Wrote BM25 index with {len(index)} chunks and {len(index.term_index)} terms to {path}")
+    return index
+
+def load_lexical_index(path: str = None) -> Optional[BM25Index]:
+    """Load the BM25 index, or None if ingestion has not built one yet."""
+    path = path or LEXICAL_INDEX_PATH
+    if not os.path.exists(path):
+        return None
+    return BM25Index.load(path)
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Fuse ranked ID lists with reciprocal rank fusion.
+
+    Each list contributes 1 / (k + rank) to an ID's score, so IDs ranked
+    highly by either retriever float to the top without having to put BM25
+    scores and cosine distances on a common scale.
+    """
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,343 @@
+"""
+Pooled client for OpenAI-compatible chat completion APIs (Groq by default).
+
+One httpx connection pool is shared by every request of the process. Each
+call has a deadline covering retries, transient failures are retried with
+jittered exponential backoff, an optional semaphore caps the calls in flight
+(the pipeline bounds them with admission control instead, see admission), and a
+circuit breaker fails fast while the provider is down instead of tying up
+every worker until its timeout.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+LLM_BASE_URL = os.environ.get("RAG_LLM_BASE_URL", "https://api.groq.com/openai/v1")
+LLM_API_KEY = os.environ.get("RAG_LLM_API_KEY") or os.environ.get("GROQ_API_KEY")
+LLM_MODEL = os.environ.get("RAG_LLM_MODEL", "llama3-8b-8192")
+LLM_TIMEOUT = float(os.environ.get("RAG_LLM_TIMEOUT", "30"))
+LLM_CONNECT_TIMEOUT = float(os.environ.get("RAG_LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_RETRIES = int(os.environ.get("RAG_LLM_MAX_RETRIES", "2"))
+LLM_POOL_SIZE = int(os.environ.get("RAG_LLM_POOL_SIZE", "20"))
+LLM_BREAKER_THRESHOLD = int(os.environ.get("RAG_LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.environ.get("RAG_LLM_BREAKER_COOLDOWN", "30"))
+
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.25
+BACKOFF_MAX = 4.0
+
+class LLMError(Exception):
+    """The completion could not be produced."""
+
+class LLMTimeoutError(LLMError):
+    """The call's deadline passed."""
+
+class LLMStatusError(LLMError):
+    """The provider answered with an HTTP error status."""
+
+    def __init__(self, status_code: int, body: str, retry_after: Optional[str]):
+        super().__init__(f"LLM provider returned HTTP {status_code}: {body}")
+        self.status_code = status_code
+        try:
+            self.retry_after = float(retry_after) if retry_after else None
+        except ValueError:
+            self.retry_after = None
+
+class CircuitOpenError(LLMError):
+    """The provider has been failing, calls are rejected until the cooldown ends."""
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, cooldown_seconds: float):
+        """
+        Consecutive-failure circuit breaker.
+
+        After `failure_threshold` consecutive failures the circuit opens and
+        calls are rejected for `cooldown_seconds`; then a single trial call is
+        let through (half-open) and its outcome closes or reopens the circuit.
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self._state()
+            if state == "open" or (state == "half_open" and self.trial_in_flight):
+                raise CircuitOpenError("LLM provider circuit is open after repeated failures")
+            if state == "half_open":
+                self.trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            failed_trial = self.trial_in_flight
+            self.trial_in_flight = False
+            if failed_trial or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+                logger.warning(f"LLM circuit opened after {self.failures} consecutive failures")
+
+class LLMClient:
+    def __init__(self, base_url: str = None, api_key: str = None, model: str = None, timeout: float = None,
+                 max_retries: int = None, max_concurrency: int = None, pool_size: int = None,
+                 breaker_threshold: int = None, breaker_cooldown: float = None):
+        """
+        Create a client; every argument defaults to its RAG_LLM_* environment variable.
+
+        Args:
+            base_url: OpenAI-compatible API root, e.g. https://api.groq.com/openai/v1
+            api_key: Bearer token, defaults to RAG_LLM_API_KEY or GROQ_API_KEY
+            model: Model name sent with every request
+            timeout: Default deadline per call in seconds, covering retries
+            max_retries: Retries after the first attempt for transient failures
+            max_concurrency: Calls in flight at once through this client, unbounded when None or 0
+            pool_size: Maximum pooled connections
+            breaker_threshold: Consecutive failures that open the circuit
+            breaker_cooldown: Seconds the circuit stays open
+        """
+        self.base_url = (base_url or LLM_BASE_URL).rstrip("/")
+        self.model = model or LLM_MODEL
+        self.timeout = timeout or LLM_TIMEOUT
+        self.max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.max_concurrency = max_concurrency or None
+        pool_size = pool_size or LLM_POOL_SIZE
+        api_key = api_key or LLM_API_KEY
+        if not api_key:
+            # Local OpenAI-compatible servers may not need one; the provider rejects calls without it
+            logger.error(f"No LLM API key configured for {self.base_url}: set RAG_LLM_API_KEY or GROQ_API_KEY")
+        self.http = httpx.Client(
+            base_url=self.base_url,
+            headers={"Authorization": f"Bearer {api_key}"} if api_key else {},
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(self.timeout, connect=LLM_CONNECT_TIMEOUT),
+        )
+        self.breaker = CircuitBreaker(breaker_threshold or LLM_BREAKER_THRESHOLD,
+                                      LLM_BREAKER_COOLDOWN if breaker_cooldown is None else breaker_cooldown)
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency) if self.max_concurrency else None
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._counters = {"requests": 0, "successes": 0, "failures": 0, "retries": 0, "rejected": 0, "timeouts": 0}
+
+    def chat(self, messages: List[Dict[str, str]], temperature: float = 0.7, max_tokens: int = 512,
+             timeout: float = None, usage: Dict[str, Any] = None) -> str:
+        """
+        Return the completion text for a list of chat messages.
+
+        Args:
+            usage: Filled with the provider's token usage report when given
+
+        Raises:
+            LLMError: When the provider fails, the deadline passes or the circuit is open
+        """
+        payload = {"model": self.model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+        deadline = time.monotonic() + (timeout or self.timeout)
+        with self._slot(deadline):
+            for attempt in self._attempts(deadline):
+                with attempt:
+                    response = self.http.post("/chat/completions", json=payload, timeout=self._attempt_timeout(deadline))
+                    self._raise_for_status(response)
+                    body = response.json()
+                    if usage is not None:
+                        usage.update(body.get("usage") or {})
+                    return body["choices"][0]["message"]["content"]
+
+    def chat_stream(self, messages: List[Dict[str, str]], temperature: float = 0.7, max_tokens: int = 512,
+                    timeout: float = None) -> Iterator[str]:
+        """
+        Yield the completion text as the provider streams it.
+
+        Failures are only retried before the first piece of text is yielded.
+
+        Raises:
+            LLMError: When the provider fails, the deadline passes or the circuit is open
+        """
+        payload = {"model": self.model, "messages": messages, "temperature": temperature,
+                   "max_tokens": max_tokens, "stream": True}
+        deadline = time.monotonic() + (timeout or self.timeout)
+        with self._slot(deadline):
+            for attempt in self._attempts(deadline):
+                with attempt:
+                    with self.http.stream("POST", "/chat/completions", json=payload,
+                                          timeout=self._attempt_timeout(deadline)) as response:
+                        self._raise_for_status(response)
+                        for line in response.iter_lines():
+                            if time.monotonic() > deadline:
+                                raise LLMTimeoutError("LLM stream exceeded its deadline")
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                break
+                            delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                            if delta:
+                                attempt.committed = True
+                                yield delta
+                    return
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._counters, in_flight=self._in_flight)
+        stats.update({
+            "model": self.model,
+            "base_url": self.base_url,
+            "max_concurrency": self.max_concurrency,
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.times_opened,
+        })
+        return stats
+
+    def close(self):
+        self.http.close()
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            self._counters[counter] += 1
+
+    def _slot(self, deadline: float):
+        return _ConcurrencySlot(self, deadline)
+
+    def _attempts(self, deadline: float) -> Iterator["_Attempt"]:
+        """Yield one context manager per attempt until one succeeds or retries run out."""
+        self._count("requests")
+        for number in range(self.max_retries + 1):
+            attempt = _Attempt(self, number, deadline)
+            yield attempt
+            if attempt.succeeded:
+                return
+            if not attempt.retry or number == self.max_retries:
+                raise attempt.error
+            self._count("retries")
+            # Full jitter keeps many workers from retrying in lockstep
+            delay = attempt.retry_after or random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** number))
+            if time.monotonic() + delay >= deadline:
+                raise LLMTimeoutError(f"LLM call ran out of time after {number + 1} attempts: {attempt.error}")
+            logger.warning(f"Retrying LLM call in {delay:.2f}s after: {attempt.error}")
+            time.sleep(delay)
+
+    def _attempt_timeout(self, deadline: float) -> httpx.Timeout:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMTimeoutError("LLM call exceeded its deadline")
+        return httpx.Timeout(remaining, connect=min(LLM_CONNECT_TIMEOUT, remaining))
+
+    @staticmethod
+    def _raise_for_status(response: httpx.Response):
+        if response.status_code >= 400:
+            response.read()
+            raise LLMStatusError(response.status_code, response.text[:200], response.headers.get("retry-after"))
+
+class _ConcurrencySlot:
+    def __init__(self, client: LLMClient, deadline: float):
+        self.client = client
+        self.deadline = deadline
+
+    def __enter__(self):
+        client = self.client
+        # Wait for a slot first, so a half-open circuit's trial call is not stuck behind the wait
+        if client._semaphore and not client._semaphore.acquire(timeout=max(0.0, self.deadline - time.monotonic())):
+            client._count("timeouts")
+            raise LLMTimeoutError("Timed out waiting for an LLM concurrency slot")
+        try:
+            client.breaker.before_call()
+        except CircuitOpenError:
+            if client._semaphore:
+                client._semaphore.release()
+            client._count("rejected")
+            raise
+        with client._stats_lock:
+            client._in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        client = self.client
+        with client._stats_lock:
+            client._in_flight -= 1
+        if client._semaphore:
+            client._semaphore.release()
+        if exc_type is None or exc_type is GeneratorExit:
+            client.breaker.record_success()
+            client._count("successes")
+            return False
+        client._count("failures")
+        if isinstance(exc, LLMTimeoutError):
+            # A provider that hangs is as down as one refusing connections
+            client._count("timeouts")
+            client.breaker.record_failure()
+        elif isinstance(exc, LLMStatusError) and exc.status_code < 500 and exc.status_code not in RETRY_STATUS_CODES:
+            # The provider answered, the request itself was rejected (bad key, bad payload)
+            client.breaker.record_success()
+        else:
+            client.breaker.record_failure()
+        return False
+
+class _Attempt:
+    """Context manager classifying the outcome of one attempt."""
+
+    def __init__(self, client: LLMClient, number: int, deadline: float):
+        self.client = client
+        self.number = number
+        self.deadline = deadline
+        self.succeeded = False
+        self.retry = False
+        self.retry_after = None
+        self.error = None
+        # Set once a stream has yielded text; after that the call cannot be replayed
+        self.committed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None or exc_type is GeneratorExit:
+            self.succeeded = exc_type is None
+            return False
+        if isinstance(exc, LLMTimeoutError):
+            return False
+        if isinstance(exc, httpx.TimeoutException):
+            self.error = LLMTimeoutError(f"LLM request timed out: {exc}")
+            self.retry = not self.committed
+        elif isinstance(exc, httpx.TransportError):
+            self.error = LLMError(f"LLM connection failed: {exc}")
+            self.retry = not self.committed
+        elif isinstance(exc, LLMStatusError):
+            self.error = exc
+            self.retry = exc.status_code in RETRY_STATUS_CODES and not self.committed
+            if exc.retry_after is not None:
+                self.retry_after = min(exc.retry_after, BACKOFF_MAX)
+        elif isinstance(exc, (KeyError, IndexError, ValueError)):
+            self.error = LLMError(f"Malformed LLM response: {exc}")
+        else:
+            return False
+        # Swallow the exception; _attempts() decides whether to retry or raise
+        return True
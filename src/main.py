@@ -1,17 +1,35 @@
 import os
 import sys
-from flask import Flask, send_from_directory
+from flask import Flask, Response, send_from_directory
 from flask_cors import CORS
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__))))
 
-from routes.chatbot import chatbot_bp
+from routes.chatbot import chatbot_bp, start_warmup
+from metrics import CONTENT_TYPE, render_metrics
+
+# With gunicorn --preload, load the embedding model in the master process so
+# forked workers share its weights copy-on-write instead of each loading a copy
+if os.environ.get('PRELOAD_MODELS') == '1':
+    from model_registry import preload
+    preload()
 
 app = Flask(__name__, static_folder='static', static_url_path='/')
 CORS(app)  # Enable CORS for all routes
 
 app.register_blueprint(chatbot_bp, url_prefix='/api/chatbot')
 
+# Each worker warms up on its first request (typically the readiness probe),
+# after gunicorn has forked it, so threads and model state are its own
+@app.before_request
+def begin_warmup():
+    start_warmup()
+
+@app.route('/metrics')
+def metrics():
+    """Query latency, per-stage timing and token histograms for Prometheus."""
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
 @app.route('/')
 def serve_index():
     return send_from_directory(app.static_folder, 'index.html')
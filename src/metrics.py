@@ -0,0 +1,203 @@
+"""
+Request tracing and Prometheus metrics for the RAG pipeline.
+
+QueryTrace times the stages of one query (embed, retrieve, context build,
+generate) and records token counts. Finished traces are aggregated into
+histograms rendered in the Prometheus text exposition format at /metrics,
+and traces slower than RAG_SLOW_QUERY_MS are written to the slow-query log.
+
+Metrics live in process memory, so with several gunicorn workers each
+scrape sees the worker that answered it; Prometheus aggregates across
+scrapes by instance.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.environ.get("RAG_SLOW_QUERY_MS", "5000"))
+SLOW_QUERY_LOG = os.environ.get("RAG_SLOW_QUERY_LOG")
+RETURN_TIMINGS = os.environ.get("RAG_RETURN_TIMINGS", "0") == "1"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+FILL_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0)
+QUEUE_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+slow_query_logger = logging.getLogger("rag.slow_queries")
+if SLOW_QUERY_LOG:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_query_logger.addHandler(_handler)
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label set: [bucket counts..., sum, count]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    bucket_label = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, bucket_label)} {_format_value(count)}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+                lines.append(f"{self.name}_count{labels} {_format_value(series[-1])}")
+        return lines
+
+QUERY_SECONDS = Histogram("rag_query_seconds", "End-to-end query latency.", ("mode", "cache_hit"))
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Latency of each query stage.", ("stage",))
+PROMPT_TOKENS = Histogram("rag_prompt_tokens", "Prompt tokens sent to the LLM per query.", buckets=TOKEN_BUCKETS)
+COMPLETION_TOKENS = Histogram("rag_completion_tokens", "Completion tokens generated per query.", buckets=TOKEN_BUCKETS)
+QUERIES_TOTAL = Counter("rag_queries_total", "Queries answered.", ("mode", "status"))
+SLOW_QUERIES_TOTAL = Counter("rag_slow_queries_total", "Queries slower than RAG_SLOW_QUERY_MS.")
+EMBED_BATCH_SIZE = Histogram("rag_embed_batch_size", "Query embeddings encoded per micro-batch.",
+                             buckets=BATCH_SIZE_BUCKETS)
+EMBED_BATCH_FILL = Histogram("rag_embed_batch_fill_ratio", "Micro-batch size as a fraction of RAG_EMBED_MAX_BATCH.",
+                             buckets=FILL_BUCKETS)
+EMBED_QUEUE_SECONDS = Histogram("rag_embed_queue_seconds", "Time a query waited for its embedding batch to start.",
+                                buckets=QUEUE_BUCKETS)
+COALESCED_REQUESTS_TOTAL = Counter("rag_coalesced_requests_total",
+                                  "Queries answered by an identical query already in flight.", ("kind",))
+ADMISSION_WAIT_SECONDS = Histogram("rag_admission_wait_seconds", "Time a query waited for an LLM call slot.")
+ADMISSION_REJECTED_TOTAL = Counter("rag_admission_rejected_total",
+                                   "Queries rejected with 503 because no LLM call slot was free in time.", ("reason",))
+
+REGISTRY = [QUERY_SECONDS, STAGE_SECONDS, PROMPT_TOKENS, COMPLETION_TOKENS, QUERIES_TOTAL, SLOW_QUERIES_TOTAL,
+            EMBED_BATCH_SIZE, EMBED_BATCH_FILL, EMBED_QUEUE_SECONDS, COALESCED_REQUESTS_TOTAL,
+            ADMISSION_WAIT_SECONDS, ADMISSION_REJECTED_TOTAL]
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class QueryTrace:
+    def __init__(self, query: str, mode: str = None):
+        """Timings and token counts of one query."""
+        self.query = query
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.tokens: Dict[str, int] = {}
+        self.cache_hit = False
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a block as one stage; repeated stages accumulate."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float, observe: bool = True):
+        """
+        Add time to a stage.
+
+        Args:
+            name: Stage name
+            seconds: Time spent
+            observe: Also count it in the stage histogram; False for a share
+                of work already observed elsewhere (e.g. one embed for a batch)
+        """
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if observe:
+            STAGE_SECONDS.observe(seconds, stage=name)
+
+    def timings(self) -> Dict[str, float]:
+        """Stage and total timings in milliseconds."""
+        timings = {f"{name}_ms": round(seconds * 1000, 3) for name, seconds in self.stages.items()}
+        timings["total_ms"] = round(self.elapsed() * 1000, 3)
+        return timings
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def finish(self, status: str = "success") -> Dict[str, float]:
+        """Record the finished query in the metrics and the slow-query log; returns its timings."""
+        elapsed = self.elapsed()
+        QUERY_SECONDS.observe(elapsed, mode=self.mode or "", cache_hit=str(self.cache_hit).lower())
+        QUERIES_TOTAL.inc(mode=self.mode or "", status=status)
+        if "prompt" in self.tokens:
+            PROMPT_TOKENS.observe(self.tokens["prompt"])
+        if "completion" in self.tokens:
+            COMPLETION_TOKENS.observe(self.tokens["completion"])
+
+        timings = self.timings()
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            SLOW_QUERIES_TOTAL.inc()
+            slow_query_logger.warning(json.dumps({
+                "slow_query": self.query[:200],
+                "mode": self.mode,
+                "status": status,
+                "cache_hit": self.cache_hit,
+                "timings": timings,
+                "tokens": self.tokens,
+            }))
+        return timings
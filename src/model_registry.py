@@ -0,0 +1,87 @@
+"""
+Process-wide registry for embedding models and ChromaDB clients.
+
+The RAG pipeline and the document processors share one copy of each model
+instead of loading their own. Under gunicorn --preload, call preload() in the
+master so forked workers share the model weights copy-on-write.
+"""
+
+import os
+import threading
+import logging
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+DEFAULT_CHROMA_PATH = "./chroma_db"
+# "torch" runs sentence-transformers, "onnx" the int8-quantized ONNX Runtime model
+EMBEDDING_BACKEND = os.environ.get("RAG_EMBEDDING_BACKEND", "torch")
+
+_lock = threading.Lock()
+_embedding_models: Dict[Tuple[str, str, str], object] = {}
+_chroma_clients: Dict[str, object] = {}
+_chroma_pid = os.getpid()
+
+def get_embedding_model(model_name: str = DEFAULT_EMBEDDING_MODEL, device: str = "cpu", backend: str = None):
+    """
+    Return the shared embedding model, loading it on first use.
+
+    Args:
+        model_name: Name of the sentence transformer model
+        device: Torch device, CPU by default to avoid MPS meta tensor issues
+        backend: "torch" or "onnx", defaults to RAG_EMBEDDING_BACKEND
+
+    Returns:
+        The loaded model; both backends expose encode() and
+        get_sentence_embedding_dimension()
+    """
+    backend = backend or EMBEDDING_BACKEND
+    key = (model_name, device, backend)
+    model = _embedding_models.get(key)
+    if model is None:
+        with _lock:
+            model = _embedding_models.get(key)
+            if model is None:
+                logger.info(f"Loading embedding model: {model_name} ({backend})")
+                if backend == "onnx":
+                    from onnx_embedding import OnnxEmbeddingModel
+                    model = OnnxEmbeddingModel(model_name)
+                elif backend == "torch":
+                    from sentence_transformers import SentenceTransformer
+                    model = SentenceTransformer(model_name, device=device)
+                    model.eval()
+                else:
+                    raise ValueError(f"Unknown embedding backend: {backend}")
+                _embedding_models[key] = model
+    return model
+
+def get_chroma_client(path: str = DEFAULT_CHROMA_PATH):
+    """
+    Return the shared ChromaDB client for a database path.
+
+    Clients hold SQLite connections that must not cross a fork, so each
+    process opens its own.
+    """
+    global _chroma_pid
+    key = os.path.abspath(path)
+    with _lock:
+        if _chroma_pid != os.getpid():
+            _chroma_clients.clear()
+            _chroma_pid = os.getpid()
+        client = _chroma_clients.get(key)
+        if client is None:
+            import chromadb
+            logger.info(f"Connecting to ChromaDB at: {path}")
+            client = chromadb.PersistentClient(path=path)
+            _chroma_clients[key] = client
+    return client
+
+def preload(model_name: str = DEFAULT_EMBEDDING_MODEL, device: str = "cpu"):
+    """
+    Load the embedding model ahead of forking workers.
+
+    Only the weights are loaded; running inference here would start torch
+    thread pools that do not survive a fork.
+    """
+    get_embedding_model(model_name, device)
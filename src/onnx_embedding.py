@@ -0,0 +1,128 @@
+"""
+ONNX Runtime embedding backend with dynamic int8 quantization.
+
+Drop-in replacement for the SentenceTransformer models used by the pipeline
+and the document processors: it exposes the same encode() and
+get_sentence_embedding_dimension() methods. On first use the Hugging Face
+model is exported to ONNX and quantized; later processes load the cached
+files with ONNX Runtime only.
+"""
+
+import logging
+import os
+import threading
+from typing import List, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ONNX_CACHE_DIR = os.environ.get("RAG_ONNX_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "rag-onnx"))
+ONNX_INTRA_OP_THREADS = int(os.environ.get("RAG_ONNX_THREADS", "0"))
+ONNX_QUANTIZE = os.environ.get("RAG_ONNX_QUANTIZE", "1") == "1"
+
+class OnnxEmbeddingModel:
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", cache_dir: str = None,
+                 intra_op_threads: int = None, quantize: bool = None, max_seq_length: int = 256):
+        """
+        Load (exporting on first use) an ONNX version of a sentence transformer.
+
+        Args:
+            model_name: Sentence transformer name, e.g. "all-MiniLM-L6-v2"
+            cache_dir: Directory holding the exported models
+            intra_op_threads: ONNX Runtime intra-op threads (0 lets ONNX Runtime decide)
+            quantize: Use the dynamically int8-quantized model
+            max_seq_length: Longest input in tokens, longer texts are truncated
+        """
+        from onnxruntime import InferenceSession, SessionOptions
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        self.max_seq_length = max_seq_length
+        quantize = ONNX_QUANTIZE if quantize is None else quantize
+        model_dir = os.path.join(cache_dir or ONNX_CACHE_DIR, self.model_name.replace("/", "__"))
+        model_path = export_onnx_model(self.model_name, model_dir, quantize)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = SessionOptions()
+        threads = ONNX_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.dimension = self.session.get_outputs()[0].shape[-1]
+        logger.info(f"Loaded ONNX embedding model {model_path} (quantized={quantize}, threads={threads or 'auto'})")
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, show_progress_bar: bool = False,
+               normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        """
+        Embed one text or a list of texts, mirroring SentenceTransformer.encode.
+
+        Returns a 1-d array for a single string and a 2-d array otherwise.
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        # Sort by length so each batch pads to similar lengths
+        order = np.argsort([-len(t) for t in texts])
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            batch_rows = order[start:start + batch_size]
+            encoded = self.tokenizer(
+                [texts[i] for i in batch_rows], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors="np"
+            )
+            inputs = {name: encoded[name].astype(np.int64) for name in self.input_names if name in encoded}
+            token_embeddings = self.session.run(None, inputs)[0]
+            # Mean pooling over real tokens, as in the sentence-transformers pooling layer
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            embeddings[batch_rows] = pooled
+        if normalize_embeddings:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings[0] if single else embeddings
+
+_export_lock = threading.Lock()
+
+def export_onnx_model(model_name: str, model_dir: str, quantize: bool = True) -> str:
+    """
+    Export a Hugging Face encoder to ONNX (and an int8 copy) unless already cached.
+
+    Returns:
+        Path of the model file to load
+    """
+    fp32_path = os.path.join(model_dir, "model.onnx")
+    int8_path = os.path.join(model_dir, "model.int8.onnx")
+    target = int8_path if quantize else fp32_path
+    with _export_lock:
+        if os.path.exists(target):
+            return target
+
+        os.makedirs(model_dir, exist_ok=True)
+        if not os.path.exists(fp32_path):
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+
+            logger.info(f"Exporting {model_name} to ONNX in {model_dir}")
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            model = AutoModel.from_pretrained(model_name).eval()
+            tokenizer.save_pretrained(model_dir)
+            sample = tokenizer(["An example sentence to trace the model."], return_tensors="pt")
+            names = ["input_ids", "attention_mask", "token_type_ids"]
+            names = [n for n in names if n in sample]
+            dynamic_axes = {n: {0: "batch", 1: "sequence"} for n in names}
+            dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+            with torch.no_grad():
+                torch.onnx.export(
+                    model, tuple(sample[n] for n in names), fp32_path,
+                    input_names=names, output_names=["token_embeddings"],
+                    dynamic_axes=dynamic_axes, opset_version=14, dynamo=False
+                )
+
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            logger.info(f"Quantizing {fp32_path} to int8")
+            quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return target
@@ -0,0 +1,279 @@
+"""
+Page-aware, parallel PDF text extraction with pluggable backends.
+
+Two extractors are available, chosen with RAG_PDF_EXTRACTOR:
+
+    tika    Apache Tika, which needs Java and starts a JVM server on first use
+    pypdf   pypdf's pure-Python text extraction, no Java required
+
+The PDF is split into page ranges with pypdf and the ranges are extracted
+from a process pool. Pages are yielded in document order as soon as their
+range is extracted, so cleaning and chunking can start before the whole
+document has been parsed, and every page keeps its page number.
+
+Extracted text is cached on disk under RAG_EXTRACTION_CACHE_DIR, keyed by
+the SHA-256 of the file and the extractor and its version, so ingesting the
+same PDF again skips extraction entirely.
+"""
+
+import hashlib
+import html
+import io
+import json
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PAGES_PER_TASK = int(os.environ.get("RAG_EXTRACT_PAGES_PER_TASK", "8"))
+MAX_WORKERS = int(os.environ.get("RAG_EXTRACT_WORKERS", "0")) or None
+PDF_EXTRACTOR = os.environ.get("RAG_PDF_EXTRACTOR", "tika")
+# Empty disables the cache
+EXTRACTION_CACHE_DIR = os.environ.get("RAG_EXTRACTION_CACHE_DIR", "./chroma_db/extraction_cache")
+
+# Bumped when the layout of cache entries changes
+CACHE_FORMAT = 1
+
+PAGE_DIV_PATTERN = re.compile(r'<div class="page">', re.IGNORECASE)
+BLOCK_END_PATTERN = re.compile(r'</(?:p|div|h\d|li|tr)>|<br\s*/?>', re.IGNORECASE)
+TAG_PATTERN = re.compile(r'<[^>]+>')
+
+def count_pages(pdf_path: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(pdf_path).pages)
+
+def split_xhtml_pages(xhtml: str) -> List[str]:
+    """Split Tika XHTML output into the plain text of each page."""
+    pages = []
+    for block in PAGE_DIV_PATTERN.split(xhtml)[1:]:
+        # Keep paragraph boundaries as line breaks so headings stay on their own line
+        text = BLOCK_END_PATTERN.sub("\n", block)
+        text = html.unescape(TAG_PATTERN.sub("", text))
+        pages.append(text.strip())
+    return pages
+
+def extract_page_range(pdf_path: str, start: int, end: int) -> List[str]:
+    """
+    Extract the text of pages [start, end) of a PDF with Tika.
+
+    Args:
+        pdf_path: Path to the PDF file
+        start: Index of the first page (0-based)
+        end: Index after the last page
+
+    Returns:
+        Text of each page in the range
+    """
+    from pypdf import PdfReader, PdfWriter
+    from tika import parser
+
+    reader = PdfReader(pdf_path)
+    writer = PdfWriter()
+    for index in range(start, end):
+        writer.add_page(reader.pages[index])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+
+    parsed = parser.from_buffer(buffer.getvalue(), xmlContent=True)
+    pages = split_xhtml_pages(parsed.get("content") or "")
+    # Pad or trim so page numbers stay aligned even if Tika drops an empty page
+    return (pages + [""] * (end - start))[:end - start]
+
+def extract_page_range_pypdf(pdf_path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end) of a PDF with pypdf; arguments as extract_page_range()."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(pdf_path)
+    return [(reader.pages[index].extract_text() or "").strip() for index in range(start, end)]
+
+def _package_version(package: str) -> str:
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        return version(package)
+    except PackageNotFoundError:
+        return "unknown"
+
+class PdfExtractor:
+    """
+    Extracts the text of a PDF page by page.
+
+    Subclasses set `name`, the package whose version identifies their
+    output, and `extract_range`, a module-level function (so it can run in
+    worker processes) returning the text of pages [start, end).
+    """
+
+    name: str = None
+    package: str = None
+    extract_range: Callable[[str, int, int], List[str]] = None
+
+    @property
+    def version(self) -> str:
+        return _package_version(self.package)
+
+    def iter_pages(self, pdf_path: str, pages_per_task: int = None,
+                   max_workers: int = None) -> Iterator[Tuple[int, str]]:
+        """
+        Yield (page_number, text) for every page of a PDF, in order.
+
+        The first range is extracted in this process, which also starts a
+        Tika server before the workers hit it; the remaining ranges are
+        extracted in parallel and yielded as soon as every earlier range has
+        been yielded.
+
+        Args:
+            pdf_path: Path to the PDF file
+            pages_per_task: Pages extracted per task
+            max_workers: Size of the process pool (defaults to the CPU count)
+        """
+        extract_range = type(self).extract_range
+        pages_per_task = pages_per_task or PAGES_PER_TASK
+        total_pages = count_pages(pdf_path)
+        ranges = [(start, min(start + pages_per_task, total_pages)) for start in range(0, total_pages, pages_per_task)]
+        logger.info(f"Extracting {total_pages} pages from {pdf_path} with {self.name} in {len(ranges)} ranges")
+        if not ranges:
+            return
+
+        first_start, first_end = ranges[0]
+        for offset, text in enumerate(extract_range(pdf_path, first_start, first_end)):
+            yield first_start + offset + 1, text
+
+        if len(ranges) == 1:
+            return
+        pool = ProcessPoolExecutor(max_workers=max_workers or MAX_WORKERS)
+        try:
+            futures = [(start, pool.submit(extract_range, pdf_path, start, end)) for start, end in ranges[1:]]
+            for start, future in futures:
+                for offset, text in enumerate(future.result()):
+                    yield start + offset + 1, text
+        finally:
+            # Don't wait for outstanding ranges if the consumer stopped early (e.g. a cancelled job)
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def extract_text(self, pdf_path: str) -> str:
+        """The text of the whole PDF."""
+        return "\n\n".join(text for _, text in self.iter_pages(pdf_path))
+
+class TikaExtractor(PdfExtractor):
+    name = "tika"
+    package = "tika"
+    extract_range = extract_page_range
+
+    def extract_text(self, pdf_path: str) -> str:
+        # One request for the whole file, as the first document processor always did
+        from tika import parser
+        return parser.from_file(pdf_path).get("content") or ""
+
+class PypdfExtractor(PdfExtractor):
+    name = "pypdf"
+    package = "pypdf"
+    extract_range = extract_page_range_pypdf
+
+EXTRACTORS = {extractor.name: extractor for extractor in (TikaExtractor, PypdfExtractor)}
+
+def get_extractor(name: str = None) -> PdfExtractor:
+    """The extractor called `name`, defaults to RAG_PDF_EXTRACTOR."""
+    name = name or PDF_EXTRACTOR
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown PDF extractor: {name}")
+    return EXTRACTORS[name]()
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ExtractionCache:
+    def __init__(self, root: str = None):
+        """
+        Extracted text on disk, one JSON file per PDF, extractor and kind of output.
+
+        Args:
+            root: Cache directory, defaults to RAG_EXTRACTION_CACHE_DIR
+        """
+        self.root = EXTRACTION_CACHE_DIR if root is None else root
+
+    def path(self, pdf_path: str, extractor: PdfExtractor, kind: str) -> str:
+        name = f"{file_sha256(pdf_path)}.{extractor.name}-{extractor.version}.{kind}.json"
+        return os.path.join(self.root, name)
+
+    def load(self, path: str) -> Optional[Any]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable extraction cache entry {path}: {e}")
+            return None
+        return entry["content"] if entry.get("format") == CACHE_FORMAT else None
+
+    def store(self, path: str, content: Any):
+        """Write an entry, replacing any previous version atomically."""
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"format": CACHE_FORMAT, "content": content}, f)
+        os.replace(tmp_path, path)
+
+def iter_pages(pdf_path: str, pages_per_task: int = None, max_workers: int = None,
+               extractor: str = None, cache_dir: str = None) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (page_number, text) for every page of a PDF, in order, from the cache when possible.
+
+    The pages are cached once the whole document has been extracted, so a
+    consumer that stops early leaves no partial entry behind.
+
+    Args:
+        pdf_path: Path to the PDF file
+        pages_per_task: Pages extracted per task
+        max_workers: Size of the process pool (defaults to the CPU count)
+        extractor: Extractor name, defaults to RAG_PDF_EXTRACTOR
+        cache_dir: Cache directory, defaults to RAG_EXTRACTION_CACHE_DIR ("" disables the cache)
+    """
+    backend = get_extractor(extractor)
+    cache = ExtractionCache(cache_dir)
+    if not cache.root:
+        yield from backend.iter_pages(pdf_path, pages_per_task, max_workers)
+        return
+
+    path = cache.path(pdf_path, backend, "pages")
+    pages = cache.load(path)
+    if pages is not None:
+        logger.info(f"Using cached {backend.name} extraction of {pdf_path} ({len(pages)} pages)")
+        yield from enumerate(pages, start=1)
+        return
+
+    pages = []
+    for page_number, text in backend.iter_pages(pdf_path, pages_per_task, max_workers):
+        pages.append(text)
+        yield page_number, text
+    cache.store(path, pages)
+
+def extract_text(pdf_path: str, extractor: str = None, cache_dir: str = None) -> str:
+    """
+    The text of a whole PDF, from the cache when possible.
+
+    Args:
+        pdf_path: Path to the PDF file
+        extractor: Extractor name, defaults to RAG_PDF_EXTRACTOR
+        cache_dir: Cache directory, defaults to RAG_EXTRACTION_CACHE_DIR ("" disables the cache)
+    """
+    backend = get_extractor(extractor)
+    cache = ExtractionCache(cache_dir)
+    if not cache.root:
+        return backend.extract_text(pdf_path)
+
+    path = cache.path(pdf_path, backend, "text")
+    text = cache.load(path)
+    if text is not None:
+        logger.info(f"Using cached {backend.name} extraction of {pdf_path}")
+        return text
+    text = backend.extract_text(pdf_path)
+    if text:
+        cache.store(path, text)
+    return text
@@ -0,0 +1,136 @@
+"""
+Publication metadata for ingested documents.
+
+Every chunk is tagged with the publication it came from, so one index can
+hold hundreds of AFIs and DAFMANs and searches can be scoped to some of
+them. The publication number (e.g. "DAFMAN 36-2664") is the document's
+`source`, the key incremental sync and per-document filters work on. It is
+read from the file name, falling back to the title page, and the revision
+date is the first date on the title page.
+"""
+
+import logging
+import os
+import re
+from datetime import date
+from functools import lru_cache
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Directory documents may be ingested from (and uploads are saved to)
+DOCUMENTS_DIR = os.environ.get("RAG_DOCUMENTS_DIR", "..")
+
+# Longer prefixes first so "DAFMAN" is not read as "DAF" + "MAN"
+PUBLICATION_PATTERN = re.compile(
+    r'\b(?P<kind>DAFMAN|DAFPD|DAFGM|DAFH|DAFI|AFMAN|AFPD|AFGM|AFH|AFI|DODM|DODI|DODD)'
+    r'[\s_-]*(?P<series>\d{1,3})\s*-\s*(?P<number>\d{1,4}(?:V\d+)?)\b',
+    re.IGNORECASE
+)
+MONTHS = ["JANUARY", "FEBRUARY", "MARCH", "APRIL", "MAY", "JUNE", "JULY",
+          "AUGUST", "SEPTEMBER", "OCTOBER", "NOVEMBER", "DECEMBER"]
+DATE_PATTERN = re.compile(r'\b(?P<day>\d{1,2})\s+(?P<month>' + "|".join(MONTHS) + r')\s+(?P<year>(?:19|20)\d{2})\b',
+                          re.IGNORECASE)
+
+# Metadata fields describing a whole document, as opposed to one chunk
+DOCUMENT_FIELDS = ("source", "revision_date", "file_name")
+
+def publication_number(text: str) -> str:
+    """First publication number in a text, normalized like "AFI 36-2606", or "" if there is none."""
+    match = PUBLICATION_PATTERN.search(text)
+    if not match:
+        return ""
+    return f"{match.group('kind').upper()} {match.group('series')}-{match.group('number').upper()}"
+
+@lru_cache(maxsize=256)
+def running_header_pattern(source: str) -> Optional["re.Pattern"]:
+    """
+    Pattern matching a publication's number as it is printed in its page headers and footers.
+
+    Headers vary the spacing, e.g. "DAFMAN36-2664" or "DAFMAN 36 - 2664".
+    None when `source` is not a publication number (a file name fallback).
+    """
+    match = PUBLICATION_PATTERN.fullmatch(source or "")
+    if not match:
+        return None
+    return re.compile(rf"\s*{match.group('kind')}[\s_-]*{match.group('series')}\s*-\s*{re.escape(match.group('number'))}\b\s*",
+                      re.IGNORECASE)
+
+def revision_date(text: str) -> str:
+    """First date in a text as YYYY-MM-DD, or "" if there is none."""
+    for match in DATE_PATTERN.finditer(text):
+        try:
+            return date(int(match.group("year")), MONTHS.index(match.group("month").upper()) + 1,
+                        int(match.group("day"))).isoformat()
+        except ValueError:
+            continue
+    return ""
+
+def describe_publication(pdf_path: str, title_page: str = "", overrides: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Document-level metadata for a PDF.
+
+    Args:
+        pdf_path: Path to the PDF
+        title_page: Text of the first page
+        overrides: Values given at upload time, e.g. {"source": "AFI 36-2606", "revision_date": "2022-06-01"}
+
+    Returns:
+        Metadata with "source" (the publication number, or the file name
+        without extension when none is found), "revision_date" and "file_name"
+    """
+    file_name = os.path.basename(pdf_path)
+    metadata = {
+        "source": publication_number(file_name) or publication_number(title_page) or os.path.splitext(file_name)[0],
+        "revision_date": revision_date(title_page),
+        "file_name": file_name,
+    }
+    metadata.update({key: value for key, value in (overrides or {}).items() if key in DOCUMENT_FIELDS and value})
+    return metadata
+
+def resolve_document_path(path: str, root: str = None) -> str:
+    """
+    Resolve a path given by a client against the documents directory.
+
+    Raises:
+        ValueError: If the path points outside the documents directory
+    """
+    root = os.path.realpath(root or DOCUMENTS_DIR)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if resolved != root and not resolved.startswith(root + os.sep):
+        raise ValueError(f"Path is outside the documents directory: {path}")
+    return resolved
+
+def iter_document_paths(path: str) -> Iterator[str]:
+    """The PDF itself, or every PDF under a directory in sorted order."""
+    if os.path.isfile(path):
+        yield path
+        return
+    for directory, subdirectories, files in os.walk(path):
+        subdirectories.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".pdf"):
+                yield os.path.join(directory, name)
+
+def document_where(where: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The part of a filter that only involves document-level fields, or None.
+
+    Section routing can only apply filters on fields sections carry too.
+    """
+    if not where:
+        return None
+    clauses = where["$and"] if list(where) == ["$and"] else [{key: value} for key, value in where.items()]
+    kept = [clause for clause in clauses if _document_only(clause)]
+    if not kept:
+        return None
+    return kept[0] if len(kept) == 1 else {"$and": kept}
+
+def _document_only(clause: Dict[str, Any]) -> bool:
+    for key, value in clause.items():
+        if key in ("$and", "$or"):
+            if not all(_document_only(c) for c in value):
+                return False
+        elif key not in DOCUMENT_FIELDS:
+            return False
+    return True
@@ -1,40 +1,111 @@
+import json
 import os
-import torch
-from sentence_transformers import SentenceTransformer
-import chromadb
-from typing import List, Dict, Any
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 
-# Import Groq client
-from groq import Groq
+from answer_cache import SemanticAnswerCache
+from model_registry import DEFAULT_EMBEDDING_MODEL, get_embedding_model, get_chroma_client
+from vector_store import create_vector_store, VECTOR_INDEX_PATH
+from lexical_index import load_lexical_index, reciprocal_rank_fusion
+from index_snapshot import LEXICAL_INDEX_FILE, SNAPSHOT_DIR, snapshot_path
+from context_assembly import assemble_context, default_counter
+from publications import document_where
+from llm_client import LLMClient
+from metrics import QueryTrace, RETURN_TIMINGS
+from embedding_batcher import EMBED_BATCHING, EmbeddingBatcher
+from single_flight import COALESCE_ENABLED, SingleFlight
+from admission import LLM_MAX_CONCURRENCY, AdmissionController, Overloaded
+from extractive import extractive_answer
+
+# "flat" searches every chunk; "toc" first routes the query to the closest
+# table-of-contents sections and only searches chunks inside them; "hybrid"
+# fuses a flat dense search with BM25 keyword search.
+RETRIEVAL_MODES = ("flat", "toc", "hybrid")
+
+GENERATION_ERROR_PREFIX = "Error generating response from AI"
+
+# Largest share of a latency budget kept back for the extractive fallback, so small budgets still leave time to generate
+EXTRACTIVE_RESERVE_FRACTION = 0.25
 
 class RAGPipeline:
-    def __init__(self):
+    def __init__(self, retrieval_mode: str = None, n_sections: int = None):
         self.embedding_model = None
         self.chroma_client = None
         self.collection = None
-        self.groq_client = None
+        self.section_collection = None
+        self.vector_store = None
+        self.section_store = None
+        self.section_tree = None
+        self.lexical_index = None
+        self.llm_client = None
         self.is_ready = False
+        self.retrieval_mode = retrieval_mode or os.environ.get("RAG_RETRIEVAL_MODE", "toc")
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {self.retrieval_mode}")
+        self.n_sections = n_sections or int(os.environ.get("RAG_N_SECTIONS", "3"))
+        # Candidates taken from each retriever before fusion, as a multiple of n_results
+        self.hybrid_candidates = int(os.environ.get("RAG_HYBRID_CANDIDATES", "4"))
+        self.rrf_k = int(os.environ.get("RAG_RRF_K", "60"))
+        self.context_token_budget = int(os.environ.get("RAG_CONTEXT_TOKEN_BUDGET", "1500"))
+        # Concurrent LLM calls per query_batch()
+        self.batch_concurrency = int(os.environ.get("RAG_BATCH_CONCURRENCY", "4"))
+        # Latency budget of a query (0 disables it); the last RAG_EXTRACTIVE_RESERVE_MS of it, but
+        # at most EXTRACTIVE_RESERVE_FRACTION, are kept for an extractive answer if generation does not finish
+        self.query_budget_ms = float(os.environ.get("RAG_QUERY_BUDGET_MS", "15000"))
+        self.extractive_reserve_ms = float(os.environ.get("RAG_EXTRACTIVE_RESERVE_MS", "500"))
+        self.answer_cache = None
+        if os.environ.get("RAG_CACHE_ENABLED", "1") == "1":
+            self.answer_cache = SemanticAnswerCache(
+                threshold=float(os.environ.get("RAG_CACHE_THRESHOLD", "0.95")),
+                ttl_seconds=float(os.environ.get("RAG_CACHE_TTL_SECONDS", "3600")),
+                max_size_mb=float(os.environ.get("RAG_CACHE_MAX_MB", "64")),
+            )
+        # Answers to canonical questions, kept until the index changes (see precompute_answers)
+        self.precomputed_answers = SemanticAnswerCache(
+            threshold=float(os.environ.get("RAG_PRECOMPUTED_THRESHOLD", "0.97")),
+            ttl_seconds=0,
+            max_size_mb=16,
+        )
+        self.canonical_questions: List[str] = []
+        # Single-query encodes from concurrent requests share one encode() call
+        self.query_embedder = None
+        if EMBED_BATCHING:
+            self.query_embedder = EmbeddingBatcher(
+                lambda texts: self.embedding_model.encode(texts, batch_size=len(texts), show_progress_bar=False))
+        # Identical queries in flight at the same time are answered once
+        self.single_flight = SingleFlight() if COALESCE_ENABLED else None
+        # Bounds concurrent LLM calls; queries beyond the queue are rejected with Overloaded
+        self.admission = AdmissionController() if LLM_MAX_CONCURRENCY > 0 else None
         self.load_pipeline()
 
     def load_pipeline(self):
         try:
             # 1. Load Embedding Model
             print("INFO:src.rag_pipeline:Loading embedding model: all-MiniLM-L6-v2")
-            # Explicitly set device to CPU to avoid MPS meta tensor issues
-            self.embedding_model = SentenceTransformer(
-                'all-MiniLM-L6-v2',
-                device='cpu' # Force CPU to avoid MPS meta tensor error
-            )
+            # Shared with the document processor; CPU avoids MPS meta tensor issues
+            self.embedding_model = get_embedding_model('all-MiniLM-L6-v2', device='cpu')
 
             # 2. Connect to ChromaDB
             print("INFO:src.rag_pipeline:Connecting to ChromaDB at: ./chroma_db")
-            self.chroma_client = chromadb.PersistentClient(path="./chroma_db")
+            self.chroma_client = get_chroma_client("./chroma_db")
             self.collection = self.chroma_client.get_or_create_collection(name="dafman_documents")
+            self.section_collection = self.chroma_client.get_or_create_collection(name="dafman_sections")
+            # Searches go through the configured backend (RAG_VECTOR_BACKEND: chroma or numpy),
+            # memory-mapping the collections' snapshots when RAG_SNAPSHOT_DIR is set
+            self.vector_store = create_vector_store(
+                self.collection, index_path=VECTOR_INDEX_PATH or snapshot_path("dafman_documents"),
+                model_name=DEFAULT_EMBEDDING_MODEL)
+            self.section_store = create_vector_store(
+                self.section_collection, index_path=snapshot_path("dafman_sections"),
+                model_name=DEFAULT_EMBEDDING_MODEL)
+            self.lexical_index = self.read_lexical_index()
 
-            # 3. Initialize Groq Client
-            groq_api_key = "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"
-            self.groq_client = Groq(api_key=groq_api_key)
-            print("INFO:src.rag_pipeline:Groq client initialized.")
+            # 3. Initialize the LLM client (Groq by default, see RAG_LLM_* variables)
+            self.llm_client = LLMClient()
+            print(f"INFO:src.rag_pipeline:LLM client initialized for {self.llm_client.base_url} ({self.llm_client.model}).")
 
             self.is_ready = True
             print("INFO:src.rag_pipeline:RAG pipeline initialized successfully")
@@ -43,56 +114,432 @@ class RAGPipeline:
             self.is_ready = False
             print(f"ERROR:src.rag_pipeline:Error initializing RAG pipeline: {e}")
 
-    def retrieve_documents(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
+    def invalidate_index_caches(self):
+        """Drop state derived from the vector database after the document index is rebuilt."""
+        self.section_tree = None
+        self.vector_store.refresh()
+        self.section_store.refresh()
+        self.lexical_index = self.read_lexical_index()
+        if self.answer_cache:
+            self.answer_cache.clear()
+        self.precomputed_answers.clear()
+        if self.canonical_questions:
+            # Answer the canonical questions against the new index without holding up the caller
+            threading.Thread(target=self.precompute_answers, args=(self.canonical_questions,),
+                             name="precompute-answers", daemon=True).start()
+
+    def embed_query(self, query: str) -> List[float]:
+        """Embed one query, batched with the queries of concurrent requests."""
+        if self.query_embedder:
+            return self.query_embedder.encode(query)
+        return self.embedding_model.encode(query).tolist()
+
+    @staticmethod
+    def read_lexical_index():
+        """
+        The BM25 index built by the document processor, or the one shipped with the snapshot.
+
+        Hybrid retrieval falls back to dense search when there is neither.
+        """
+        index = load_lexical_index()
+        if index is None and SNAPSHOT_DIR:
+            index = load_lexical_index(os.path.join(SNAPSHOT_DIR, LEXICAL_INDEX_FILE))
+        return index
+
+    def warm_up(self) -> Dict[str, float]:
+        """
+        Run a throwaway encode and search so the first real query finds warm models and indexes.
+
+        Returns:
+            Seconds spent on each step
+        """
+        timings = {}
+        start = time.perf_counter()
+        query_embedding = self.embed_query("warm-up query")
+        timings["encode_seconds"] = round(time.perf_counter() - start, 3)
+        for mode in dict.fromkeys((self.retrieval_mode, "flat")):
+            start = time.perf_counter()
+            self.retrieve_documents("warm-up query", mode=mode, query_embedding=query_embedding)
+            timings[f"{mode}_search_seconds"] = round(time.perf_counter() - start, 3)
+        # Loads the tokenizer used to budget the context
+        default_counter().count("warm-up query")
+        return timings
+
+    def precompute_answers(self, questions: List[str], n_results: int = 5) -> Dict[str, Any]:
+        """
+        Answer canonical questions ahead of time.
+
+        The answers are served to matching queries (default retrieval
+        options, no filter) in milliseconds and are recomputed whenever the
+        index is rebuilt. Failed generations are not stored.
+
+        Returns:
+            Counts of stored and failed answers and the seconds it took
+        """
+        self.canonical_questions = list(questions)
+        if not questions:
+            return {"questions": 0, "stored": 0, "failed": 0, "seconds": 0.0}
+
+        start = time.perf_counter()
+        mode = self.retrieval_mode
+        query_embeddings = self.embedding_model.encode(list(questions), batch_size=64).tolist()
+        retrieved = self.retrieve_documents_batch(questions, query_embeddings, n_results, mode)
+
+        def answer_question(i: int) -> bool:
+            try:
+                result = self.answer(questions[i], query_embeddings[i], retrieved[i], n_results, mode)
+            except Overloaded:
+                return False
+            if result["status"] != "success" or result["response"].startswith(GENERATION_ERROR_PREFIX):
+                return False
+            result.pop("cache_hit", None)
+            result["precomputed"] = True
+            self.precomputed_answers.store(query_embeddings[i], result, params=self.cache_params(n_results, mode))
+            return True
+
+        with ThreadPoolExecutor(max_workers=min(self.batch_concurrency, len(questions))) as pool:
+            stored = sum(pool.map(answer_question, range(len(questions))))
+        seconds = round(time.perf_counter() - start, 3)
+        print(f"INFO:src.rag_pipeline:Precomputed {stored} of {len(questions)} canonical answers in {seconds}s")
+        return {"questions": len(questions), "stored": stored, "failed": len(questions) - stored, "seconds": seconds}
+
+    def lookup_answer(self, query_embedding: List[float], params: Tuple[Any, ...]) -> Optional[Dict[str, Any]]:
+        """A precomputed or cached answer for the query, marked as a cache hit, or None."""
+        cached = self.precomputed_answers.lookup(query_embedding, params=params)
+        if cached is None and self.answer_cache:
+            cached = self.answer_cache.lookup(query_embedding, params=params)
+        if cached is not None:
+            cached["cache_hit"] = True
+        return cached
+
+    def load_section_tree(self) -> Dict[Tuple[str, str], List[Tuple[str, str]]]:
+        """
+        Cache every indexed section with its subsections.
+
+        Sections are keyed by (source, section_id), since every publication
+        numbers its sections from 1. Each key maps to itself and all of its
+        subsections, so routed sections are expanded without scanning the
+        sections of the whole corpus.
+        """
+        if self.section_tree is None:
+            tree: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+            for metadata in self.section_store.metadatas():
+                source, section_id = metadata.get("source"), metadata["section_id"]
+                ancestor = section_id
+                tree.setdefault((source, ancestor), []).append((source, section_id))
+                while "." in ancestor:
+                    ancestor = ancestor.rsplit(".", 1)[0]
+                    tree.setdefault((source, ancestor), []).append((source, section_id))
+            self.section_tree = tree
+        return self.section_tree
+
+    def route_sections(self, query_embedding: List[float], n_sections: int = None,
+                       where: Dict[str, Any] = None) -> List[Tuple[str, str]]:
+        """Return the (source, section_id) keys of the top-k sections for a query, expanded with their subsections."""
+        return self.route_sections_batch([query_embedding], n_sections, where)[0]
+
+    def route_sections_batch(self, query_embeddings: List[List[float]], n_sections: int = None,
+                             where: Dict[str, Any] = None) -> List[List[Tuple[str, str]]]:
+        """route_sections() for several queries with one section search."""
+        section_tree = self.load_section_tree()
+        if not section_tree:
+            return [[] for _ in query_embeddings]
+
+        results = self.section_store.query(
+            query_embeddings=query_embeddings,
+            n_results=n_sections or self.n_sections,
+            # Sections carry the document fields of their publication, not chunk fields
+            where=document_where(where)
+        )
+        routed_sections = []
+        for metadatas in results["metadatas"]:
+            keys = {}
+            for metadata in metadatas:
+                for key in section_tree.get((metadata.get("source"), metadata["section_id"]), []):
+                    keys[key] = True
+            routed_sections.append(sorted(keys))
+        return routed_sections
+
+    @staticmethod
+    def section_where(section_keys: Tuple[Tuple[str, str], ...], where: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Filter restricting a chunk search to some sections (and an optional caller filter)."""
+        clauses = []
+        if section_keys:
+            by_source: Dict[str, List[str]] = {}
+            for source, section_id in section_keys:
+                by_source.setdefault(source, []).append(section_id)
+            sections = [{"$and": [{"source": source}, {"section_id": {"$in": section_ids}}]}
+                        for source, section_ids in by_source.items()]
+            clauses.append(sections[0] if len(sections) == 1 else {"$or": sections})
+        if where:
+            clauses.append(where)
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def retrieve_documents(self, query: str, n_results: int = 5, mode: str = None, query_embedding: List[float] = None,
+                           where: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         if not self.is_ready:
             return []
         
-        query_embedding = self.embedding_model.encode(query).tolist()
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results,
-            include=["documents", "metadatas", "distances"]
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+
+        return self.retrieve_documents_batch([query], [query_embedding], n_results, mode, where)[0]
+
+    def retrieve_documents_batch(self, queries: List[str], query_embeddings: List[List[float]], n_results: int = 5, mode: str = None,
+                                 where: Dict[str, Any] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Retrieve chunks for several queries with as few vector searches as possible.
+
+        Args:
+            queries: Query texts
+            query_embeddings: Embedding of each query
+            n_results: Chunks per query
+            mode: Retrieval mode, defaults to the pipeline's
+            where: ChromaDB-style metadata filter, e.g. {"source": {"$in": ["AFI 36-2606", "DAFMAN 36-2664"]}}
+
+        Returns:
+            Retrieved chunks of each query, in query order
+        """
+        mode = mode or self.retrieval_mode
+        if mode == "hybrid" and self.lexical_index is not None:
+            return self.retrieve_hybrid(queries, query_embeddings, n_results, where)
+
+        # Two-stage retrieval: restrict the chunk search to the routed sections.
+        # Falls back to a flat search when no section index has been built.
+        if mode == "toc":
+            routed = self.route_sections_batch(query_embeddings, where=where)
+        else:
+            routed = [[] for _ in queries]
+
+        # Queries routed to the same sections share one search
+        groups: Dict[Tuple[Tuple[str, str], ...], List[int]] = {}
+        for i, section_keys in enumerate(routed):
+            groups.setdefault(tuple(section_keys), []).append(i)
+
+        retrieved: List[List[Dict[str, Any]]] = [[] for _ in queries]
+        for section_keys, rows in groups.items():
+            results = self.vector_store.query(
+                query_embeddings=[query_embeddings[i] for i in rows],
+                n_results=n_results,
+                where=self.section_where(section_keys, where)
+            )
+            if not results or not results["documents"]:
+                continue
+            # Format results for easier use
+            for j, i in enumerate(rows):
+                retrieved[i] = [{
+                    "document": document,
+                    "metadata": metadata,
+                    "distance": distance
+                } for document, metadata, distance in zip(
+                    results["documents"][j], results["metadatas"][j], results["distances"][j])]
+        return retrieved
+
+    def retrieve_hybrid(self, queries: List[str], query_embeddings: List[List[float]], n_results: int,
+                        where: Dict[str, Any] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Fuse dense and BM25 rankings with reciprocal rank fusion.
+
+        Exact identifiers (form numbers, AFSC codes, paragraph numbers) that
+        the embedding misses are recovered by the keyword ranking, so fewer
+        chunks are needed in the context.
+        """
+        n_candidates = n_results * self.hybrid_candidates
+        dense = self.vector_store.query(query_embeddings=query_embeddings, n_results=n_candidates, where=where)
+
+        records = {}
+        fused_rankings, lexical_scores = [], []
+        for i, query in enumerate(queries):
+            for chunk_id, document, metadata, distance in zip(
+                    dense["ids"][i], dense["documents"][i], dense["metadatas"][i], dense["distances"][i]):
+                records[(i, chunk_id)] = {"document": document, "metadata": metadata, "distance": distance}
+            lexical = self.lexical_index.search(query, n_results=n_candidates, where=where)
+            lexical_scores.append(dict(lexical))
+            fused_rankings.append(reciprocal_rank_fusion(
+                [dense["ids"][i], [chunk_id for chunk_id, _ in lexical]], k=self.rrf_k)[:n_results])
+
+        # Keyword-only hits still need their text from the store
+        missing = sorted({chunk_id for i, fused in enumerate(fused_rankings)
+                          for chunk_id, _ in fused if (i, chunk_id) not in records})
+        fetched = {}
+        if missing:
+            found = self.vector_store.get(missing)
+            for chunk_id, document, metadata in zip(found["ids"], found["documents"], found["metadatas"]):
+                fetched[chunk_id] = {"document": document, "metadata": metadata, "distance": None}
+
+        retrieved = []
+        for i, fused in enumerate(fused_rankings):
+            formatted_results = []
+            for chunk_id, score in fused:
+                record = records.get((i, chunk_id)) or fetched.get(chunk_id)
+                if record:
+                    formatted_results.append(dict(record, score=score, bm25=lexical_scores[i].get(chunk_id)))
+            retrieved.append(formatted_results)
+        return retrieved
+
+    def assemble_context(self, retrieved_docs: List[Dict[str, Any]]) -> Tuple[List[str], Dict[str, Any]]:
+        """Merge, deduplicate and pack retrieved chunks into the context token budget."""
+        return assemble_context(
+            [doc["document"] for doc in retrieved_docs],
+            [doc["metadata"].get("source") for doc in retrieved_docs],
+            token_budget=self.context_token_budget
         )
-        
-        # Format results for easier use
-        formatted_results = []
-        if results and results["documents"]:
-            for i in range(len(results["documents"][0])):
-                formatted_results.append({
-                    "document": results["documents"][0][i],
-                    "metadata": results["metadatas"][0][i],
-                    "distance": results["distances"][0][i]
-                })
-        return formatted_results
-
-    def generate_response(self, query: str, context: List[str]) -> str:
-        if not self.is_ready or not self.groq_client:
-            return "I am currently initializing. Please try again in a moment."
 
+    def build_messages(self, query: str, context: List[str]) -> List[Dict[str, str]]:
         # Construct the prompt for the LLM
         system_prompt = "You are an AI assistant specialized in Air Force policy and logistics compliance. Answer the user's question based ONLY on the provided context. If the answer is not in the context, state that you cannot find the information. Do not make up answers."
         
         context_str = "\n\nContext:\n" + "\n".join(context)
         
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": f"{query}{context_str}"},
         ]
 
+    def generate_response(self, query: str, context: List[str], usage: Dict[str, Any] = None,
+                          timeout: float = None) -> str:
+        if not self.is_ready or not self.llm_client:
+            return "I am currently initializing. Please try again in a moment."
+
+        messages = self.build_messages(query, context)
+
         try:
-            chat_completion = self.groq_client.chat.completions.create(
-                messages=messages,
-                model="llama3-8b-8192", # Using a common Groq-supported model.
-                temperature=0.7,
-                max_tokens=512,
-            )
-            response = chat_completion.choices[0].message.content
-            return response
+            return self.llm_client.chat(messages, temperature=0.7, max_tokens=512, timeout=timeout, usage=usage)
         except Exception as e:
-            print(f"ERROR:src.rag_pipeline:Error calling Groq API: {e}")
-            return f"Error generating response from AI: {e}"
+            print(f"ERROR:src.rag_pipeline:Error calling LLM API: {e}")
+            return f"{GENERATION_ERROR_PREFIX}: {e}"
+
+    def generate_response_stream(self, query: str, context: List[str], timeout: float = None) -> Iterator[str]:
+        """Yield the completion text piece by piece as the LLM streams it back."""
+        if not self.is_ready or not self.llm_client:
+            yield "I am currently initializing. Please try again in a moment."
+            return
+
+        messages = self.build_messages(query, context)
+
+        try:
+            yield from self.llm_client.chat_stream(messages, temperature=0.7, max_tokens=512, timeout=timeout)
+        except Exception as e:
+            print(f"ERROR:src.rag_pipeline:Error calling LLM API: {e}")
+            yield f"{GENERATION_ERROR_PREFIX}: {e}"
+
+    def count_tokens(self, trace: QueryTrace, query: str, context: List[str], answer: str, usage: Dict[str, Any] = None):
+        """Record prompt and completion tokens, from the provider's usage report when it sent one."""
+        usage = usage or {}
+        counter = default_counter()
+        prompt = usage.get("prompt_tokens")
+        if prompt is None:
+            prompt = sum(counter.count(m["content"]) for m in self.build_messages(query, context))
+        completion = usage.get("completion_tokens")
+        if completion is None:
+            completion = counter.count(answer)
+        trace.tokens.update({"prompt": prompt, "completion": completion})
+
+    def finish_trace(self, trace: QueryTrace, result: Dict[str, Any], include_timings: bool = None) -> Dict[str, Any]:
+        """Record a finished query in the metrics and optionally attach its timings to the result."""
+        trace.cache_hit = bool(result.get("cache_hit"))
+        timings = trace.finish(result.get("status", "success"))
+        if RETURN_TIMINGS if include_timings is None else include_timings:
+            result["timings"] = timings
+            result["tokens"] = dict(trace.tokens)
+        return result
+
+    def generation_deadline(self, started: float, budget_ms: float = None) -> Optional[float]:
+        """
+        perf_counter() time by which generation for a query started at `started` must finish.
+
+        The rest of the budget is reserved for an extractive answer. None without a budget.
+        """
+        budget_ms = self.query_budget_ms if budget_ms is None else budget_ms
+        if budget_ms <= 0:
+            return None
+        reserve_ms = min(self.extractive_reserve_ms, budget_ms * EXTRACTIVE_RESERVE_FRACTION)
+        return started + (budget_ms - reserve_ms) / 1000
 
-    def query(self, user_query: str, n_results: int = 5) -> Dict[str, Any]:
+    @staticmethod
+    def generation_timeout(deadline: Optional[float]) -> Optional[float]:
+        """Seconds left for generation."""
+        if deadline is None:
+            return None
+        return deadline - time.perf_counter()
+
+    def admit_generation(self, stack: ExitStack, trace: QueryTrace,
+                         deadline: Optional[float]) -> Tuple[Optional[float], Optional[str]]:
+        """
+        Take an LLM call slot, waiting no longer than the query's deadline allows.
+
+        The slot is released when `stack` closes.
+
+        Returns:
+            (generation timeout, None), or (None, reason) when there is no
+            time left to generate and the query should fall back to an
+            extractive answer
+
+        Raises:
+            Overloaded: If the admission queue is full, or the wait too long for a query without a deadline
+        """
+        timeout = self.generation_timeout(deadline)
+        if timeout is not None and timeout <= 0:
+            return None, "the latency budget ran out before generation"
+        try:
+            stack.enter_context(self.llm_slot(trace, timeout))
+        except Overloaded as e:
+            if deadline is None or e.reason != "timeout":
+                raise
+            return None, str(e)
+        # Queueing for the slot used part of the budget
+        timeout = self.generation_timeout(deadline)
+        if timeout is not None and timeout <= 0:
+            return None, "the latency budget ran out waiting for an LLM call slot"
+        return timeout, None
+
+    def extractive_fallback(self, trace: QueryTrace, query_embedding: List[float],
+                            retrieved_docs: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
+        """The retrieved sentences closest to the query, as (answer text, passages)."""
+        with trace.stage("extractive"):
+            return extractive_answer(
+                query_embedding, retrieved_docs,
+                lambda texts: self.embedding_model.encode(texts, batch_size=64, show_progress_bar=False))
+
+    def format_sources(self, retrieved_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [{
+            "source": doc["metadata"].get("source", "Unknown"),
+            "chunk_id": doc["metadata"].get("chunk_id", "N/A"),
+            "section": doc["metadata"].get("section_path"),
+            "page": doc["metadata"].get("page_number"),
+            "revision_date": doc["metadata"].get("revision_date"),
+            "preview": doc["document"][:200] + "..." if len(doc["document"]) > 200 else doc["document"],
+            # None for hybrid hits found by keyword only; "score" is then their fused rank score
+            "distance": doc["distance"],
+            "score": doc.get("score")
+        } for doc in retrieved_docs]
+
+    @staticmethod
+    def cache_params(n_results: int, mode: str, where: Dict[str, Any] = None) -> Tuple[Any, ...]:
+        """Retrieval parameters a cached answer must have been produced with."""
+        return n_results, mode, json.dumps(where, sort_keys=True) if where else None
+
+    @staticmethod
+    def flight_key(user_query: str, n_results: int, mode: str, where: Dict[str, Any] = None,
+                   include_timings: bool = None, budget_ms: float = None) -> Tuple[Any, ...]:
+        """Identifies queries that get the same answer: normalized text plus retrieval options and budget."""
+        include_timings = RETURN_TIMINGS if include_timings is None else bool(include_timings)
+        return ((" ".join(user_query.lower().split()), include_timings, budget_ms)
+                + RAGPipeline.cache_params(n_results, mode, where))
+
+    def query(self, user_query: str, n_results: int = 5, mode: str = None, include_timings: bool = None,
+              where: Dict[str, Any] = None, budget_ms: float = None) -> Dict[str, Any]:
+        """
+        Answer a query.
+
+        Args:
+            budget_ms: Latency budget, defaults to RAG_QUERY_BUDGET_MS. When
+                generation fails or would not finish in time the answer is
+                built from the retrieved sentences instead, with status
+                "extractive_fallback"
+        """
         if not self.is_ready:
             return {
                 "response": "I am currently initializing. Please try again in a moment.",
@@ -100,23 +547,293 @@ class RAGPipeline:
                 "status": "mock_response"
             }
 
-        retrieved_docs = self.retrieve_documents(user_query, n_results)
-        
-        context = [doc["document"] for doc in retrieved_docs]
-        sources = [{
-            "source": doc["metadata"].get("source", "Unknown"),
-            "chunk_id": doc["metadata"].get("chunk_id", "N/A"),
-            "preview": doc["document"][:200] + "..." if len(doc["document"]) > 200 else doc["document"],
-            "distance": doc["distance"]
-        } for doc in retrieved_docs]
+        mode = mode or self.retrieval_mode
+        if not self.single_flight:
+            return self.run_query(user_query, n_results, mode, include_timings, where, budget_ms)
+        key = self.flight_key(user_query, n_results, mode, where, include_timings, budget_ms)
+        # An identical streamed query in flight carries the whole result in its last event
+        shared_stream = self.single_flight.join_stream(key)
+        if shared_stream is not None:
+            for event, data in shared_stream:
+                if event == "done":
+                    data["coalesced"] = True
+                    return data
+        result, shared = self.single_flight.do(
+            key, lambda: self.run_query(user_query, n_results, mode, include_timings, where, budget_ms))
+        if shared:
+            result["coalesced"] = True
+        return result
+
+    def run_query(self, user_query: str, n_results: int, mode: str, include_timings: bool = None,
+                  where: Dict[str, Any] = None, budget_ms: float = None) -> Dict[str, Any]:
+        """Answer one query, without coalescing."""
+        trace = QueryTrace(user_query, mode)
+        deadline = self.generation_deadline(trace.started, budget_ms)
+        with trace.stage("embed"):
+            query_embedding = self.embed_query(user_query)
 
-        generated_answer = self.generate_response(user_query, context)
+        # Paraphrases of an already answered question skip retrieval and generation
+        with trace.stage("cache_lookup"):
+            cached = self.lookup_answer(query_embedding, self.cache_params(n_results, mode, where))
+        if cached:
+            return self.finish_trace(trace, cached, include_timings)
 
-        return {
+        with trace.stage("retrieve"):
+            retrieved_docs = self.retrieve_documents(user_query, n_results, mode, query_embedding=query_embedding, where=where)
+        result = self.answer(user_query, query_embedding, retrieved_docs, n_results, mode, trace, where, deadline)
+        return self.finish_trace(trace, result, include_timings)
+
+    def answer(self, user_query: str, query_embedding: List[float], retrieved_docs: List[Dict[str, Any]],
+               n_results: int, mode: str, trace: QueryTrace = None, where: Dict[str, Any] = None,
+               deadline: float = None) -> Dict[str, Any]:
+        """
+        Generate and cache the answer for a query whose chunks have been retrieved.
+
+        Falls back to an extractive answer when generation fails or cannot
+        finish by `deadline` (a perf_counter() time, see generation_deadline()).
+        """
+        trace = trace or QueryTrace(user_query, mode)
+        with trace.stage("context"):
+            context, context_stats = self.assemble_context(retrieved_docs)
+            sources = self.format_sources(retrieved_docs)
+
+        usage = {}
+        with ExitStack() as slot:
+            timeout, failure = self.admit_generation(slot, trace, deadline)
+            if failure is None:
+                with trace.stage("generate"):
+                    generated_answer = self.generate_response(user_query, context, usage=usage, timeout=timeout)
+                self.count_tokens(trace, user_query, context, generated_answer, usage)
+                if generated_answer.startswith(GENERATION_ERROR_PREFIX):
+                    failure = generated_answer[len(GENERATION_ERROR_PREFIX) + 2:]
+            else:
+                generated_answer = f"{GENERATION_ERROR_PREFIX}: {failure}"
+
+        result = {
             "response": generated_answer,
             "sources": sources,
+            "retrieval_mode": mode,
+            "prompt_tokens_saved": context_stats["prompt_tokens_saved"],
+            "context": context_stats,
+            "status": "success"
+        }
+        if failure is not None:
+            self.apply_extractive_fallback(result, trace, query_embedding, retrieved_docs, failure)
+        elif self.answer_cache:
+            self.answer_cache.store(query_embedding, result, params=self.cache_params(n_results, mode, where))
+        result["cache_hit"] = False
+        return result
+
+    def apply_extractive_fallback(self, result: Dict[str, Any], trace: QueryTrace, query_embedding: List[float],
+                                  retrieved_docs: List[Dict[str, Any]], failure: str):
+        """Replace a failed generation in `result` with an extractive answer, when one can be built."""
+        print(f"WARNING:src.rag_pipeline:Answering from the retrieved sentences: {failure}")
+        try:
+            text, passages = self.extractive_fallback(trace, query_embedding, retrieved_docs)
+        except Exception as e:
+            print(f"ERROR:src.rag_pipeline:Error building extractive answer: {e}")
+            return
+        if text:
+            result.update({"response": text, "passages": passages, "status": "extractive_fallback",
+                           "fallback_reason": failure})
+
+    @contextmanager
+    def llm_slot(self, trace: QueryTrace, max_wait: float = None) -> Iterator[None]:
+        """
+        Hold an LLM call slot, recording the wait as the "admission" stage.
+
+        Args:
+            max_wait: Seconds to wait for the slot when less than RAG_ADMISSION_MAX_WAIT_MS
+
+        Raises:
+            Overloaded: If the admission queue is full or the wait too long
+        """
+        if not self.admission:
+            yield
+            return
+        with self.admission.slot(max_wait) as waited:
+            trace.record("admission", waited)
+            yield
+
+    def query_batch(self, user_queries: List[str], n_results: int = 5, mode: str = None,
+                    max_concurrency: int = None, include_timings: bool = None,
+                    where: Dict[str, Any] = None, budget_ms: float = None) -> List[Dict[str, Any]]:
+        """
+        Answer many queries at once.
+
+        All queries are embedded in one encode() call and searched together,
+        then the LLM calls run concurrently. A failing item does not fail the
+        batch: it gets an extractive answer, or status "error" and an "error"
+        message when none can be built.
+
+        Args:
+            user_queries: Query texts
+            n_results: Chunks retrieved per query
+            mode: Retrieval mode, defaults to the pipeline's
+            max_concurrency: Concurrent LLM calls, defaults to RAG_BATCH_CONCURRENCY
+            include_timings: Attach per-stage timings to each result
+            where: Metadata filter applied to every query
+            budget_ms: Latency budget of the whole batch; unlike query() there is none by default
+
+        Returns:
+            One result per query, in order
+        """
+        if not self.is_ready:
+            return [self.query(user_query, n_results, mode) for user_query in user_queries]
+
+        mode = mode or self.retrieval_mode
+        # Shared stages are observed once for the batch and charged in full to every item
+        batch_trace = QueryTrace(f"batch of {len(user_queries)}", mode)
+        deadline = self.generation_deadline(batch_trace.started, budget_ms) if budget_ms else None
+        traces = [QueryTrace(user_query, mode) for user_query in user_queries]
+        with batch_trace.stage("embed"):
+            query_embeddings = self.embedding_model.encode(list(user_queries), batch_size=64).tolist()
+
+        results: List[Dict[str, Any]] = [None] * len(user_queries)
+        pending = []
+        for i, query_embedding in enumerate(query_embeddings):
+            cached = self.lookup_answer(query_embedding, self.cache_params(n_results, mode, where))
+            if cached:
+                results[i] = cached
+            else:
+                pending.append(i)
+
+        if pending:
+            with batch_trace.stage("retrieve"):
+                retrieved = self.retrieve_documents_batch(
+                    [user_queries[i] for i in pending], [query_embeddings[i] for i in pending], n_results, mode, where
+                )
+        for trace in traces:
+            trace.started = batch_trace.started
+            for stage, seconds in batch_trace.stages.items():
+                trace.record(stage, seconds, observe=False)
+
+        def answer_item(i: int, retrieved_docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+            result = self.answer(user_queries[i], query_embeddings[i], retrieved_docs, n_results, mode, traces[i], where,
+                                 deadline)
+            if result["response"].startswith(GENERATION_ERROR_PREFIX):
+                result["status"] = "error"
+                result["error"] = result["response"]
+            return result
+
+        if pending:
+            workers = min(max_concurrency or self.batch_concurrency, len(pending))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [(i, pool.submit(answer_item, i, docs)) for i, docs in zip(pending, retrieved)]
+                for i, future in futures:
+                    try:
+                        results[i] = future.result()
+                    except Overloaded as e:
+                        results[i] = {"response": None, "sources": [], "status": "error", "error": str(e),
+                                      "retry_after": e.retry_after}
+                    except Exception as e:
+                        print(f"ERROR:src.rag_pipeline:Error answering batch query {i}: {e}")
+                        results[i] = {"response": None, "sources": [], "status": "error", "error": str(e)}
+        return [self.finish_trace(trace, result, include_timings) for trace, result in zip(traces, results)]
+
+    def query_stream(self, user_query: str, n_results: int = 5, mode: str = None,
+                     include_timings: bool = None, where: Dict[str, Any] = None,
+                     budget_ms: float = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Streaming variant of query().
+
+        Yields (event, data) pairs: one "sources" event as soon as retrieval
+        finishes, "token" events as the LLM produces text, then a final
+        "done" event carrying the complete response. When generation fails
+        or runs out of budget, the extractive answer follows as one more
+        "token" event.
+        """
+        if not self.is_ready:
+            result = self.query(user_query, n_results, mode)
+            yield "sources", {"sources": result["sources"]}
+            yield "token", {"text": result["response"]}
+            yield "done", result
+            return
+
+        mode = mode or self.retrieval_mode
+        if not self.single_flight:
+            yield from self.run_query_stream(user_query, n_results, mode, include_timings, where, budget_ms)
+            return
+        key = self.flight_key(user_query, n_results, mode, where, include_timings, budget_ms)
+        # An identical non-streamed query in flight: replay its answer like a cached one
+        joined, result = self.single_flight.join(key)
+        if joined:
+            result["coalesced"] = True
+            yield "sources", {"sources": result["sources"]}
+            yield "token", {"text": result["response"]}
+            yield "done", result
+            return
+        yield from self.single_flight.stream(
+            key, lambda: self.run_query_stream(user_query, n_results, mode, include_timings, where, budget_ms),
+            mark_shared=lambda event, data: {**data, "coalesced": True} if event == "done" else data)
+
+    def run_query_stream(self, user_query: str, n_results: int, mode: str, include_timings: bool = None,
+                         where: Dict[str, Any] = None, budget_ms: float = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Stream the answer to one query, without coalescing."""
+        trace = QueryTrace(user_query, mode)
+        deadline = self.generation_deadline(trace.started, budget_ms)
+        with trace.stage("embed"):
+            query_embedding = self.embed_query(user_query)
+
+        with trace.stage("cache_lookup"):
+            cached = self.lookup_answer(query_embedding, self.cache_params(n_results, mode, where))
+        if cached:
+            yield "sources", {"sources": cached["sources"]}
+            yield "token", {"text": cached["response"]}
+            yield "done", self.finish_trace(trace, cached, include_timings)
+            return
+
+        with trace.stage("retrieve"):
+            retrieved_docs = self.retrieve_documents(user_query, n_results, mode, query_embedding=query_embedding, where=where)
+        with trace.stage("context"):
+            context, context_stats = self.assemble_context(retrieved_docs)
+            sources = self.format_sources(retrieved_docs)
+
+        # Admitted before the first event, so an overloaded stream can still be refused with a 503
+        with ExitStack() as slot:
+            timeout, failure = self.admit_generation(slot, trace, deadline)
+            yield "sources", {"sources": sources}
+
+            pieces = []
+            if failure is None:
+                # Generation time excludes time spent waiting on the client between pieces
+                generate_seconds = 0.0
+                stream = self.generate_response_stream(user_query, context, timeout=timeout)
+                while True:
+                    start = time.perf_counter()
+                    piece = next(stream, None)
+                    generate_seconds += time.perf_counter() - start
+                    if piece is None:
+                        break
+                    if piece.startswith(GENERATION_ERROR_PREFIX):
+                        failure = piece[len(GENERATION_ERROR_PREFIX) + 2:]
+                        break
+                    if not pieces:
+                        trace.record("first_token", generate_seconds)
+                    pieces.append(piece)
+                    yield "token", {"text": piece}
+                trace.record("generate", generate_seconds)
+                self.count_tokens(trace, user_query, context, "".join(pieces))
+
+        result = {
+            "response": "".join(pieces),
+            "sources": sources,
+            "retrieval_mode": mode,
+            "prompt_tokens_saved": context_stats["prompt_tokens_saved"],
+            "context": context_stats,
             "status": "success"
         }
+        if failure is not None:
+            result["response"] = f"{GENERATION_ERROR_PREFIX}: {failure}"
+            self.apply_extractive_fallback(result, trace, query_embedding, retrieved_docs, failure)
+            # After a partial answer, the rest starts on a new paragraph
+            tail = ("\n\n" if pieces else "") + result["response"]
+            result["response"] = "".join(pieces) + tail
+            yield "token", {"text": tail}
+        elif self.answer_cache:
+            self.answer_cache.store(query_embedding, result, params=self.cache_params(n_results, mode, where))
+        result["cache_hit"] = False
+        yield "done", self.finish_trace(trace, result, include_timings)
 
 # For testing purposes (optional, can be removed in production)
 if __name__ == "__main__":
@@ -126,9 +843,9 @@ if __name__ == "__main__":
         test_query = "What are the responsibilities of a selection board president?"
         response = rag_pipeline.query(test_query)
         print(f"\nQuery: {test_query}")
-        print(f"Response: {response["response"]}")
+        print(f"Response: {response['response']}")
         print("Sources:")
         for source in response["sources"]:
-            print(f"  - {source["source"]} (Chunk {source["chunk_id"]}): {source["preview"]}")
+            print(f"  - {source['source']} (Chunk {source['chunk_id']}): {source['preview']}")
     else:
         print("RAG Pipeline failed to initialize. Check logs for errors.")
@@ -4,14 +4,20 @@ Chatbot API routes for the RAG-powered Air Force policy compliance chatbot.
 
 import os
 import sys
+import json
+import itertools
 import logging
-from flask import Blueprint, request, jsonify
+import threading
+from datetime import datetime
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_cors import cross_origin
-import pandas as pd
 
 # Add the 'src' directory to sys.path so imports from src/*.py work
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # Points to root/src
 
+from admission import Overloaded
+from warmup import Warmup
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,21 +27,35 @@ chatbot_bp = Blueprint('chatbot', __name__)
 # Global variables for lazy loading
 rag_pipeline = None
 document_processor = None
+ingestion_jobs = None
+
+_pipeline_lock = threading.Lock()
+
+MAX_BATCH_QUERIES = int(os.environ.get('RAG_BATCH_MAX_QUERIES', '500'))
 
 def get_rag_pipeline():
     """Lazy load the RAG pipeline to avoid startup delays."""
     global rag_pipeline
     if rag_pipeline is None:
-        try:
-            from rag_pipeline import RAGPipeline  # No src. prefix now
-            rag_pipeline = RAGPipeline()
-            logger.info("RAG pipeline loaded successfully")
-        except Exception as e:
-            logger.error(f"Failed to load RAG pipeline: {e}")
-            # Return a mock pipeline for development
-            rag_pipeline = MockRAGPipeline()
+        # The warm-up thread and the first requests may all get here at once
+        with _pipeline_lock:
+            if rag_pipeline is None:
+                try:
+                    from rag_pipeline import RAGPipeline  # No src. prefix now
+                    rag_pipeline = RAGPipeline()
+                    logger.info("RAG pipeline loaded successfully")
+                except Exception as e:
+                    logger.error(f"Failed to load RAG pipeline: {e}")
+                    # Return a mock pipeline for development
+                    rag_pipeline = MockRAGPipeline()
     return rag_pipeline
 
+warmup = Warmup(get_rag_pipeline)
+
+def start_warmup():
+    """Start this worker's warm-up if it has not started yet."""
+    warmup.start()
+
 def get_document_processor():
     """Lazy load the document processor."""
     global document_processor
@@ -52,7 +72,8 @@ def get_document_processor():
 class MockRAGPipeline:
     """Mock RAG pipeline for development when models aren't available."""
     
-    def query(self, user_query: str, n_results: int = 5):
+    def query(self, user_query: str, n_results: int = 5, mode: str = None, include_timings: bool = None,
+              where: dict = None, budget_ms: float = None):
         return {
             'response': f"This is a mock response for the query: '{user_query}'. The RAG pipeline is not fully loaded yet. Please ensure the document processing is complete and the models are properly installed.",
             'sources': [
@@ -67,6 +88,97 @@ class MockRAGPipeline:
             'query': user_query
         }
 
+    def query_batch(self, user_queries, n_results: int = 5, mode: str = None, max_concurrency: int = None,
+                    include_timings: bool = None, where: dict = None, budget_ms: float = None):
+        return [self.query(user_query, n_results, mode) for user_query in user_queries]
+
+    def query_stream(self, user_query: str, n_results: int = 5, mode: str = None, include_timings: bool = None,
+                     where: dict = None, budget_ms: float = None):
+        result = self.query(user_query, n_results, mode)
+        yield 'sources', {'sources': result['sources']}
+        yield 'token', {'text': result['response']}
+        yield 'done', result
+
+def parse_query_options(data):
+    """
+    Validate the retrieval options shared by the query endpoints.
+
+    Returns an (options, error) pair where error is a Flask response tuple
+    when the options are invalid.
+    """
+    n_results = data.get('n_results', 5)
+    retrieval_mode = data.get('retrieval_mode')
+    include_timings = data.get('include_timings')
+    budget_ms = data.get('latency_budget_ms')
+
+    # Validate n_results
+    if not isinstance(n_results, int) or n_results < 1 or n_results > 20:
+        n_results = 5
+
+    if retrieval_mode not in (None, 'flat', 'toc', 'hybrid'):
+        return None, (jsonify({
+            'error': 'retrieval_mode must be "flat", "toc" or "hybrid"',
+            'status': 'error'
+        }), 400)
+
+    if include_timings is not None and not isinstance(include_timings, bool):
+        return None, (jsonify({
+            'error': 'include_timings must be a boolean',
+            'status': 'error'
+        }), 400)
+
+    if budget_ms is not None and (isinstance(budget_ms, bool) or not isinstance(budget_ms, (int, float))
+                                  or budget_ms <= 0):
+        return None, (jsonify({
+            'error': 'latency_budget_ms must be a positive number',
+            'status': 'error'
+        }), 400)
+
+    # Scope the search with a ChromaDB-style filter and/or a list of publications
+    where = data.get('where')
+    publications = data.get('publications')
+    if isinstance(publications, str):
+        publications = [publications]
+    if (where is not None and not isinstance(where, dict)) or (
+            publications is not None and not (isinstance(publications, list) and publications
+                                              and all(isinstance(p, str) for p in publications))):
+        return None, (jsonify({
+            'error': 'where must be an object and publications a non-empty list of publication numbers',
+            'status': 'error'
+        }), 400)
+    if publications:
+        scope = {'source': publications[0]} if len(publications) == 1 else {'source': {'$in': publications}}
+        where = {'$and': [scope, where]} if where else scope
+
+    return {'n_results': n_results, 'mode': retrieval_mode, 'include_timings': include_timings,
+            'where': where or None, 'budget_ms': budget_ms}, None
+
+def parse_query_payload(data):
+    """
+    Validate a query payload.
+
+    Returns a (params, error) pair where error is a Flask response tuple
+    when the payload is invalid.
+    """
+    if not data or 'query' not in data:
+        return None, (jsonify({
+            'error': 'Missing required field: query',
+            'status': 'error'
+        }), 400)
+
+    user_query = data['query'].strip()
+
+    if not user_query:
+        return None, (jsonify({
+            'error': 'Query cannot be empty',
+            'status': 'error'
+        }), 400)
+
+    options, error = parse_query_options(data)
+    if error:
+        return None, error
+    return {'user_query': user_query, **options}, None
+
 @chatbot_bp.route('/query', methods=['POST'])
 @cross_origin()
 def query_chatbot():
@@ -76,47 +188,36 @@ def query_chatbot():
     Expected JSON payload:
     {
         "query": "What are the responsibilities of a selection board president?",
-        "n_results": 5  # optional, defaults to 5
+        "n_results": 5,  # optional, defaults to 5
+        "retrieval_mode": "toc",  # optional, "flat", "toc" or "hybrid"
+        "include_timings": true,  # optional, per-stage timings and token counts
+        "latency_budget_ms": 5000,  # optional, defaults to RAG_QUERY_BUDGET_MS
+        "publications": ["DAFMAN 36-2664"],  # optional, search only these publications
+        "where": {"revision_date": "2023-03-02"}  # optional, ChromaDB-style metadata filter
     }
     """
     try:
         # Get request data
-        data = request.get_json()
-        
-        if not data or 'query' not in data:
-            return jsonify({
-                'error': 'Missing required field: query',
-                'status': 'error'
-            }), 400
-        
-        user_query = data['query'].strip()
-        n_results = data.get('n_results', 5)
-        
-        if not user_query:
-            return jsonify({
-                'error': 'Query cannot be empty',
-                'status': 'error'
-            }), 400
-        
-        # Validate n_results
-        if not isinstance(n_results, int) or n_results < 1 or n_results > 20:
-            n_results = 5
+        params, error = parse_query_payload(request.get_json())
+        if error:
+            return error
         
-        logger.info(f"Processing query: {user_query}")
+        logger.info(f"Processing query: {params['user_query']}")
         
         # Get RAG pipeline and process query
         rag = get_rag_pipeline()
-        result = rag.query(user_query, n_results)
+        result = rag.query(**params)
         
         # Add request metadata
-        import pandas as pd  # Import here to avoid errors if not installed globally
-        result['timestamp'] = str(pd.Timestamp.now()) if 'pd' in globals() else 'unknown'
-        result['n_results_requested'] = n_results
+        result['timestamp'] = str(datetime.now())
+        result['n_results_requested'] = params['n_results']
         
         logger.info(f"Query processed successfully. Status: {result.get('status', 'unknown')}")
         
         return jsonify(result)
         
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"Error processing chatbot query: {e}")
         return jsonify({
@@ -125,6 +226,141 @@ def query_chatbot():
             'details': str(e)
         }), 500
 
+@chatbot_bp.route('/query/batch', methods=['POST'])
+@cross_origin()
+def query_chatbot_batch():
+    """
+    Answer a list of queries in one request.
+
+    Expected JSON payload:
+    {
+        "queries": ["What is a restricted report?", "Who appoints the SARC?"],
+        "n_results": 5,  # optional, applies to every query
+        "retrieval_mode": "toc",  # optional
+        "max_concurrency": 4,  # optional, concurrent LLM calls
+        "latency_budget_ms": 60000  # optional, for the whole batch; no budget by default
+    }
+
+    Results come back in query order; an item whose generation fails gets an
+    extractive answer (status "extractive_fallback"), or status "error" when
+    none can be built, without failing the rest of the batch.
+    """
+    try:
+        data = request.get_json()
+        queries = data.get('queries') if data else None
+        if not isinstance(queries, list) or not queries:
+            return jsonify({
+                'error': 'Missing required field: queries (a non-empty list)',
+                'status': 'error'
+            }), 400
+        if len(queries) > MAX_BATCH_QUERIES:
+            return jsonify({
+                'error': f'At most {MAX_BATCH_QUERIES} queries per batch',
+                'status': 'error'
+            }), 400
+        if not all(isinstance(q, str) and q.strip() for q in queries):
+            return jsonify({
+                'error': 'Every query must be a non-empty string',
+                'status': 'error'
+            }), 400
+
+        options, error = parse_query_options(data)
+        if error:
+            return error
+        max_concurrency = data.get('max_concurrency')
+        if not isinstance(max_concurrency, int) or max_concurrency < 1:
+            max_concurrency = None
+
+        logger.info(f"Processing batch of {len(queries)} queries")
+        rag = get_rag_pipeline()
+        results = rag.query_batch([q.strip() for q in queries], max_concurrency=max_concurrency, **options)
+
+        errors = sum(1 for r in results if r.get('status') == 'error')
+        return jsonify({
+            'results': results,
+            'count': len(results),
+            'errors': errors,
+            'timestamp': str(datetime.now()),
+            'n_results_requested': options['n_results'],
+            'status': 'success'
+        })
+
+    except Exception as e:
+        logger.error(f"Error processing batch query: {e}")
+        return jsonify({
+            'error': 'Internal server error while processing batch',
+            'status': 'error',
+            'details': str(e)
+        }), 500
+
+def overloaded_response(error: Overloaded):
+    """503 telling the client when to retry a query that was not admitted."""
+    logger.warning(f"Rejected query: {error}")
+    response = jsonify({
+        'error': 'Too many queries in progress, please retry shortly',
+        'status': 'overloaded',
+        'details': str(error),
+        'retry_after': error.retry_after
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@chatbot_bp.route('/query/stream', methods=['POST'])
+@cross_origin()
+def query_chatbot_stream():
+    """
+    Streaming variant of /query using server-sent events.
+
+    Accepts the same JSON payload as /query and emits a "sources" event
+    once retrieval finishes, "token" events as the answer is generated,
+    and a final "done" event with the complete result (or an "error" event).
+    """
+    params, error = parse_query_payload(request.get_json())
+    if error:
+        return error
+
+    logger.info(f"Processing streaming query: {params['user_query']}")
+    rag = get_rag_pipeline()
+    events = rag.query_stream(**params)
+    # The first event comes after admission, so a rejected query still gets a plain 503
+    first, failure = [], None
+    try:
+        first.append(next(events))
+    except StopIteration:
+        pass
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        failure = e
+
+    def generate():
+        try:
+            if failure:
+                raise failure
+            for event, data in itertools.chain(first, events):
+                if event == 'done':
+                    data['timestamp'] = str(datetime.now())
+                    data['n_results_requested'] = params['n_results']
+                yield format_sse(event, data)
+        except Exception as e:
+            logger.error(f"Error streaming chatbot query: {e}")
+            yield format_sse('error', {
+                'error': 'Internal server error while processing query',
+                'status': 'error',
+                'details': str(e)
+            })
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        # Keep proxies from buffering the stream
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @chatbot_bp.route('/status', methods=['GET'])
 @cross_origin()
 def get_status():
@@ -132,18 +368,12 @@ def get_status():
     try:
         status = {
             'system': 'operational',
-            'components': {}
+            'components': {},
+            'warmup': warmup.to_dict()
         }
         
-        # Check document processor
-        try:
-            processor = get_document_processor()
-            if processor:
-                status['components']['document_processor'] = 'loaded'
-            else:
-                status['components']['document_processor'] = 'not_loaded'
-        except Exception as e:
-            status['components']['document_processor'] = f'error: {str(e)}'
+        # Check document processor without loading it, a health check should not trigger ingestion setup
+        status['components']['document_processor'] = 'loaded' if document_processor else 'not_loaded'
         
         # Check RAG pipeline
         try:
@@ -152,13 +382,23 @@ def get_status():
                 status['components']['rag_pipeline'] = 'mock_mode'
             else:
                 status['components']['rag_pipeline'] = 'loaded'
+                if rag.answer_cache:
+                    status['answer_cache'] = rag.answer_cache.stats()
+                if rag.llm_client:
+                    status['llm'] = rag.llm_client.stats()
+                if rag.query_embedder:
+                    status['embedding_batcher'] = rag.query_embedder.stats()
+                if rag.single_flight:
+                    status['single_flight'] = rag.single_flight.stats()
+                if rag.admission:
+                    status['admission'] = rag.admission.stats()
         except Exception as e:
             status['components']['rag_pipeline'] = f'error: {str(e)}'
         
         # Check vector database
         try:
-            import chromadb
-            chroma_client = chromadb.PersistentClient(path="./chroma_db")
+            from model_registry import get_chroma_client
+            chroma_client = get_chroma_client("./chroma_db")
             collections = chroma_client.list_collections()
             if collections:
                 collection = chroma_client.get_collection("dafman_documents")
@@ -179,12 +419,38 @@ def get_status():
             'details': str(e)
         }), 500
 
+def get_ingestion_jobs():
+    """Lazy load the background ingestion job manager."""
+    global ingestion_jobs
+    if ingestion_jobs is None:
+        from ingestion_jobs import IngestionJobManager
+        ingestion_jobs = IngestionJobManager()
+    return ingestion_jobs
+
+def on_index_committed(result):
+    """Refresh pipeline state derived from the index once a new version is committed."""
+    logger.info(f"Document processing completed. Status: {result.get('status', 'unknown')}")
+    # The pipeline caches the section list and answers, refresh them against the new index
+    if rag_pipeline is not None and not isinstance(rag_pipeline, MockRAGPipeline):
+        rag_pipeline.invalidate_index_caches()
+
 @chatbot_bp.route('/process-document', methods=['POST'])
 @cross_origin()
 def process_document():
     """
-    Trigger document processing for the DAFMAN PDF.
-    This endpoint can be used to reprocess the document if needed.
+    Trigger document processing, by default for the DAFMAN PDF.
+    This endpoint can be used to reprocess documents or add new ones.
+
+    Accepts either a JSON payload naming a PDF or a directory of PDFs
+    inside RAG_DOCUMENTS_DIR, or PDFs uploaded as multipart `files`:
+    {
+        "path": "publications/",  # optional, defaults to the DAFMAN PDF
+        "metadata": {"source": "AFI 36-2606", "revision_date": "2022-06-01"}  # optional, single documents only
+    }
+
+    Processing runs as a background job; the response carries the job id
+    to poll at /process-document/<job_id>. Queries are served from the
+    previous index until each document commits.
     """
     try:
         processor = get_document_processor()
@@ -195,21 +461,45 @@ def process_document():
                 'status': 'error'
             }), 500
         
-        # Process the DAFMAN document
-        pdf_path = "../dafman36-2664.pdf"
+        from publications import iter_document_paths, resolve_document_path
+        uploads = request.files.getlist('files')
+        data = request.form if uploads else (request.get_json(silent=True) or {})
+        metadata = parse_document_metadata(data.get('metadata'))
+        if metadata is False:
+            return jsonify({
+                'error': 'metadata must be an object',
+                'status': 'error'
+            }), 400
         
-        if not os.path.exists(pdf_path):
+        if uploads:
+            pdf_paths = save_uploads(uploads)
+            label = f"upload: {', '.join(os.path.basename(path) for path in pdf_paths)}"
+        elif data.get('path'):
+            try:
+                label = resolve_document_path(data['path'])
+            except ValueError as e:
+                return jsonify({'error': str(e), 'status': 'error'}), 400
+            pdf_paths = list(iter_document_paths(label)) if os.path.exists(label) else []
+        else:
+            # Process the DAFMAN document
+            label = "../dafman36-2664.pdf"
+            pdf_paths = [label] if os.path.exists(label) else []
+        
+        if not pdf_paths:
             return jsonify({
-                'error': 'DAFMAN PDF file not found',
+                'error': 'No PDF files found',
                 'status': 'error'
             }), 404
         
-        logger.info("Starting document processing...")
-        result = processor.process_document(pdf_path)
-        
-        logger.info(f"Document processing completed. Status: {result.get('status', 'unknown')}")
+        logger.info(f"Starting document processing of {len(pdf_paths)} document(s)...")
+        job = get_ingestion_jobs().submit(
+            lambda _, job: processor.process_documents(pdf_paths, job, metadata), label,
+            on_success=on_index_committed
+        )
         
-        return jsonify(result)
+        response = job.to_dict()
+        response['status_url'] = f"{request.script_root}/api/chatbot/process-document/{job.id}"
+        return jsonify(response), 202
         
     except Exception as e:
         logger.error(f"Error processing document: {e}")
@@ -219,16 +509,87 @@ def process_document():
             'details': str(e)
         }), 500
 
+def parse_document_metadata(metadata):
+    """Document metadata overrides as a dict, None if absent, False if invalid."""
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            return False
+    if metadata is None or isinstance(metadata, dict):
+        return metadata
+    return False
+
+def save_uploads(uploads):
+    """Save uploaded PDFs into the uploads folder of the documents directory."""
+    from werkzeug.utils import secure_filename
+    from publications import DOCUMENTS_DIR
+    upload_dir = os.path.join(DOCUMENTS_DIR, 'uploads')
+    os.makedirs(upload_dir, exist_ok=True)
+    pdf_paths = []
+    for upload in uploads:
+        filename = secure_filename(upload.filename or '')
+        if not filename.lower().endswith('.pdf'):
+            continue
+        path = os.path.join(upload_dir, filename)
+        upload.save(path)
+        pdf_paths.append(path)
+    return pdf_paths
+
+@chatbot_bp.route('/process-document/jobs', methods=['GET'])
+@cross_origin()
+def list_processing_jobs():
+    """List recent document processing jobs, newest first."""
+    return jsonify({'jobs': [job.to_dict() for job in get_ingestion_jobs().list()]})
+
+@chatbot_bp.route('/process-document/<job_id>', methods=['GET'])
+@cross_origin()
+def get_processing_job(job_id):
+    """Report the stage, progress, throughput and ETA of a processing job."""
+    job = get_ingestion_jobs().get(job_id)
+    if not job:
+        return jsonify({
+            'error': 'Job not found',
+            'status': 'error'
+        }), 404
+    return jsonify(job.to_dict())
+
+@chatbot_bp.route('/process-document/<job_id>/cancel', methods=['POST'])
+@cross_origin()
+def cancel_processing_job(job_id):
+    """Cancel a processing job that has not started committing to the index."""
+    job = get_ingestion_jobs().get(job_id)
+    if not job:
+        return jsonify({
+            'error': 'Job not found',
+            'status': 'error'
+        }), 404
+    if not job.cancel():
+        return jsonify({
+            'error': f'Job can no longer be cancelled (stage: {job.stage})',
+            'status': 'error'
+        }), 409
+    return jsonify(job.to_dict()), 202
+
 @chatbot_bp.route('/health', methods=['GET'])
 @cross_origin()
 def health_check():
-    """Simple health check endpoint."""
+    """Liveness check: the process is up, whether or not it is warmed up."""
     return jsonify({
         'status': 'healthy',
         'service': 'rag-chatbot-api',
         'version': '1.0.0'
     })
 
+@chatbot_bp.route('/ready', methods=['GET'])
+@cross_origin()
+def readiness_check():
+    """Readiness check: 200 once models are loaded and one search completed."""
+    start_warmup()
+    state = warmup.to_dict()
+    state['status'] = 'ready' if warmup.ready else 'not_ready'
+    return jsonify(state), 200 if warmup.ready else 503
+
 # Error handlers
 @chatbot_bp.errorhandler(404)
 def not_found(error):
@@ -0,0 +1,187 @@
+"""
+Single-flight coalescing of identical in-flight queries.
+
+When many users ask the same question within seconds, only the first
+request embeds, retrieves and calls the LLM; requests with the same key
+arriving while it is in flight wait for its result instead of repeating
+the work. Nothing outlives the flight, so unlike the answer cache this
+never serves a stale answer.
+
+Streamed queries are produced by a background thread into a buffer that
+every waiting request replays and then follows live, so one client
+disconnecting does not cut the stream short for the others.
+"""
+
+import copy
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+from admission import Overloaded
+from metrics import COALESCED_REQUESTS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+COALESCE_ENABLED = os.environ.get("RAG_COALESCE", "1") == "1"
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class _StreamFlight:
+    def __init__(self):
+        self.events: List[Tuple[str, Any]] = []
+        self.finished = False
+        self.error = None
+        self.condition = threading.Condition()
+
+class SingleFlight:
+    def __init__(self):
+        """Share the work of identical concurrent calls."""
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._streams: Dict[Hashable, _StreamFlight] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run `function`, or wait for the identical call already running.
+
+        Returns:
+            (result, shared): shared is True when the result came from
+            another caller's flight; it is then a copy the caller may modify
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+        if not leader:
+            COALESCED_REQUESTS_TOTAL.inc(kind="query")
+            return self._wait(flight), True
+
+        try:
+            result = function()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            return result, False
+        finally:
+            with self._lock:
+                # Nobody joins once the flight is gone, so the waiter count is final
+                del self._flights[key]
+            if flight.error is None and flight.waiters:
+                # Waiters copy from a private copy, the leader's caller may modify the original
+                flight.result = copy.deepcopy(result)
+            flight.done.set()
+
+    def stream(self, key: Hashable, produce: Callable[[], Iterator[Tuple[str, Any]]],
+               mark_shared: Callable[[str, Any], Any] = None) -> Iterator[Tuple[str, Any]]:
+        """
+        Iterate a stream of (event, data) pairs, shared with identical concurrent streams.
+
+        Args:
+            key: Identifies identical streams
+            produce: Starts the stream; only called for the first of them
+            mark_shared: Applied to each event handed to a coalesced stream
+        """
+        with self._lock:
+            flight = self._streams.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._streams[key] = _StreamFlight()
+            else:
+                self.coalesced += 1
+        if leader:
+            threading.Thread(target=self._produce, args=(key, flight, produce),
+                             name="single-flight-stream", daemon=True).start()
+            return self._follow(flight, None)
+        COALESCED_REQUESTS_TOTAL.inc(kind="stream")
+        return self._follow(flight, mark_shared)
+
+    def join(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Wait for an identical do() call if one is in flight.
+
+        Returns:
+            (True, a copy of its result), or (False, None) when there is none
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                return False, None
+            flight.waiters += 1
+            self.coalesced += 1
+        COALESCED_REQUESTS_TOTAL.inc(kind="query")
+        return True, self._wait(flight)
+
+    def join_stream(self, key: Hashable) -> Optional[Iterator[Tuple[str, Any]]]:
+        """Follow an identical stream if one is in flight, else None."""
+        with self._lock:
+            flight = self._streams.get(key)
+            if flight is None:
+                return None
+            self.coalesced += 1
+        COALESCED_REQUESTS_TOTAL.inc(kind="stream")
+        return self._follow(flight, None)
+
+    @staticmethod
+    def _wait(flight: _Flight) -> Any:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return copy.deepcopy(flight.result)
+
+    @staticmethod
+    def _follow(flight: _StreamFlight, mark_shared: Callable[[str, Any], Any] = None) -> Iterator[Tuple[str, Any]]:
+        position = 0
+        while True:
+            with flight.condition:
+                while position == len(flight.events) and not flight.finished:
+                    flight.condition.wait()
+                events = flight.events[position:]
+                finished, error = flight.finished, flight.error
+            position += len(events)
+            for event, data in events:
+                # Every stream gets its own copy, consumers add fields to the final event
+                data = copy.deepcopy(data)
+                yield (event, data) if mark_shared is None else (event, mark_shared(event, data))
+            if finished and position == len(flight.events):
+                if error is not None:
+                    raise error
+                return
+
+    def _produce(self, key: Hashable, flight: _StreamFlight, produce: Callable[[], Iterator[Tuple[str, Any]]]):
+        try:
+            for event in produce():
+                with flight.condition:
+                    flight.events.append(event)
+                    flight.condition.notify_all()
+        except Overloaded as e:
+            # Load shedding, not a failure; every follower turns it into a 503
+            logger.debug(f"Shared stream not admitted: {e}")
+            flight.error = e
+        except Exception as e:
+            logger.error(f"Shared stream failed: {e}")
+            flight.error = e
+        finally:
+            with self._lock:
+                del self._streams[key]
+            with flight.condition:
+                flight.finished = True
+                flight.condition.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "in_flight": len(self._flights) + len(self._streams),
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,397 @@
+"""
+Vector store backends for retrieval.
+
+ChromaVectorStore wraps a ChromaDB collection. NumpyVectorStore keeps the
+whole collection in one contiguous matrix of normalized vectors and answers
+queries with an exact matrix product, which for a few thousand MiniLM vectors
+is faster than going through SQLite and HNSW. Both return results in the
+ChromaDB query format, with squared L2 distances like a default Chroma
+collection.
+
+NumpyVectorStore keeps the rows of each source document contiguous, so a
+search scoped to some publications scores only their rows and its latency
+does not grow with the rest of the corpus. It can also serve straight from a
+memory-mapped snapshot (see index_snapshot), without reading the database.
+"""
+
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Snapshots are served by the numpy backend
+VECTOR_BACKEND = os.environ.get("RAG_VECTOR_BACKEND", "numpy" if os.environ.get("RAG_SNAPSHOT_DIR") else "chroma")
+VECTOR_DTYPE = os.environ.get("RAG_VECTOR_DTYPE", "float32")
+VECTOR_INDEX_PATH = os.environ.get("RAG_VECTOR_INDEX_PATH")
+
+# Rows converted to float32 at a time when scoring a float16 matrix
+SCORE_BLOCK_ROWS = 65536
+
+class MetadataIndex:
+    """
+    Evaluates ChromaDB-style `where` filters over a fixed list of metadata.
+
+    Per-key value -> row masks are built lazily the first time a key is used
+    in a filter, so repeated filters cost a few vectorized mask operations.
+    """
+
+    def __init__(self, metadatas: List[Dict[str, Any]]):
+        self.metadatas = metadatas
+        self.size = len(metadatas)
+        self._masks: Dict[str, Dict[Any, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def mask(self, where: Dict[str, Any]) -> np.ndarray:
+        """Boolean mask of the rows matching a filter."""
+        mask = np.ones(self.size, dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self.mask(clause)
+                continue
+            if key == "$or":
+                any_mask = np.zeros(self.size, dtype=bool)
+                for clause in condition:
+                    any_mask |= self.mask(clause)
+                mask &= any_mask
+                continue
+
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            masks = self._value_masks(key)
+            for op, value in condition.items():
+                mask &= self._condition_mask(masks, op, value)
+        return mask
+
+    def _value_masks(self, key: str) -> Dict[Any, np.ndarray]:
+        masks = self._masks.get(key)
+        if masks is None:
+            with self._lock:
+                masks = self._masks.get(key)
+                if masks is None:
+                    rows_by_value: Dict[Any, List[int]] = {}
+                    for row, metadata in enumerate(self.metadatas):
+                        if metadata and key in metadata:
+                            rows_by_value.setdefault(metadata[key], []).append(row)
+                    masks = {}
+                    for value, rows in rows_by_value.items():
+                        mask = np.zeros(self.size, dtype=bool)
+                        mask[rows] = True
+                        masks[value] = mask
+                    self._masks[key] = masks
+        return masks
+
+    def _condition_mask(self, masks: Dict[Any, np.ndarray], op: str, value) -> np.ndarray:
+        empty = np.zeros(self.size, dtype=bool)
+        if op == "$eq":
+            return masks.get(value, empty)
+        if op == "$ne":
+            return ~masks.get(value, empty)
+        if op in ("$in", "$nin"):
+            selected = empty.copy()
+            for v in value:
+                if v in masks:
+                    selected |= masks[v]
+            return selected if op == "$in" else ~selected
+        compare = {
+            "$gt": lambda v: v > value,
+            "$gte": lambda v: v >= value,
+            "$lt": lambda v: v < value,
+            "$lte": lambda v: v <= value,
+        }.get(op)
+        if compare is None:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        selected = empty.copy()
+        for v, value_mask in masks.items():
+            if isinstance(v, (int, float)) and not isinstance(v, bool) and compare(v):
+                selected |= value_mask
+        return selected
+
+class ChromaVectorStore:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def query(self, query_embeddings, n_results: int = 5, where: Optional[Dict[str, Any]] = None) -> Dict[str, List[List[Any]]]:
+        return self.collection.query(
+            query_embeddings=[list(map(float, q)) for q in query_embeddings],
+            n_results=n_results,
+            where=where,
+            include=["documents", "metadatas", "distances"]
+        )
+
+    def metadatas(self) -> List[Dict[str, Any]]:
+        return self.collection.get(include=["metadatas"])["metadatas"]
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def get(self, ids: List[str]) -> Dict[str, List[Any]]:
+        """Fetch records by ID, in the ChromaDB get() format."""
+        return self.collection.get(ids=ids, include=["documents", "metadatas"])
+
+    def refresh(self):
+        """Chroma reads through to the database, nothing to reload."""
+
+class NumpyVectorStore:
+    def __init__(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+                 embeddings, dtype: str = "float32", source_collection=None):
+        """
+        Build an exact in-memory index.
+
+        Args:
+            ids: Record IDs
+            documents: Record texts
+            metadatas: Record metadata
+            embeddings: Matrix (or memory-mapped array) of record embeddings
+            dtype: "float32", or "float16" to halve memory
+            source_collection: ChromaDB collection to reload from on refresh()
+        """
+        self.dtype = np.dtype(dtype)
+        self.source_collection = source_collection
+        # Manifest of the snapshot the index was loaded from
+        self.manifest = None
+        self._index = self._build_index(ids, documents, metadatas, embeddings)
+
+    @classmethod
+    def from_collection(cls, collection, dtype: str = "float32") -> "NumpyVectorStore":
+        ids, documents, metadatas, embeddings = cls._read_collection(collection)
+        return cls(ids, documents, metadatas, embeddings, dtype=dtype, source_collection=collection)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, source_collection=None, model_name: str = None,
+             verify: bool = None) -> "NumpyVectorStore":
+        """
+        Load an index written by save(), memory-mapping the embeddings by default.
+
+        Args:
+            path: Snapshot directory
+            mmap: Map the embeddings instead of reading them into memory
+            source_collection: ChromaDB collection to reload from on refresh()
+            model_name: Embedding model queries are encoded with, must match the snapshot's
+            verify: Check the snapshot's checksums, defaults to RAG_SNAPSHOT_VERIFY
+
+        Raises:
+            ValueError: If `path` is not a snapshot, or it is incomplete, corrupted or from another model
+        """
+        # index_snapshot builds on this module, import it on use
+        from index_snapshot import MANIFEST_FILE, Snapshot
+        if not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+            raise ValueError(f"{path} is not an index snapshot (no {MANIFEST_FILE})")
+        snapshot = Snapshot(path, verify=verify)
+        snapshot_model = snapshot.manifest.get("model")
+        if model_name and snapshot_model and snapshot_model != model_name:
+            raise ValueError(f"Snapshot {path} was embedded with {snapshot_model}, not {model_name}")
+        store = cls.__new__(cls)
+        store.dtype = np.dtype(np.float16)
+        store.source_collection = source_collection
+        store.manifest = snapshot.manifest
+        # The snapshot's columns stand in for the lists _build_index makes; IDs are mapped to rows on first get()
+        store._index = {
+            "ids": snapshot.ids,
+            "documents": snapshot.documents,
+            "metadatas": snapshot.metadatas,
+            "matrix": snapshot.embeddings if mmap else np.array(snapshot.embeddings),
+            "filters": snapshot.filters(),
+            "rows": None,
+            "namespaces": snapshot.namespaces,
+            "scattered_sources": snapshot.scattered_sources,
+        }
+        return store
+
+    def save(self, path: str, model_name: str = None, collection_name: str = None):
+        """Write the index as a float16 snapshot (see index_snapshot)."""
+        from index_snapshot import write_snapshot
+        index = self._index
+        write_snapshot(path, list(index["ids"]), list(index["documents"]), list(index["metadatas"]),
+                       index["matrix"], model_name=model_name, collection_name=collection_name)
+
+    def refresh(self):
+        """Reload from the source collection after the index has been rebuilt."""
+        if self.source_collection is None:
+            return
+        index = self._build_index(*self._read_collection(self.source_collection))
+        # Swap in one assignment so concurrent queries see either version, never a mix
+        self._index = index
+        self.manifest = None
+        logger.info(f"Reloaded in-memory vector index with {len(index['ids'])} vectors")
+
+    def count(self) -> int:
+        return len(self._index["ids"])
+
+    def metadatas(self) -> List[Dict[str, Any]]:
+        return list(self._index["metadatas"])
+
+    def get(self, ids: List[str]) -> Dict[str, List[Any]]:
+        """Fetch records by ID, in the ChromaDB get() format (unknown IDs are skipped)."""
+        index = self._index
+        if index["rows"] is None:
+            index["rows"] = {record_id: row for row, record_id in enumerate(index["ids"])}
+        rows = [index["rows"][i] for i in ids if i in index["rows"]]
+        return {
+            "ids": [index["ids"][r] for r in rows],
+            "documents": [index["documents"][r] for r in rows],
+            "metadatas": [index["metadatas"][r] for r in rows],
+        }
+
+    def query(self, query_embeddings, n_results: int = 5, where: Optional[Dict[str, Any]] = None) -> Dict[str, List[List[Any]]]:
+        """
+        Exact top-k search for a batch of query embeddings.
+
+        Args:
+            query_embeddings: One embedding per query
+            n_results: Results per query
+            where: ChromaDB-style metadata filter
+
+        Returns:
+            Results in the ChromaDB query format
+        """
+        index = self._index
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+
+        rows, ranges = None, self._namespace_ranges(index, where)
+        if ranges is not None:
+            rows = np.concatenate([np.arange(start, stop) for start, stop in ranges] or [np.empty(0, dtype=np.int64)])
+        elif where:
+            rows = np.flatnonzero(index["filters"].mask(where))
+        candidates = len(index["ids"]) if rows is None else len(rows)
+        k = min(n_results, candidates)
+
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if k == 0:
+            for key in results:
+                results[key] = [[] for _ in range(len(queries))]
+            return results
+
+        if ranges is not None:
+            # Contiguous slices are views, nothing is copied out of the matrix
+            scores = np.concatenate([self._scores(index["matrix"][start:stop], queries, None)
+                                     for start, stop in ranges], axis=1)
+        else:
+            scores = self._scores(index["matrix"], queries, rows)
+        # argpartition finds the top k in linear time, only those k get sorted
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        if rows is not None:
+            top = rows[top]
+
+        for query_rows, query_scores in zip(top, top_scores):
+            results["ids"].append([index["ids"][r] for r in query_rows])
+            results["documents"].append([index["documents"][r] for r in query_rows])
+            results["metadatas"].append([index["metadatas"][r] for r in query_rows])
+            # Squared L2 between unit vectors, matching a default Chroma collection
+            results["distances"].append([float(max(0.0, 2.0 - 2.0 * s)) for s in query_scores])
+        return results
+
+    @staticmethod
+    def _namespace_ranges(index: Dict[str, Any], where: Optional[Dict[str, Any]]) -> Optional[List[Tuple[int, int]]]:
+        """Row ranges for a filter on nothing but the source document, None for any other filter."""
+        if not where or list(where) != ["source"]:
+            return None
+        condition = where["source"]
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        if list(condition) == ["$eq"]:
+            sources = [condition["$eq"]]
+        elif list(condition) == ["$in"]:
+            sources = list(dict.fromkeys(condition["$in"]))
+        else:
+            return None
+        namespaces = index["namespaces"]
+        if any(source in index["scattered_sources"] for source in sources):
+            return None
+        return [namespaces[source] for source in sources if source in namespaces]
+
+    def _scores(self, matrix, queries: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        if rows is not None:
+            return (np.asarray(matrix[rows], dtype=np.float32) @ queries.T).T
+        if matrix.dtype == np.float32:
+            return (matrix @ queries.T).T
+        # BLAS has no float16 kernels, score in float32 blocks
+        scores = np.empty((len(queries), matrix.shape[0]), dtype=np.float32)
+        for start in range(0, matrix.shape[0], SCORE_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + len(block)] = (block @ queries.T).T
+        return scores
+
+    def _build_index(self, ids, documents, metadatas, embeddings) -> Dict[str, Any]:
+        # Group rows by source document so each one is a contiguous slice
+        order = sorted(range(len(ids)), key=lambda row: str((metadatas[row] or {}).get("source", "")))
+        ids = [ids[row] for row in order]
+        documents = [documents[row] for row in order]
+        metadatas = [metadatas[row] for row in order]
+        if order:
+            matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(order), -1)[order]
+        else:
+            # An empty collection, e.g. the sections of a corpus without a table of contents
+            matrix = np.zeros((0, np.shape(embeddings)[-1] if np.ndim(embeddings) == 2 else 0), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = np.ascontiguousarray((matrix / np.where(norms == 0, 1, norms)).astype(self.dtype))
+        ids, metadatas = list(ids), list(metadatas)
+        namespaces, scattered = {}, set()
+        for row, metadata in enumerate(metadatas):
+            source = (metadata or {}).get("source")
+            start, stop = namespaces.get(source, (row, row))
+            if stop != row:
+                # Distinct sources with the same sort key (no source and "", 1 and "1") can interleave
+                scattered.add(source)
+            namespaces[source] = (start, row + 1)
+        return {
+            "ids": ids,
+            "documents": list(documents),
+            "metadatas": metadatas,
+            "matrix": matrix,
+            "filters": MetadataIndex(metadatas),
+            "rows": {record_id: row for row, record_id in enumerate(ids)},
+            "namespaces": namespaces,
+            "scattered_sources": scattered,
+        }
+
+    @staticmethod
+    def _read_collection(collection):
+        records = collection.get(include=["documents", "metadatas", "embeddings"])
+        return records["ids"], records["documents"], records["metadatas"], records["embeddings"]
+
+def create_vector_store(collection, backend: str = None, index_path: str = None, dtype: str = None,
+                        model_name: str = None):
+    """
+    Create the configured vector store for a ChromaDB collection.
+
+    Args:
+        collection: Collection the store serves (and reloads from)
+        backend: "chroma" or "numpy", defaults to RAG_VECTOR_BACKEND
+        index_path: Snapshot to memory-map instead of reading the collection
+        dtype: Matrix dtype for the numpy backend, defaults to RAG_VECTOR_DTYPE
+        model_name: Embedding model of the queries, a snapshot from another model is not used
+    """
+    backend = backend or VECTOR_BACKEND
+    if backend == "chroma":
+        return ChromaVectorStore(collection)
+    if backend == "numpy":
+        if index_path and os.path.exists(index_path):
+            try:
+                store = NumpyVectorStore.load(index_path, source_collection=collection, model_name=model_name)
+            except ValueError as e:
+                logger.error(f"Not using the vector index at {index_path}: {e}")
+            else:
+                logger.info(f"Memory-mapped vector index with {store.count()} vectors from {index_path}")
+                collection_count = collection.count()
+                if collection_count == 0:
+                    # Reloading from an empty database would drop the snapshot's records
+                    logger.warning(f"Collection {collection.name} is empty, serving {index_path} without "
+                                   f"reloading after ingestion; import the snapshot before ingesting here")
+                    store.source_collection = None
+                elif collection_count != store.count():
+                    logger.warning(f"{index_path} has {store.count()} vectors but collection {collection.name} has "
+                                   f"{collection_count}; serving the snapshot until the index is rebuilt")
+                return store
+        return NumpyVectorStore.from_collection(collection, dtype=dtype or VECTOR_DTYPE)
+    raise ValueError(f"Unknown vector backend: {backend}")
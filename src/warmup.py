@@ -0,0 +1,143 @@
+"""
+Per-worker warm-up and readiness.
+
+The first query after a deploy used to pay for loading the models and the
+indexes plus cold caches. A worker now warms up in the background as soon
+as it receives its first request (usually the load balancer's readiness
+probe): it loads the pipeline and runs a throwaway encode and search.
+/ready answers 503 until that is done, while /health keeps reporting
+liveness only. A failed warm-up (say, the model download timed out) is
+started again by the next request after RAG_WARMUP_RETRY_SECONDS.
+
+Precomputed answers for canonical questions cost one LLM call per question
+in every worker, so they are opt-in (RAG_PRECOMPUTE_QUESTIONS) and computed
+after the worker has become ready; a failure there never fails readiness.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.environ.get("RAG_WARMUP", "1") == "1"
+WARMUP_RETRY_SECONDS = float(os.environ.get("RAG_WARMUP_RETRY_SECONDS", "30"))
+# File with one canonical question per line, or "examples" for the example
+# questions of the web UI; unset (or "none") disables precomputed answers
+PRECOMPUTE_QUESTIONS = os.environ.get("RAG_PRECOMPUTE_QUESTIONS", "")
+
+INDEX_HTML = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "index.html")
+EXAMPLE_QUESTION_PATTERN = re.compile(r"setQuery\('((?:[^'\\]|\\.)+)'\)")
+
+def canonical_questions(source: str = None) -> List[str]:
+    """
+    Questions to precompute answers for.
+
+    Args:
+        source: Path to a file with one question per line, "examples" for
+            the example questions in static/index.html, "" or "none" for no
+            questions, or None for RAG_PRECOMPUTE_QUESTIONS
+    """
+    source = PRECOMPUTE_QUESTIONS if source is None else source
+    if not source or source.lower() == "none":
+        return []
+    try:
+        if source.lower() == "examples":
+            with open(INDEX_HTML, encoding="utf-8") as f:
+                questions = [q.replace("\\'", "'") for q in EXAMPLE_QUESTION_PATTERN.findall(f.read())]
+        else:
+            with open(source, encoding="utf-8") as f:
+                questions = [line.strip() for line in f]
+    except OSError as e:
+        logger.warning(f"Could not read canonical questions: {e}")
+        return []
+    return list(dict.fromkeys(q for q in questions if q and not q.startswith("#")))
+
+class Warmup:
+    def __init__(self, get_pipeline: Callable[[], Any]):
+        """
+        Warm-up state of this worker process.
+
+        Args:
+            get_pipeline: Returns the (lazily loaded) RAG pipeline
+        """
+        self.get_pipeline = get_pipeline
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.steps: Dict[str, Any] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.attempts = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start warming up in a background thread, once per process unless it failed."""
+        with self._lock:
+            # A worker forked from a preloading master starts its own warm-up
+            if self._pid == os.getpid():
+                if self.state != "failed" or time.time() - self.finished_at < WARMUP_RETRY_SECONDS:
+                    return
+            else:
+                self.attempts = 0
+            self._pid = os.getpid()
+            self.attempts += 1
+            self.state = "running"
+            self.error = None
+            self.steps = {}
+            self.started_at = time.time()
+            self.finished_at = None
+        threading.Thread(target=self.run, name="warmup", daemon=True).start()
+
+    def run(self):
+        """Warm up in the calling thread."""
+        self.started_at = self.started_at or time.time()
+        try:
+            start = time.perf_counter()
+            pipeline = self.get_pipeline()
+            if not getattr(pipeline, "is_ready", False) and self.attempts > 1 and hasattr(pipeline, "load_pipeline"):
+                # Loading failed on an earlier attempt, try again
+                pipeline.load_pipeline()
+            self.steps["load_seconds"] = round(time.perf_counter() - start, 3)
+            if not getattr(pipeline, "is_ready", False):
+                raise RuntimeError("RAG pipeline failed to load its models or database")
+            if WARMUP_ENABLED:
+                self.steps.update(pipeline.warm_up())
+            self.state = "ready"
+        except Exception as e:
+            logger.error(f"Warm-up failed: {e}")
+            self.state = "failed"
+            self.error = str(e)
+            return
+        finally:
+            self.finished_at = time.time()
+            logger.info(f"Warm-up {self.state} in {self.finished_at - self.started_at:.1f}s")
+        self.precompute(pipeline)
+
+    def precompute(self, pipeline: Any):
+        """Precompute answers for the canonical questions; the worker is already ready."""
+        questions = canonical_questions()
+        if not questions:
+            return
+        try:
+            self.steps["precomputed"] = pipeline.precompute_answers(questions)
+        except Exception as e:
+            logger.error(f"Precomputing answers failed: {e}")
+            self.steps["precompute_error"] = str(e)
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "error": self.error,
+            "attempts": self.attempts,
+            "steps": dict(self.steps),
+            "seconds": round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else None,
+        }
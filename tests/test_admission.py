@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+from admission import AdmissionController, Overloaded
+
+def hold_slot(controller):
+    """Take a slot in another thread; set the returned event to give it back."""
+    admitted, release = threading.Event(), threading.Event()
+
+    def hold():
+        with controller.slot():
+            admitted.set()
+            release.wait(5)
+
+    threading.Thread(target=hold, daemon=True).start()
+    assert admitted.wait(5)
+    return release
+
+def test_full_queue_rejects_with_retry_after():
+    controller = AdmissionController(max_concurrency=1, max_queue=0, max_wait_ms=1000)
+    release = hold_slot(controller)
+
+    with pytest.raises(Overloaded) as rejected:
+        with controller.slot():
+            pass
+    release.set()
+
+    assert rejected.value.reason == "queue_full"
+    assert rejected.value.retry_after >= 1
+    assert controller.stats()["rejected"]["queue_full"] == 1
+
+def test_waiting_too_long_rejects_and_leaves_the_queue():
+    controller = AdmissionController(max_concurrency=1, max_queue=4, max_wait_ms=20)
+    release = hold_slot(controller)
+
+    with pytest.raises(Overloaded) as rejected:
+        with controller.slot():
+            pass
+    release.set()
+
+    assert rejected.value.reason == "timeout"
+    stats = controller.stats()
+    assert stats["queued"] == 0
+    assert stats["rejected"]["timeout"] == 1
+
+@pytest.mark.parametrize("interruption", [TimeoutError, GeneratorExit, KeyboardInterrupt])
+def test_slot_is_released_when_the_call_is_interrupted(interruption):
+    controller = AdmissionController(max_concurrency=1, max_queue=0, max_wait_ms=0)
+
+    with pytest.raises(interruption):
+        with controller.slot():
+            assert controller.stats()["active"] == 1
+            raise interruption()
+
+    assert controller.stats()["active"] == 0
+    # The freed slot admits the next call at once
+    with controller.slot() as waited:
+        assert waited == 0.0
+
+def test_queued_call_gets_the_slot_once_it_is_released():
+    controller = AdmissionController(max_concurrency=1, max_queue=1, max_wait_ms=5000)
+    release = hold_slot(controller)
+    threading.Timer(0.02, release.set).start()
+
+    with controller.slot() as waited:
+        assert waited > 0
+        assert controller.stats()["queued"] == 0
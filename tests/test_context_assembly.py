@@ -0,0 +1,30 @@
+from context_assembly import TokenCounter, assemble_context
+
+class ExactCounter(TokenCounter):
+    """One token per word, as if a real tokenizer were loaded."""
+
+    exact = True
+
+    def count(self, text):
+        return len(text.split())
+
+def distinct_passages(count, words=50):
+    return [" ".join(f"p{i}w{j}" for j in range(words)) for i in range(count)]
+
+def test_estimated_counts_keep_a_safety_margin():
+    counter = TokenCounter(tokenizer="")
+    budget = 3 * counter.count(distinct_passages(1)[0])
+
+    context, stats = assemble_context(distinct_passages(3), token_budget=budget, counter=counter)
+
+    assert not stats["exact_token_count"]
+    assert stats["packing_budget"] < budget
+    # Three passages fill the whole budget, so only two fit within the margin
+    assert len(context) == 2
+    assert stats["context_tokens"] <= stats["packing_budget"]
+
+def test_exact_counts_use_the_whole_budget():
+    context, stats = assemble_context(distinct_passages(3), token_budget=150, counter=ExactCounter(tokenizer=""))
+
+    assert stats["packing_budget"] == 150
+    assert len(context) == 3
@@ -0,0 +1,60 @@
+import threading
+import time
+
+import pytest
+
+from embedding_batcher import EmbeddingBatcher
+
+class RecordingEncoder:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+def encode_concurrently(batcher, texts):
+    results = [None] * len(texts)
+
+    def encode(i):
+        results[i] = batcher.encode(texts[i])
+
+    threads = [threading.Thread(target=encode, args=(i,)) for i in range(len(texts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results
+
+def test_full_batch_flushes_without_waiting():
+    encoder = RecordingEncoder()
+    # The wait is far longer than the test, only a full batch can flush it
+    batcher = EmbeddingBatcher(encoder, max_batch_size=4, max_wait_ms=30_000)
+
+    start = time.perf_counter()
+    results = encode_concurrently(batcher, ["a", "bb", "ccc", "dddd"])
+
+    assert time.perf_counter() - start < 5
+    assert encoder.batches and len(encoder.batches[0]) == 4
+    assert results == [[1.0], [2.0], [3.0], [4.0]]
+    assert batcher.stats()["batches"] == 1
+
+def test_partial_batch_flushes_after_the_wait():
+    encoder = RecordingEncoder()
+    batcher = EmbeddingBatcher(encoder, max_batch_size=32, max_wait_ms=50)
+
+    start = time.perf_counter()
+    result = batcher.encode("query")
+
+    assert time.perf_counter() - start >= 0.04
+    assert result == [5.0]
+    assert encoder.batches == [["query"]]
+
+def test_encode_error_reaches_every_request():
+    def failing_encode(texts):
+        raise RuntimeError("model unavailable")
+
+    batcher = EmbeddingBatcher(failing_encode, max_batch_size=2, max_wait_ms=10)
+
+    with pytest.raises(RuntimeError, match="model unavailable"):
+        batcher.encode("query")
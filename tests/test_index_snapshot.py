@@ -0,0 +1,43 @@
+from index_snapshot import Snapshot, export_collection, verify_snapshot
+from vector_store import NumpyVectorStore
+
+class FakeCollection:
+    name = "dafman_sections"
+
+    def __init__(self, records):
+        self.records = records
+
+    def get(self, include=None):
+        return self.records
+
+def test_empty_collection_exports_and_loads(tmp_path):
+    # ChromaDB returns no embeddings at all for an empty collection
+    collection = FakeCollection({"ids": [], "documents": [], "metadatas": [], "embeddings": None})
+    path = str(tmp_path / "dafman_sections")
+
+    manifest = export_collection(collection, path, model_name="test-model")
+
+    assert manifest["count"] == 0
+    assert verify_snapshot(path)["count"] == 0
+    snapshot = Snapshot(path)
+    assert len(snapshot) == 0
+    assert snapshot.embeddings.shape == (0, 0)
+    store = NumpyVectorStore.load(path, model_name="test-model")
+    assert store.count() == 0
+    assert store.query([[1.0, 0.0]])["ids"] == [[]]
+
+def test_filters_keep_booleans_and_integers_apart(tmp_path):
+    path = str(tmp_path / "dafman_documents")
+    metadatas = [{"source": "a", "flag": True}, {"source": "a", "flag": 1}, {"source": "b", "flag": 2}]
+    export_collection(FakeCollection({"ids": ["t", "one", "two"], "documents": ["x", "y", "z"],
+                                      "metadatas": metadatas, "embeddings": [[1.0, 0.0]] * 3}), path)
+    store = NumpyVectorStore.load(path)
+
+    def matching(where):
+        return sorted(store.query([[1.0, 0.0]], n_results=3, where=where)["ids"][0])
+
+    assert matching({"flag": True}) == ["t"]
+    assert matching({"flag": 1}) == ["one"]
+    assert matching({"flag": {"$in": [True, 2]}}) == ["t", "two"]
+    assert matching({"flag": {"$ne": True}}) == ["one", "two"]
+    assert matching({"flag": {"$gte": 1}}) == ["one", "two"]
@@ -0,0 +1,55 @@
+import time
+
+import httpx
+import pytest
+
+from llm_client import CircuitOpenError, LLMClient, LLMTimeoutError
+
+MESSAGES = [{"role": "user", "content": "What is a PAS code?"}]
+
+def make_client(handler, **kwargs):
+    client = LLMClient(base_url="http://llm.test", api_key="test", breaker_threshold=2, breaker_cooldown=60, **kwargs)
+    client.http = httpx.Client(base_url="http://llm.test", transport=httpx.MockTransport(handler))
+    return client
+
+def hanging_upstream(request):
+    time.sleep(0.01)
+    raise httpx.ReadTimeout("no response", request=request)
+
+def test_hanging_upstream_opens_the_circuit():
+    client = make_client(hanging_upstream, max_retries=0)
+
+    for _ in range(2):
+        with pytest.raises(LLMTimeoutError):
+            client.chat(MESSAGES, timeout=1)
+
+    assert client.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        client.chat(MESSAGES, timeout=1)
+    assert client.stats()["timeouts"] == 2
+
+def test_deadline_passing_before_an_attempt_counts_as_a_failure():
+    calls = []
+
+    def upstream(request):
+        calls.append(request)
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+    client = make_client(upstream)
+
+    for _ in range(2):
+        with pytest.raises(LLMTimeoutError):
+            # The per-attempt deadline has passed before the request is sent
+            client.chat(MESSAGES, timeout=1e-9)
+
+    assert not calls
+    assert client.breaker.state == "open"
+
+def test_rejected_request_does_not_open_the_circuit():
+    client = make_client(lambda request: httpx.Response(400, json={"error": "bad request"}))
+
+    for _ in range(3):
+        with pytest.raises(Exception):
+            client.chat(MESSAGES, timeout=1)
+
+    assert client.breaker.state == "closed"
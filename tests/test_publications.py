@@ -0,0 +1,20 @@
+from publications import describe_publication, running_header_pattern
+
+def test_running_header_matches_printed_variants():
+    header = running_header_pattern("DAFMAN 36-2664")
+
+    for printed in ("DAFMAN 36-2664", "DAFMAN36-2664", "dafman 36 - 2664"):
+        assert header.sub("", f"Text {printed} more") == "Textmore"
+    # Another publication's number is body text, not this document's header
+    assert header.sub("", "See AFI 36-2606 for details") == "See AFI 36-2606 for details"
+    assert header.sub("", "DAFMAN 36-26640") == "DAFMAN 36-26640"
+
+def test_running_header_follows_the_document():
+    header = running_header_pattern(describe_publication("/docs/afi36-2606.pdf")["source"])
+
+    assert header.sub(" ", "end of page AFI36-2606 12 MAY 2022") == "end of page 12 MAY 2022"
+    assert header.sub(" ", "DAFMAN 36-2664") == "DAFMAN 36-2664"
+
+def test_no_header_without_a_publication_number():
+    assert running_header_pattern("handbook") is None
+    assert running_header_pattern(None) is None
@@ -0,0 +1,32 @@
+import time
+
+import rag_pipeline
+from rag_pipeline import RAGPipeline
+
+def make_pipeline(monkeypatch, budget_ms="15000", reserve_ms="500"):
+    monkeypatch.setenv("RAG_QUERY_BUDGET_MS", budget_ms)
+    monkeypatch.setenv("RAG_EXTRACTIVE_RESERVE_MS", reserve_ms)
+    # Only the budget arithmetic is under test, no models or database
+    monkeypatch.setattr(RAGPipeline, "load_pipeline", lambda self: None)
+    return RAGPipeline(retrieval_mode="flat")
+
+def test_reserve_is_kept_for_large_budgets(monkeypatch):
+    pipeline = make_pipeline(monkeypatch)
+
+    assert pipeline.generation_deadline(100.0) == 100.0 + 14.5
+    assert pipeline.generation_deadline(100.0, budget_ms=2000) == 100.0 + 1.5
+
+def test_reserve_is_capped_for_small_budgets(monkeypatch):
+    pipeline = make_pipeline(monkeypatch)
+
+    # A 400 ms budget keeps 300 ms for generation instead of none
+    deadline = pipeline.generation_deadline(100.0, budget_ms=400)
+
+    assert abs(deadline - (100.0 + 0.4 * (1 - rag_pipeline.EXTRACTIVE_RESERVE_FRACTION))) < 1e-9
+    assert pipeline.generation_timeout(pipeline.generation_deadline(time.perf_counter(), budget_ms=400)) > 0.25
+
+def test_zero_budget_means_no_deadline(monkeypatch):
+    pipeline = make_pipeline(monkeypatch, budget_ms="0")
+
+    assert pipeline.generation_deadline(100.0) is None
+    assert pipeline.generation_timeout(None) is None
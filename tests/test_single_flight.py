@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+from admission import Overloaded
+from single_flight import SingleFlight
+
+WAITERS = 8
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline, "timed out"
+        time.sleep(0.001)
+
+def run_identical_calls(flights, function):
+    """Call flights.do() from WAITERS threads at once; returns each thread's (result, shared) or exception."""
+    outcomes = [None] * WAITERS
+
+    def call(i):
+        try:
+            outcomes[i] = flights.do("same question", function)
+        except Exception as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(WAITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return outcomes
+
+def blocking_producer(flights, calls, outcome):
+    """Counts its calls and only finishes once every other caller has joined the flight."""
+    def produce():
+        calls.append(1)
+        wait_until(lambda: flights.stats()["coalesced"] == WAITERS - 1)
+        return outcome()
+    return produce
+
+def test_identical_calls_share_one_producer_call():
+    flights, calls = SingleFlight(), []
+
+    outcomes = run_identical_calls(flights, blocking_producer(flights, calls, lambda: {"response": "42"}))
+
+    assert len(calls) == 1
+    assert [result for result, _ in outcomes] == [{"response": "42"}] * WAITERS
+    assert sorted(shared for _, shared in outcomes) == [False] + [True] * (WAITERS - 1)
+    assert flights.stats()["in_flight"] == 0
+
+def test_producer_error_reaches_every_waiter():
+    flights, calls = SingleFlight(), []
+
+    def fail():
+        raise RuntimeError("LLM provider unreachable")
+
+    outcomes = run_identical_calls(flights, blocking_producer(flights, calls, fail))
+
+    assert len(calls) == 1
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+
+def test_shared_stream_rejection_reaches_every_follower():
+    flights, started = SingleFlight(), threading.Event()
+
+    def produce():
+        yield "token", "partial"
+        started.wait(5)
+        raise Overloaded("queue_full", 3)
+
+    leader = flights.stream("same question", produce)
+    follower = flights.join_stream("same question")
+    started.set()
+
+    for stream in (leader, follower):
+        with pytest.raises(Overloaded) as rejected:
+            list(stream)
+        assert rejected.value.retry_after == 3
@@ -0,0 +1,15 @@
+from rag_pipeline import RAGPipeline
+
+def test_keyword_only_hits_report_their_fused_score(monkeypatch):
+    monkeypatch.setattr(RAGPipeline, "load_pipeline", lambda self: None)
+    pipeline = RAGPipeline(retrieval_mode="hybrid")
+    retrieved = [
+        {"document": "Dense hit", "metadata": {"source": "a.pdf"}, "distance": 0.2, "score": 0.032},
+        {"document": "AF Form 1206", "metadata": {"source": "a.pdf"}, "distance": None, "score": 0.016},
+    ]
+
+    dense, keyword = pipeline.format_sources(retrieved)
+
+    assert dense["distance"] == 0.2
+    assert keyword["distance"] is None
+    assert keyword["score"] == 0.016
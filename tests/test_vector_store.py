@@ -0,0 +1,47 @@
+import pytest
+
+from vector_store import NumpyVectorStore
+
+class FakeCollection:
+    def __init__(self, records):
+        self.records = records
+
+    def get(self, include=None):
+        return self.records
+
+def test_empty_store_builds_and_answers_nothing():
+    store = NumpyVectorStore([], [], [], [])
+
+    assert store.count() == 0
+    assert store.query([[0.1, 0.2, 0.3]], n_results=5) == {
+        "ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+    assert store.query([[0.1, 0.2, 0.3]], where={"source": "DAFMAN 36-2664"})["ids"] == [[]]
+    assert store.get(["missing"])["ids"] == []
+
+def test_refresh_from_empty_collection():
+    collection = FakeCollection({"ids": ["a"], "documents": ["text"], "metadatas": [{"source": "s"}],
+                                 "embeddings": [[1.0, 0.0]]})
+    store = NumpyVectorStore.from_collection(collection)
+    assert store.count() == 1
+
+    # ChromaDB returns no embeddings at all for an empty collection
+    collection.records = {"ids": [], "documents": [], "metadatas": [], "embeddings": None}
+    store.refresh()
+
+    assert store.count() == 0
+    assert store.query([[1.0, 0.0]])["ids"] == [[]]
+
+def test_store_finds_nearest_record():
+    store = NumpyVectorStore(["a", "b"], ["first", "second"], [{"source": "s"}, {"source": "t"}],
+                             [[1.0, 0.0], [0.0, 1.0]])
+
+    results = store.query([[0.9, 0.1]], n_results=1)
+
+    assert results["ids"] == [["a"]]
+    assert store.query([[0.9, 0.1]], where={"source": "t"})["ids"] == [["b"]]
+
+def test_loading_a_directory_without_a_manifest_fails(tmp_path):
+    (tmp_path / "embeddings.npy").write_bytes(b"")
+
+    with pytest.raises(ValueError, match="not an index snapshot"):
+        NumpyVectorStore.load(str(tmp_path))
@@ -0,0 +1,91 @@
+import time
+
+import warmup
+from warmup import Warmup
+
+class FakePipeline:
+    is_ready = True
+
+    def __init__(self, fail_precompute=False):
+        self.fail_precompute = fail_precompute
+        self.precomputed = None
+
+    def warm_up(self):
+        return {"search_seconds": 0.0}
+
+    def precompute_answers(self, questions):
+        if self.fail_precompute:
+            raise ConnectionError("LLM provider unreachable")
+        self.precomputed = questions
+        return {"questions": len(questions)}
+
+def test_precompute_is_off_by_default(monkeypatch):
+    monkeypatch.setattr(warmup, "PRECOMPUTE_QUESTIONS", "")
+    pipeline = FakePipeline()
+
+    Warmup(lambda: pipeline).run()
+
+    assert pipeline.precomputed is None
+    assert warmup.canonical_questions() == []
+
+def test_example_questions_are_opt_in(monkeypatch):
+    monkeypatch.setattr(warmup, "PRECOMPUTE_QUESTIONS", "examples")
+    pipeline = FakePipeline()
+    state = Warmup(lambda: pipeline)
+
+    state.run()
+
+    assert state.ready
+    assert pipeline.precomputed
+    assert state.steps["precomputed"] == {"questions": len(pipeline.precomputed)}
+
+def test_precompute_failure_does_not_fail_readiness(monkeypatch, tmp_path):
+    questions = tmp_path / "questions.txt"
+    questions.write_text("# canonical questions\nWhat is a PAS code?\n")
+    monkeypatch.setattr(warmup, "PRECOMPUTE_QUESTIONS", str(questions))
+    state = Warmup(lambda: FakePipeline(fail_precompute=True))
+
+    state.run()
+
+    assert state.ready
+    assert state.error is None
+    assert "unreachable" in state.steps["precompute_error"]
+
+class FlakyPipeline(FakePipeline):
+    """Fails to load the first time, like a model download that timed out."""
+
+    is_ready = False
+
+    def load_pipeline(self):
+        self.is_ready = True
+
+def wait_while_running(state, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while state.state == "running":
+        assert time.perf_counter() < deadline, "warm-up did not finish"
+        time.sleep(0.001)
+
+def test_failed_warmup_is_started_again(monkeypatch):
+    monkeypatch.setattr(warmup, "PRECOMPUTE_QUESTIONS", "")
+    monkeypatch.setattr(warmup, "WARMUP_RETRY_SECONDS", 0)
+    state = Warmup(lambda pipeline=FlakyPipeline(): pipeline)
+
+    state.start()
+    wait_while_running(state)
+    assert state.state == "failed"
+
+    state.start()
+    wait_while_running(state)
+    assert state.ready
+    assert state.attempts == 2
+
+def test_failed_warmup_waits_before_retrying(monkeypatch):
+    monkeypatch.setattr(warmup, "WARMUP_RETRY_SECONDS", 60)
+    state = Warmup(lambda pipeline=FlakyPipeline(): pipeline)
+
+    state.start()
+    wait_while_running(state)
+    state.start()
+
+    assert state.state == "failed"
+    assert state.attempts == 1